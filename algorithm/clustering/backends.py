@@ -0,0 +1,213 @@
+import numpy as np
+from abc import ABC, abstractmethod
+from scipy.sparse.csgraph import connected_components
+from sklearn.cluster import DBSCAN
+from typing import List, Dict, Optional, Type
+import logging
+
+from algorithm.clustering.spatial_index import (
+    EARTH_RADIUS_KM, haversine_km, od_neighbor_graph, greedy_clique_clusters
+)
+from algorithm.trip_batch import TripBatch
+
+logger = logging.getLogger(__name__)
+
+
+class ClusteringBackend(ABC):
+    """
+    时间组空间聚类后端的基类
+
+    后端只负责对单个时间组内的请求做空间聚类，时间分组、预聚合、并行和结果组装
+    由EnhancedClustering完成。子类实现cluster方法并注册到CLUSTERING_BACKENDS。
+    """
+
+    name = None
+
+    def __init__(self, spatial_threshold=1.0, min_samples=2, neighbor_search='dense'):
+        """
+        参数:
+            spatial_threshold: 空间距离阈值（公里）
+            min_samples: 形成聚类的最小请求数
+            neighbor_search: 邻居搜索方式，只有greedy_clique后端区分'dense'和'balltree'
+        """
+        self.spatial_threshold = spatial_threshold
+        self.min_samples = min_samples
+        self.neighbor_search = neighbor_search
+
+    @abstractmethod
+    def cluster(self, time_group: TripBatch, weights: Optional[np.ndarray] = None) -> List[List[int]]:
+        """
+        对单个时间组聚类
+
+        参数:
+            time_group: 时间组内的列式出行请求
+            weights: 每个请求代表的原始请求数（预聚合后的超级请求），为None时均计为1
+
+        返回:
+            聚类列表，每个聚类为组内请求索引列表（噪声点不出现在任何聚类中）
+        """
+
+    @staticmethod
+    def _labels_to_clusters(labels: np.ndarray) -> List[List[int]]:
+        """
+        将标签数组（-1为噪声）转换为聚类索引列表，按聚类首个成员的位置排序
+        """
+        clusters = {}
+        for i, label in enumerate(labels.tolist()):
+            if label != -1:
+                clusters.setdefault(label, []).append(i)
+        return sorted(clusters.values(), key=lambda cluster: cluster[0])
+
+
+class GreedyCliqueBackend(ClusteringBackend):
+    """
+    贪心团聚类（原有行为）: 簇内任意两个请求的OD平均距离都不超过空间阈值
+    """
+
+    name = 'greedy_clique'
+
+    def cluster(self, time_group, weights=None):
+        if self.neighbor_search == 'balltree':
+            return self._cluster_indexed(time_group, weights)
+        return self._cluster_dense(time_group, weights)
+
+    def _cluster_dense(self, time_group: TripBatch, weights=None) -> List[List[int]]:
+        """
+        使用稠密距离矩阵执行贪心团聚类
+        """
+        # 计算组内请求之间的距离矩阵，使用起点和终点距离的平均值
+        n = len(time_group)
+        origin_lat, origin_lng = time_group.origin_lat, time_group.origin_lng
+        dest_lat, dest_lng = time_group.dest_lat, time_group.dest_lng
+        distance_matrix = (
+            haversine_km(origin_lat[:, None], origin_lng[:, None], origin_lat[None, :], origin_lng[None, :]) +
+            haversine_km(dest_lat[:, None], dest_lng[:, None], dest_lat[None, :], dest_lng[None, :])
+        ) / 2
+
+        clusters = []
+        used = set()
+
+        for i in range(n):
+            if i in used:
+                continue
+
+            cluster = [i]
+            for j in range(i+1, n):
+                if j in used:
+                    continue
+
+                # 检查j是否与当前簇中的所有点都满足距离条件
+                if all(distance_matrix[j][k] <= self.spatial_threshold for k in cluster):
+                    cluster.append(j)
+
+            size = len(cluster) if weights is None else int(weights[cluster].sum())
+            if size >= self.min_samples:
+                used.update(cluster)
+                clusters.append(cluster)
+
+        return clusters
+
+    def _cluster_indexed(self, time_group: TripBatch, weights=None) -> List[List[int]]:
+        """
+        使用空间索引构建稀疏邻接图后执行贪心团聚类，结果与稠密模式一致
+        """
+        graph = od_neighbor_graph(
+            time_group.origin_lat, time_group.origin_lng,
+            time_group.dest_lat, time_group.dest_lng,
+            self.spatial_threshold
+        )
+        return greedy_clique_clusters(graph, self.min_samples, weights)
+
+
+class HaversineDBSCANBackend(ClusteringBackend):
+    """
+    基于起点坐标的DBSCAN，使用BallTree和haversine度量
+
+    sklearn的haversine度量以弧度为单位，eps为空间阈值除以地球半径
+    """
+
+    name = 'dbscan'
+
+    def cluster(self, time_group, weights=None):
+        if len(time_group) == 0:
+            return []
+
+        dbscan = DBSCAN(
+            eps=self.spatial_threshold / EARTH_RADIUS_KM,
+            min_samples=self.min_samples,
+            metric='haversine',
+            algorithm='ball_tree'
+        )
+        features = np.radians(np.column_stack([time_group.origin_lat, time_group.origin_lng]))
+        labels = dbscan.fit_predict(features, sample_weight=weights)
+        return self._labels_to_clusters(labels)
+
+
+class ODDBSCANBackend(ClusteringBackend):
+    """
+    基于OD平均距离的DBSCAN
+
+    邻域定义与贪心团聚类相同（(起点距离 + 终点距离) / 2 <= 空间阈值），
+    邻域由BallTree稀疏邻接图给出，不计算完整距离矩阵。
+    核心点为邻域（含自身）请求数不少于min_samples的点，相连的核心点属于同一聚类，
+    非核心点归入其首个核心邻居所在的聚类。
+    """
+
+    name = 'od_dbscan'
+
+    def cluster(self, time_group, weights=None):
+        n = len(time_group)
+        if n == 0:
+            return []
+
+        graph = od_neighbor_graph(
+            time_group.origin_lat, time_group.origin_lng,
+            time_group.dest_lat, time_group.dest_lng,
+            self.spatial_threshold
+        )
+        weights = np.ones(n, dtype=np.int64) if weights is None else np.asarray(weights, dtype=np.int64)
+
+        # 邻域权重（含自身）
+        neighborhood = graph @ weights + weights
+        core = neighborhood >= self.min_samples
+        if not core.any():
+            return []
+
+        # 核心点之间的连通分量即为聚类
+        core_index = np.flatnonzero(core)
+        _, component = connected_components(graph[core_index][:, core_index], directed=False)
+        labels = np.full(n, -1, dtype=np.int64)
+        labels[core_index] = component
+
+        # 边界点归入首个核心邻居的聚类
+        indptr, indices = graph.indptr, graph.indices
+        for i in np.flatnonzero(~core).tolist():
+            neighbors = indices[indptr[i]:indptr[i + 1]]
+            core_neighbors = neighbors[core[neighbors]]
+            if len(core_neighbors):
+                labels[i] = labels[core_neighbors[0]]
+
+        return self._labels_to_clusters(labels)
+
+
+# 名称 -> 后端类，新增后端在此注册
+CLUSTERING_BACKENDS: Dict[str, Type[ClusteringBackend]] = {
+    backend.name: backend
+    for backend in (GreedyCliqueBackend, HaversineDBSCANBackend, ODDBSCANBackend)
+}
+
+
+def create_backend(name: str, **params) -> ClusteringBackend:
+    """
+    按名称创建聚类后端
+
+    参数:
+        name: 后端名称，见CLUSTERING_BACKENDS
+        params: 传给后端构造函数的参数
+
+    返回:
+        ClusteringBackend实例
+    """
+    if name not in CLUSTERING_BACKENDS:
+        raise ValueError(f"不支持的聚类后端: {name}，可选: {', '.join(CLUSTERING_BACKENDS)}")
+    return CLUSTERING_BACKENDS[name](**params)
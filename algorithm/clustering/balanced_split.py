@@ -0,0 +1,102 @@
+import numpy as np
+import math
+from typing import Optional
+import logging
+
+from algorithm.clustering.spatial_index import haversine_km
+from algorithm.clustering.od_aggregation import KM_PER_DEGREE_LAT
+
+logger = logging.getLogger(__name__)
+
+
+def _od_features_km(origin_lat, origin_lng, dest_lat, dest_lng) -> np.ndarray:
+    """
+    将起终点坐标投影为以公里为单位的 (n, 4) 局部平面坐标
+    """
+    scale = math.cos(math.radians(float(np.mean(np.concatenate([origin_lat, dest_lat])))))
+    return np.column_stack([
+        origin_lat * KM_PER_DEGREE_LAT,
+        origin_lng * KM_PER_DEGREE_LAT * scale,
+        dest_lat * KM_PER_DEGREE_LAT,
+        dest_lng * KM_PER_DEGREE_LAT * scale
+    ])
+
+
+def _within_radius(members, origin_lat, origin_lng, dest_lat, dest_lng, max_radius_km) -> bool:
+    """
+    检查成员的起点和终点到各自中心的距离是否都不超过最大半径
+    """
+    for lat, lng in ((origin_lat, origin_lng), (dest_lat, dest_lng)):
+        distance = haversine_km(lat[members], lng[members], lat[members].mean(), lng[members].mean())
+        if distance.max() > max_radius_km:
+            return False
+    return True
+
+
+def balanced_split(origin_lat, origin_lng, dest_lat, dest_lng,
+                   max_size: Optional[int] = None,
+                   max_radius_km: Optional[float] = None) -> np.ndarray:
+    """
+    沿主轴递归二分，把一个聚类拆分为大小和半径都受限的子聚类
+
+    每次对当前子集的OD平面坐标求主轴（4×4协方差矩阵的最大特征向量），按投影值
+    在与容量成比例的位置切分（argpartition，线性时间），直到子集请求数不超过max_size
+    且起终点到中心的距离都不超过max_radius_km。总复杂度O(n log n)，结果确定。
+
+    参数:
+        origin_lat, origin_lng, dest_lat, dest_lng: 聚类成员的起终点坐标数组（度）
+        max_size: 子聚类最大请求数，为None时不限制
+        max_radius_km: 子聚类最大半径（公里），为None时不限制
+
+    返回:
+        长度为n的子聚类标签数组，从0开始按首个成员的位置编号
+    """
+    origin_lat = np.asarray(origin_lat, dtype=np.float64)
+    origin_lng = np.asarray(origin_lng, dtype=np.float64)
+    dest_lat = np.asarray(dest_lat, dtype=np.float64)
+    dest_lng = np.asarray(dest_lng, dtype=np.float64)
+    n = len(origin_lat)
+    labels = np.zeros(n, dtype=np.int64)
+    if n == 0:
+        return labels
+
+    features = _od_features_km(origin_lat, origin_lng, dest_lat, dest_lng)
+    leaves = []
+    stack = [np.arange(n)]
+
+    while stack:
+        members = stack.pop()
+        size = len(members)
+
+        too_large = max_size is not None and size > max_size
+        too_wide = (
+            max_radius_km is not None and size > 1 and
+            not _within_radius(members, origin_lat, origin_lng, dest_lat, dest_lng, max_radius_km)
+        )
+        if not (too_large or too_wide):
+            leaves.append(members)
+            continue
+
+        # 主轴投影
+        points = features[members]
+        centered = points - points.mean(axis=0)
+        _, eigenvectors = np.linalg.eigh(centered.T @ centered)
+        projection = centered @ eigenvectors[:, -1]
+
+        # 按容量比例切分: 共需n_parts个子聚类时，左侧分得ceil(n_parts/2)份，请求数按份数比例分配，
+        # 各子聚类大小接近平均值（如17个请求、上限8时为6+6+5，而不是8+8+1）
+        if too_large:
+            n_parts = math.ceil(size / max_size)
+            split = math.ceil(size * math.ceil(n_parts / 2) / n_parts)
+        else:
+            split = size // 2
+        order = np.argpartition(projection, split - 1)
+        left, right = np.sort(members[order[:split]]), np.sort(members[order[split:]])
+        stack.append(right)
+        stack.append(left)
+
+    # 按首个成员的位置编号，保证标签与输入顺序一致
+    leaves.sort(key=lambda leaf: leaf[0])
+    for label, members in enumerate(leaves):
+        labels[members] = label
+    return labels
@@ -0,0 +1,110 @@
+import numpy as np
+from scipy.spatial import ConvexHull
+from typing import Dict, Any
+import logging
+
+from algorithm.clustering.spatial_index import haversine_km
+from algorithm.trip_batch import TripBatch
+
+logger = logging.getLogger(__name__)
+
+# 点数不少于该值时先求凸包，只在凸包顶点之间计算最大间距
+HULL_MIN_POINTS = 16
+
+
+def cluster_diameter_km(lat: np.ndarray, lng: np.ndarray, hull_min_points: int = HULL_MIN_POINTS) -> float:
+    """
+    计算点集的最大间距（公里）
+
+    小点集直接向量化计算全部点对；大点集在局部等距投影平面上求凸包，
+    最远点对必在凸包顶点之间，只需计算顶点间的距离。
+
+    参数:
+        lat, lng: 纬度/经度数组（度）
+        hull_min_points: 使用凸包的最小点数
+
+    返回:
+        最大间距（公里），少于2个点时为0
+    """
+    n = len(lat)
+    if n < 2:
+        return 0.0
+
+    if n >= hull_min_points:
+        # 局部等距投影: 经度按平均纬度的余弦缩放，使平面距离与球面距离近似成比例
+        x = lng * np.cos(np.radians(lat.mean()))
+        try:
+            vertices = ConvexHull(np.column_stack([x, lat])).vertices
+            lat, lng = lat[vertices], lng[vertices]
+        except Exception:
+            # 点共线或重合时凸包退化，退回到全部点对
+            pass
+
+    distance = haversine_km(lat[:, None], lng[:, None], lat[None, :], lng[None, :])
+    return float(distance.max())
+
+
+def compute_cluster_statistics(labels: np.ndarray, batch: TripBatch) -> Dict[int, Dict[str, Any]]:
+    """
+    用分组归约一次性计算所有聚类的统计量
+
+    参数:
+        labels: 每个请求的聚类ID，-1表示噪声点
+        batch: 与labels对齐的列式出行请求
+
+    返回:
+        字典，键为聚类ID（不含噪声点），值包含:
+            indices: 聚类成员在batch中的索引（保持原始顺序）
+            size, center_origin, center_destination, total_passengers,
+            earliest_index, latest_index: 最早/最晚出发请求在batch中的索引,
+            max_origin_distance, max_dest_distance
+    """
+    labels = np.asarray(labels, dtype=np.int64)
+    valid = np.flatnonzero(labels != -1)
+    if len(valid) == 0:
+        return {}
+
+    cluster_ids, inverse, sizes = np.unique(labels[valid], return_inverse=True, return_counts=True)
+
+    # 中心点与乘客数: 按聚类求和
+    def grouped_mean(values):
+        return np.bincount(inverse, weights=values[valid], minlength=len(cluster_ids)) / sizes
+
+    center_origin_lat = grouped_mean(batch.origin_lat)
+    center_origin_lng = grouped_mean(batch.origin_lng)
+    center_dest_lat = grouped_mean(batch.dest_lat)
+    center_dest_lng = grouped_mean(batch.dest_lng)
+    total_passengers = np.bincount(inverse, weights=batch.people_count[valid], minlength=len(cluster_ids))
+
+    # 按聚类稳定排序后，每个聚类的成员是一段连续区间
+    order = valid[np.argsort(inverse, kind='stable')]
+    bounds = np.concatenate([[0], np.cumsum(sizes)])
+
+    # 时间范围: 在每个区间内按出发时间取最小/最大
+    departure_ts = batch.departure_ts[order]
+    earliest = np.minimum.reduceat(departure_ts, bounds[:-1])
+    latest = np.maximum.reduceat(departure_ts, bounds[:-1])
+
+    statistics = {}
+    for k, cluster_id in enumerate(cluster_ids.tolist()):
+        members = order[bounds[k]:bounds[k + 1]]
+        member_ts = batch.departure_ts[members]
+        statistics[cluster_id] = {
+            'indices': members,
+            'size': int(sizes[k]),
+            'center_origin': {
+                'lat': float(center_origin_lat[k]),
+                'lng': float(center_origin_lng[k])
+            },
+            'center_destination': {
+                'lat': float(center_dest_lat[k]),
+                'lng': float(center_dest_lng[k])
+            },
+            'total_passengers': int(total_passengers[k]),
+            'earliest_index': int(members[np.argmax(member_ts == earliest[k])]),
+            'latest_index': int(members[np.argmax(member_ts == latest[k])]),
+            'max_origin_distance': cluster_diameter_km(batch.origin_lat[members], batch.origin_lng[members]),
+            'max_dest_distance': cluster_diameter_km(batch.dest_lat[members], batch.dest_lng[members])
+        }
+
+    return statistics
@@ -1,5 +1,5 @@
 import numpy as np
-from sklearn.cluster import DBSCAN, KMeans
+from sklearn.cluster import DBSCAN
 from typing import List, Dict, Any, Tuple
 import pandas as pd
 from datetime import datetime, timedelta
@@ -7,6 +7,15 @@ import math
 from geopy.distance import geodesic
 import logging
 import traceback
+import os
+from concurrent.futures import Executor, ProcessPoolExecutor
+
+from algorithm.clustering.spatial_index import EARTH_RADIUS_KM, haversine_km
+from algorithm.clustering.backends import create_backend
+from algorithm.clustering.balanced_split import balanced_split
+from algorithm.clustering.cluster_statistics import compute_cluster_statistics
+from algorithm.clustering.od_aggregation import aggregate_od
+from algorithm.trip_batch import TripBatch, to_epoch, parse_departure_time
 
 # 配置日志
 logging.basicConfig(
@@ -21,7 +30,14 @@ class EnhancedClustering:
                  time_window=30,          # 时间窗口（分钟）
                  min_samples=2,           # 最小样本数
                  max_cluster_radius=5.0,  # 最大聚类半径（公里）
-                 max_points_per_route=8   # 每条路线最大点数
+                 max_points_per_route=8,  # 每条路线最大点数
+                 neighbor_search='dense', # 邻居搜索方式: 'dense' 或 'balltree'
+                 n_jobs=1,                # 并行聚类时间组的进程数，-1表示使用全部CPU
+                 executor: Executor = None, # 外部提供的进程池，优先于n_jobs
+                 od_aggregation=False,    # 聚类前合并起终点和出发时间相近的请求
+                 aggregation_cell_km=0.1, # 预聚合网格边长（公里）
+                 aggregation_bucket_minutes=5, # 预聚合出发时间桶（分钟）
+                 backend='greedy_clique'  # 时间组空间聚类后端
                 ):
         """
         增强版聚类算法
@@ -32,24 +48,54 @@ class EnhancedClustering:
             min_samples: 最小样本数
             max_cluster_radius: 最大聚类半径（公里）
             max_points_per_route: 每条路线最大点数
+            neighbor_search: 邻居搜索方式。'dense' 计算完整的n×n距离矩阵；
+                'balltree' 使用空间索引只查找阈值内的请求对并存为稀疏图，聚类结果相同
+            n_jobs: 并行处理时间组的进程数。大于1（或为-1）时，各时间组以紧凑坐标数组的形式
+                分发到进程池，结果按时间组顺序合并，聚类ID与串行模式一致
+            executor: 外部进程池（如调度进程共享的ProcessPoolExecutor），提供后不再自建进程池
+            od_aggregation: 是否在时间组内先将起点网格、终点网格和出发时间桶相同的请求
+                合并为带权重的超级请求，只对超级请求聚类，最后再展开为原始请求
+            aggregation_cell_km: 预聚合网格边长（公里），应远小于spatial_threshold
+            aggregation_bucket_minutes: 预聚合出发时间桶宽度（分钟）
+            backend: 时间组空间聚类后端，见backends.CLUSTERING_BACKENDS:
+                'greedy_clique' 贪心团聚类（默认，原有行为，使用neighbor_search）；
+                'dbscan' 基于起点的haversine DBSCAN（BallTree）；
+                'od_dbscan' 基于OD平均距离的DBSCAN（稀疏邻接图）
         """
+        if neighbor_search not in ('dense', 'balltree'):
+            raise ValueError(f"不支持的邻居搜索方式: {neighbor_search}")
+        
         self.spatial_threshold = spatial_threshold
         self.time_window = time_window
         self.min_samples = min_samples
         self.max_cluster_radius = max_cluster_radius
         self.max_points_per_route = max_points_per_route
+        self.neighbor_search = neighbor_search
+        self.n_jobs = (os.cpu_count() or 1) if n_jobs == -1 else max(1, n_jobs)
+        self._executor = executor
+        self._owns_executor = False
+        self.od_aggregation = od_aggregation
+        self.aggregation_cell_km = aggregation_cell_km
+        self.aggregation_bucket_minutes = aggregation_bucket_minutes
+        self.backend = backend
+        self.clustering_backend = create_backend(
+            backend,
+            spatial_threshold=spatial_threshold,
+            min_samples=min_samples,
+            neighbor_search=neighbor_search
+        )
         
         # 初始化DBSCAN聚类器
-        # 空间阈值转换为度 (1公里约等于0.009度)
-        # 空间聚类参数
-        self.spatial_eps = spatial_threshold * 0.009
+        # haversine度量的输入和eps均为弧度: 空间阈值（公里）除以地球半径
+        self.spatial_eps = spatial_threshold / EARTH_RADIUS_KM
         self.spatial_clusterer = DBSCAN(
             eps=self.spatial_eps,
             min_samples=min_samples,
-            metric='haversine'
+            metric='haversine',
+            algorithm='ball_tree'
         )
         
-        logger.info(f"初始化增强版聚类算法: 空间阈值={spatial_threshold}公里, 时间窗口={time_window}分钟")
+        logger.info(f"初始化增强版聚类算法: 空间阈值={spatial_threshold}公里, 时间窗口={time_window}分钟, 聚类后端={backend}, 邻居搜索={neighbor_search}")
 
     def _filter_expired_requests(self, trips: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
         """
@@ -447,7 +493,8 @@ class EnhancedClustering:
                 dest_clusterer = DBSCAN(
                     eps=self.spatial_eps,
                     min_samples=self.min_samples,
-                    metric='haversine'
+                    metric='haversine',
+                    algorithm='ball_tree'
                 )
                 dest_labels = dest_clusterer.fit_predict(destination_features)
                 
@@ -591,27 +638,12 @@ class EnhancedClustering:
         for cluster_id, cluster_trips in final_clusters.items():
             # 如果聚类中的请求数大于每条线路最大点数，拆分为多个小聚类
             if len(cluster_trips) > self.max_points_per_route:
-                # 使用KMeans将这个大聚类拆分为多个小聚类
-                n_sub_clusters = math.ceil(len(cluster_trips) / self.max_points_per_route)
-                
-                # 结合起点和终点坐标
-                combined_features = []
-                for trip in cluster_trips:
-                    combined_features.append([
-                        trip['origin']['lat'],
-                        trip['origin']['lng'],
-                        trip['destination']['lat'],
-                        trip['destination']['lng']
-                    ])
-                
-                combined_features = np.array(combined_features)
-                
-                # 执行KMeans聚类
-                kmeans = KMeans(n_clusters=n_sub_clusters, random_state=42)
-                sub_labels = kmeans.fit_predict(combined_features)
+                # 沿主轴递归二分，使每个子聚类不超过每条线路最大点数
+                sub_labels = self._balanced_split(cluster_trips, max_size=self.max_points_per_route)
+                n_sub_clusters = int(sub_labels.max()) + 1
                 
                 # 将拆分结果合并到最终结果中
-                for trip, sub_label in zip(cluster_trips, sub_labels):
+                for trip, sub_label in zip(cluster_trips, sub_labels.tolist()):
                     trip_copy = trip.copy()
                     trip_copy['final_cluster_id'] = next_cluster_id + sub_label
                     split_clustered_trips.append(trip_copy)
@@ -687,56 +719,189 @@ class EnhancedClustering:
                 adjusted_trips.extend(cluster_trips)
                 logger.info(f"聚类 {cluster_id} 满足距离约束")
             else:
-                # 聚类无效，尝试拆分
-                if len(cluster_trips) > 2:
-                    # 使用KMeans拆分为2个子聚类
-                    combined_features = []
-                    for trip in cluster_trips:
-                        combined_features.append([
-                            trip['origin']['lat'],
-                            trip['origin']['lng'],
-                            trip['destination']['lat'],
-                            trip['destination']['lng']
-                        ])
-                    
-                    kmeans = KMeans(n_clusters=2, random_state=42)
-                    sub_labels = kmeans.fit_predict(np.array(combined_features))
-                    
-                    # 更新聚类ID
-                    for trip, sub_label in zip(cluster_trips, sub_labels):
-                        trip_copy = trip.copy()
-                        trip_copy['final_cluster_id'] = next_cluster_id + sub_label
-                        adjusted_trips.append(trip_copy)
-                    
-                    logger.info(f"聚类 {cluster_id} 被拆分为2个子聚类")
-                    next_cluster_id += 2
-                else:
-                    # 对于只有2个点的聚类，标记为噪声点
-                    for trip in cluster_trips:
-                        trip_copy = trip.copy()
-                        trip_copy['final_cluster_id'] = -1
-                        adjusted_trips.append(trip_copy)
-                    logger.info(f"聚类 {cluster_id} 被标记为噪声点")
+                # 聚类无效，沿主轴递归二分直到每个子聚类都满足半径约束
+                sub_labels = self._balanced_split(cluster_trips, max_radius_km=self.max_cluster_radius)
+                sizes = np.bincount(sub_labels)
+                
+                # 只剩单个请求的子聚类无法成团，标记为噪声点
+                for trip, sub_label in zip(cluster_trips, sub_labels.tolist()):
+                    trip_copy = trip.copy()
+                    trip_copy['final_cluster_id'] = next_cluster_id + sub_label if sizes[sub_label] > 1 else -1
+                    adjusted_trips.append(trip_copy)
+                
+                logger.info(f"聚类 {cluster_id} 被拆分为 {int((sizes > 1).sum())} 个子聚类, "
+                            f"{int((sizes == 1).sum())} 个请求被标记为噪声点")
+                next_cluster_id += len(sizes)
         
-        # 添加原来的噪声点
+        # 添加原来的噪声点（上面只处理了有效聚类，不会重复）
         for trip in clustered_trips:
             if trip['final_cluster_id'] == -1:
-                if trip not in adjusted_trips:
-                    adjusted_trips.append(trip)
+                adjusted_trips.append(trip)
         
         return adjusted_trips
 
+    def _balanced_split(self, cluster_trips, max_size=None, max_radius_km=None) -> np.ndarray:
+        """
+        对单个聚类执行主轴递归二分拆分
+        
+        参数:
+            cluster_trips: 聚类内的出行请求列表
+            max_size: 子聚类最大请求数
+            max_radius_km: 子聚类最大半径（公里）
+            
+        返回:
+            与cluster_trips对齐的子聚类标签数组
+        """
+        return balanced_split(
+            [t['origin']['lat'] for t in cluster_trips],
+            [t['origin']['lng'] for t in cluster_trips],
+            [t['destination']['lat'] for t in cluster_trips],
+            [t['destination']['lng'] for t in cluster_trips],
+            max_size=max_size,
+            max_radius_km=max_radius_km
+        )
+
+    def _cluster_time_group(self, time_group: TripBatch, weights: np.ndarray = None):
+        """
+        使用配置的聚类后端对单个时间组聚类
+        
+        参数:
+            time_group: 时间组内的列式出行请求
+            weights: 每个请求代表的原始请求数（预聚合后的超级请求），为None时均计为1
+            
+        返回:
+            聚类列表，每个聚类为组内请求索引列表
+        """
+        return self.clustering_backend.cluster(time_group, weights)
+
+    def _worker_params(self) -> Tuple:
+        """
+        进程池工作进程重建聚类器所需的参数（可哈希，用于工作进程内缓存）
+        """
+        return (
+            ('spatial_threshold', self.spatial_threshold),
+            ('time_window', self.time_window),
+            ('min_samples', self.min_samples),
+            ('max_cluster_radius', self.max_cluster_radius),
+            ('max_points_per_route', self.max_points_per_route),
+            ('neighbor_search', self.neighbor_search),
+            ('backend', self.backend)
+        )
+
+    def _get_executor(self) -> Executor:
+        """
+        获取进程池，未提供外部进程池时按n_jobs懒创建并在多次调用间复用
+        """
+        if self._executor is None:
+            self._executor = ProcessPoolExecutor(max_workers=self.n_jobs)
+            self._owns_executor = True
+            logger.info(f"创建聚类进程池: {self.n_jobs} 个进程")
+        return self._executor
+
+    def close(self):
+        """
+        关闭自建的进程池
+        """
+        if self._owns_executor and self._executor is not None:
+            self._executor.shutdown()
+            self._executor = None
+            self._owns_executor = False
+
+    def _cluster_time_groups(self, batch: TripBatch, time_groups: List[np.ndarray]) -> List[List[List[int]]]:
+        """
+        对所有时间组执行空间聚类，可选地并行
+        
+        参数:
+            batch: 列式出行请求
+            time_groups: 时间组索引数组列表
+            
+        返回:
+            与time_groups一一对应的聚类列表（组内索引）
+        """
+        groups = [batch.take(group) for group in time_groups]
+        
+        # 起终点预聚合: 每个时间组内只对超级请求聚类
+        aggregations = None
+        if self.od_aggregation:
+            aggregations = [
+                aggregate_od(group, self.aggregation_cell_km, self.aggregation_bucket_minutes)
+                for group in groups
+            ]
+            groups = [aggregation.batch for aggregation in aggregations]
+            logger.info(f"预聚合后进入空间聚类的点数: {sum(len(g) for g in groups)} (原始 {len(batch)})")
+        
+        def group_weights(k):
+            return aggregations[k].weights if aggregations is not None else None
+        
+        if (self.n_jobs == 1 and self._executor is None) or len(time_groups) < 2:
+            group_clusters = [self._cluster_time_group(group, group_weights(k)) for k, group in enumerate(groups)]
+        else:
+            executor = self._get_executor()
+            params = self._worker_params()
+            
+            # 每个时间组只传输 (n, 4) 的起终点坐标数组
+            futures = [
+                executor.submit(
+                    _cluster_time_group_worker,
+                    params,
+                    np.column_stack([group.origin_lat, group.origin_lng, group.dest_lat, group.dest_lng]),
+                    group_weights(k)
+                )
+                for k, group in enumerate(groups)
+            ]
+            
+            # 按提交顺序收集结果，保证聚类ID的分配顺序与串行模式一致
+            group_clusters = [future.result() for future in futures]
+        
+        if aggregations is not None:
+            group_clusters = [
+                aggregation.expand(clusters)
+                for aggregation, clusters in zip(aggregations, group_clusters)
+            ]
+        return group_clusters
+
+    def _group_by_time_window_indices(self, batch: TripBatch) -> List[np.ndarray]:
+        """
+        按时间窗口对列式请求分组（保持输入顺序），丢弃请求数小于最小样本数的组
+        
+        参数:
+            batch: 列式出行请求
+            
+        返回:
+            时间组列表，每个时间组为batch中的请求索引数组
+        """
+        time_groups = []
+        current_group = [0]
+        window_seconds = self.time_window * 60
+        departure_ts = batch.departure_ts.tolist()
+        start_ts = departure_ts[0]
+        
+        for i in range(1, len(departure_ts)):
+            if departure_ts[i] - start_ts <= window_seconds:
+                current_group.append(i)
+            else:
+                if len(current_group) >= self.min_samples:
+                    time_groups.append(np.array(current_group))
+                current_group = [i]
+                start_ts = departure_ts[i]
+        
+        # 添加最后一组
+        if len(current_group) >= self.min_samples:
+            time_groups.append(np.array(current_group))
+        
+        return time_groups
+
     def cluster_trips(self, trips):
         """
         对出行请求进行增强聚类
         
         参数:
-            trips: 出行请求列表
+            trips: 出行请求列表，或列式的TripBatch
             
         返回:
             聚类后的出行请求列表
         """
-        if not trips:
+        if trips is None or len(trips) == 0:
             logger.warning("没有请求可供聚类")
             return []
         
@@ -745,26 +910,15 @@ class EnhancedClustering:
         logger.info("=====================================================")
         
         try:
-            # 步骤1: 按时间窗口分组
-            time_groups = []
-            current_group = [trips[0]]
-            start_time = datetime.fromisoformat(trips[0]['departure_time'].replace('Z', '+00:00'))
+            # 转换为列式表示，出发时间只解析一次
+            batch = trips if isinstance(trips, TripBatch) else TripBatch.from_records(trips)
             
-            for trip in trips[1:]:
-                trip_time = datetime.fromisoformat(trip['departure_time'].replace('Z', '+00:00'))
-                time_diff = (trip_time - start_time).total_seconds() / 60
-                
-                if time_diff <= self.time_window:
-                    current_group.append(trip)
-                else:
-                    if len(current_group) >= self.min_samples:
-                        time_groups.append(current_group)
-                    current_group = [trip]
-                    start_time = trip_time
+            def materialize(i):
+                # 字典输入保留原始字段（如origin中的name），列式输入按列还原
+                return batch.record(i) if isinstance(trips, TripBatch) else trips[i].copy()
             
-            # 添加最后一组
-            if len(current_group) >= self.min_samples:
-                time_groups.append(current_group)
+            # 步骤1: 按时间窗口分组
+            time_groups = self._group_by_time_window_indices(batch)
             
             logger.info(f"\n时间分组结果: {len(time_groups)} 个时间组")
             for i, group in enumerate(time_groups):
@@ -779,65 +933,18 @@ class EnhancedClustering:
             all_clusters = []
             cluster_id = 0
             
-            for time_group in time_groups:
-                logger.info(f"\n处理时间组: {len(time_group)} 个请求")
-                
-                # 计算组内请求之间的距离矩阵
-                n = len(time_group)
-                distance_matrix = np.zeros((n, n))
-                
-                for i in range(n):
-                    for j in range(i+1, n):
-                        # 计算起点和终点的距离
-                        origin_dist = self._haversine_distance(
-                            time_group[i]['origin']['lat'],
-                            time_group[i]['origin']['lng'],
-                            time_group[j]['origin']['lat'],
-                            time_group[j]['origin']['lng']
-                        )
-                        dest_dist = self._haversine_distance(
-                            time_group[i]['destination']['lat'],
-                            time_group[i]['destination']['lng'],
-                            time_group[j]['destination']['lat'],
-                            time_group[j]['destination']['lng']
-                        )
-                        # 使用起点和终点距离的加权平均
-                        distance = (origin_dist + dest_dist) / 2
-                        distance_matrix[i][j] = distance
-                        distance_matrix[j][i] = distance
-                
-                # 找出距离在阈值内的请求对
-                clusters = []
-                used = set()
+            group_clusters = self._cluster_time_groups(batch, time_groups)
+            
+            for group_indices, clusters in zip(time_groups, group_clusters):
+                logger.info(f"\n处理时间组: {len(group_indices)} 个请求")
                 
-                for i in range(n):
-                    if i in used:
-                        continue
-                        
-                    cluster = [i]
-                    for j in range(i+1, n):
-                        if j in used:
-                            continue
-                        
-                        # 检查j是否与当前簇中的所有点都满足距离条件
-                        can_add = True
-                        for k in cluster:
-                            if distance_matrix[j][k] > self.spatial_threshold:
-                                can_add = False
-                                break
-                        
-                        if can_add:
-                            cluster.append(j)
-                    
-                    if len(cluster) >= self.min_samples:
-                        used.update(cluster)
-                        clusters.append(cluster)
+                n = len(group_indices)
                 
                 # 将索引转换为实际的请求
                 for cluster_indices in clusters:
                     cluster_trips = []
                     for idx in cluster_indices:
-                        trip = time_group[idx].copy()
+                        trip = materialize(int(group_indices[idx]))
                         trip['cluster_id'] = cluster_id
                         cluster_trips.append(trip)
                     
@@ -846,9 +953,10 @@ class EnhancedClustering:
                     cluster_id += 1
                 
                 # 处理未分配的请求（噪声点）
+                used = {idx for cluster_indices in clusters for idx in cluster_indices}
                 for i in range(n):
                     if i not in used:
-                        trip = time_group[i].copy()
+                        trip = materialize(int(group_indices[i]))
                         trip['cluster_id'] = -1
                         all_clusters.append(trip)
             
@@ -920,6 +1028,19 @@ class EnhancedClustering:
         logger.info(f"其中噪声点组: {1 if -1 in clusters else 0}")
         logger.info(f"有效聚类组: {len(clusters) - (1 if -1 in clusters else 0)}")
         
+        # 一次性构建列式数据并用分组归约计算所有聚类的统计量
+        batch = TripBatch(
+            request_id=[trip.get('request_id', -1) for trip in clustered_trips],
+            origin_lat=[trip['origin']['lat'] for trip in clustered_trips],
+            origin_lng=[trip['origin']['lng'] for trip in clustered_trips],
+            dest_lat=[trip['destination']['lat'] for trip in clustered_trips],
+            dest_lng=[trip['destination']['lng'] for trip in clustered_trips],
+            departure_ts=[to_epoch(trip['departure_time']) for trip in clustered_trips],
+            people_count=[trip.get('people_count', 1) for trip in clustered_trips]
+        )
+        labels = np.array([trip.get('cluster_id', -1) for trip in clustered_trips], dtype=np.int64)
+        numeric_stats = compute_cluster_statistics(labels, batch)
+        
         # 计算每个聚类的中心点和时间范围
         for cluster_id, stats in clusters.items():
             logger.info(f"\n=====================================================")
@@ -934,92 +1055,56 @@ class EnhancedClustering:
             logger.info(f"- 时间组: {stats['time_group']}")
             
             if cluster_id != -1:  # 排除噪声点
-                # 计算中心点
-                origin_lats = [o['lat'] for o in stats['origins']]
-                origin_lngs = [o['lng'] for o in stats['origins']]
-                dest_lats = [d['lat'] for d in stats['destinations']]
-                dest_lngs = [d['lng'] for d in stats['destinations']]
+                numeric = numeric_stats[cluster_id]
                 
-                stats['center_origin'] = {
-                    'lat': sum(origin_lats) / len(origin_lats),
-                    'lng': sum(origin_lngs) / len(origin_lngs)
-                }
-                stats['center_destination'] = {
-                    'lat': sum(dest_lats) / len(dest_lats),
-                    'lng': sum(dest_lngs) / len(dest_lngs)
-                }
-                
-                # 将中心点信息添加到每个trip中
-                for trip in stats['trips']:
-                    trip['center_origin'] = stats['center_origin']
-                    trip['center_destination'] = stats['center_destination']
+                # 中心点只保存在聚类级别，路线规划从聚类数据中读取
+                stats['center_origin'] = numeric['center_origin']
+                stats['center_destination'] = numeric['center_destination']
                 
                 logger.info(f"\n空间信息:")
                 logger.info(f"- 起点中心: ({stats['center_origin']['lat']:.6f}, {stats['center_origin']['lng']:.6f})")
                 logger.info(f"- 终点中心: ({stats['center_destination']['lat']:.6f}, {stats['center_destination']['lng']:.6f})")
                 
-                # 计算时间范围
-                times = [datetime.fromisoformat(t.replace('Z', '+00:00')) for t in stats['departure_times']]
+                # 时间范围: 只需解析最早和最晚的两个出发时间
                 stats['time_range'] = {
-                    'start': min(times).isoformat(),
-                    'end': max(times).isoformat()
+                    'start': parse_departure_time(clustered_trips[numeric['earliest_index']]['departure_time']).isoformat(),
+                    'end': parse_departure_time(clustered_trips[numeric['latest_index']]['departure_time']).isoformat()
                 }
                 
                 logger.info(f"\n时间信息:")
                 logger.info(f"- 最早出发: {stats['time_range']['start']}")
                 logger.info(f"- 最晚出发: {stats['time_range']['end']}")
                 
-                # 计算请求总人数
-                stats['total_passengers'] = sum([t.get('people_count', 1) for t in stats['trips']])
+                # 请求总人数
+                stats['total_passengers'] = numeric['total_passengers']
                 logger.info(f"\n乘客信息:")
                 logger.info(f"- 总乘客数: {stats['total_passengers']}")
                 logger.info(f"- 平均每个请求乘客数: {stats['total_passengers']/stats['size']:.1f}")
                 
-                # 计算起始点最大间距
-                max_origin_distance = 0
-                for i, o1 in enumerate(stats['origins']):
-                    for j, o2 in enumerate(stats['origins']):
-                        if i != j:
-                            dist = self._haversine_distance(o1['lat'], o1['lng'], o2['lat'], o2['lng'])
-                            max_origin_distance = max(max_origin_distance, dist)
-                
-                stats['max_origin_distance'] = max_origin_distance
-                
-                # 计算终点最大间距
-                max_dest_distance = 0
-                for i, d1 in enumerate(stats['destinations']):
-                    for j, d2 in enumerate(stats['destinations']):
-                        if i != j:
-                            dist = self._haversine_distance(d1['lat'], d1['lng'], d2['lat'], d2['lng'])
-                            max_dest_distance = max(max_dest_distance, dist)
-                
-                stats['max_dest_distance'] = max_dest_distance
+                # 起点和终点最大间距（大聚类使用凸包直径）
+                stats['max_origin_distance'] = numeric['max_origin_distance']
+                stats['max_dest_distance'] = numeric['max_dest_distance']
                 
                 logger.info(f"\n距离信息:")
                 logger.info(f"- 起点最大间距: {stats['max_origin_distance']:.2f}公里")
                 logger.info(f"- 终点最大间距: {stats['max_dest_distance']:.2f}公里")
                 
                 # 打印每个请求的详细信息
+                members = numeric['indices']
+                origin_dists = haversine_km(
+                    batch.origin_lat[members], batch.origin_lng[members],
+                    stats['center_origin']['lat'], stats['center_origin']['lng']
+                )
+                dest_dists = haversine_km(
+                    batch.dest_lat[members], batch.dest_lng[members],
+                    stats['center_destination']['lat'], stats['center_destination']['lng']
+                )
                 logger.info(f"\n请求详细信息:")
-                for i, trip in enumerate(stats['trips']):
+                for i, (trip, origin_dist, dest_dist) in enumerate(zip(stats['trips'], origin_dists, dest_dists)):
                     logger.info(f"\n  请求 {i+1}:")
                     logger.info(f"  - 请求ID: {trip.get('request_id', 'unknown')}")
                     logger.info(f"  - 乘客数: {trip.get('people_count', 1)}")
                     logger.info(f"  - 出发时间: {trip['departure_time']}")
-                    
-                    # 计算到聚类中心的距离
-                    origin_dist = self._haversine_distance(
-                        trip['origin']['lat'], 
-                        trip['origin']['lng'],
-                        stats['center_origin']['lat'],
-                        stats['center_origin']['lng']
-                    )
-                    dest_dist = self._haversine_distance(
-                        trip['destination']['lat'],
-                        trip['destination']['lng'],
-                        stats['center_destination']['lat'],
-                        stats['center_destination']['lng']
-                    )
                     logger.info(f"  - 到聚类中心距离: 起点={origin_dist:.2f}公里, 终点={dest_dist:.2f}公里")
             
             else:  # 噪声点组的统计
@@ -1036,4 +1121,37 @@ class EnhancedClustering:
         logger.info("聚类统计完成")
         logger.info("=====================================================")
         
-        return clusters 
\ No newline at end of file
+        return clusters
+
+
+# 工作进程内按参数缓存的聚类器，避免每个时间组重复初始化
+_worker_clusterers = {}
+
+
+def _cluster_time_group_worker(params: Tuple, coords: np.ndarray, weights: np.ndarray = None) -> List[List[int]]:
+    """
+    进程池中执行的时间组聚类
+    
+    参数:
+        params: EnhancedClustering._worker_params() 返回的参数
+        coords: (n, 4) 数组，列依次为起点纬度、起点经度、终点纬度、终点经度
+        weights: 每个点代表的原始请求数，为None时均计为1
+        
+    返回:
+        聚类列表，每个聚类为组内请求索引列表
+    """
+    clusterer = _worker_clusterers.get(params)
+    if clusterer is None:
+        clusterer = EnhancedClustering(**dict(params))
+        _worker_clusterers[params] = clusterer
+    
+    n = len(coords)
+    time_group = TripBatch(
+        request_id=np.arange(n),
+        origin_lat=coords[:, 0],
+        origin_lng=coords[:, 1],
+        dest_lat=coords[:, 2],
+        dest_lng=coords[:, 3],
+        departure_ts=np.zeros(n, dtype=np.int64)
+    )
+    return clusterer._cluster_time_group(time_group, weights)
@@ -0,0 +1,323 @@
+import numpy as np
+from scipy.sparse import csr_matrix
+from typing import List, Dict, Any, Tuple, Union
+import logging
+import time
+
+from algorithm.clustering.spatial_index import haversine_km, greedy_clique_clusters
+from algorithm.trip_batch import TripBatch
+
+logger = logging.getLogger(__name__)
+
+
+class IncrementalClustering:
+    def __init__(self,
+                 spatial_threshold=1.0,    # 空间距离阈值（公里）
+                 time_window=30,          # 时间窗口（分钟）
+                 min_samples=2            # 最小样本数
+                ):
+        """
+        增量在线聚类
+
+        在调度周期之间常驻内存，保存未分配请求、请求间的邻接关系以及每个时间组的聚类结果。
+        每个周期只为新到达的请求计算邻居、只重新聚类成员发生变化的时间组，
+        其余时间组直接复用上一周期的结果。聚类规则与EnhancedClustering.cluster_trips一致
+        （请求按出发时间、请求ID排序后分组）。
+
+        参数:
+            spatial_threshold: 空间距离阈值（公里）
+            time_window: 时间窗口（分钟）
+            min_samples: 最小样本数
+        """
+        self.spatial_threshold = spatial_threshold
+        self.time_window = time_window
+        self.min_samples = min_samples
+
+        # 列式保存的当前请求，按插入顺序存放
+        self._ids = np.empty(0, dtype=np.int64)
+        self._origin_lat = np.empty(0, dtype=np.float64)
+        self._origin_lng = np.empty(0, dtype=np.float64)
+        self._dest_lat = np.empty(0, dtype=np.float64)
+        self._dest_lng = np.empty(0, dtype=np.float64)
+        self._departure_ts = np.empty(0, dtype=np.int64)
+
+        # 请求ID -> 原始请求字典（用于输出）及用于检测修改的签名
+        self._records: Dict[int, Dict[str, Any]] = {}
+        self._signatures: Dict[int, Tuple] = {}
+
+        # 请求ID -> 相邻请求ID集合（OD平均距离不超过空间阈值）
+        self._neighbors: Dict[int, set] = {}
+
+        # 时间组成员元组 -> 组内聚类结果（请求ID列表）
+        self._group_clusters: Dict[Tuple[int, ...], List[List[int]]] = {}
+
+        # 早于该时间出发的请求视为过期，不再接收
+        self._retired_before = None
+
+        logger.info(f"初始化增量聚类: 空间阈值={spatial_threshold}公里, 时间窗口={time_window}分钟")
+
+    def __len__(self) -> int:
+        return len(self._ids)
+
+    @staticmethod
+    def _signature(batch: TripBatch, i: int) -> Tuple:
+        return (
+            float(batch.origin_lat[i]), float(batch.origin_lng[i]),
+            float(batch.dest_lat[i]), float(batch.dest_lng[i]),
+            int(batch.departure_ts[i]), int(batch.people_count[i])
+        )
+
+    def _invalidate(self, request_ids: set):
+        """
+        丢弃包含指定请求的时间组聚类结果
+
+        请求被修改后以相同ID重新插入时，时间组的成员元组可能不变，但邻接关系已经变化，
+        因此凡是包含被移除或插入请求的组都必须重新聚类
+        """
+        stale = [member_ids for member_ids in self._group_clusters
+                 if not request_ids.isdisjoint(member_ids)]
+        for member_ids in stale:
+            del self._group_clusters[member_ids]
+
+    def insert(self, trips: Union[List[Dict[str, Any]], TripBatch]) -> int:
+        """
+        插入新提交的请求，只为新请求计算与时间窗口内已有请求的邻接关系
+
+        参数:
+            trips: 新请求列表或TripBatch；已存在的请求ID会先被移除再重新插入
+
+        返回:
+            实际插入的请求数
+        """
+        batch = trips if isinstance(trips, TripBatch) else TripBatch.from_records(trips)
+        indices = np.arange(len(batch))
+        if self._retired_before is not None:
+            indices = np.flatnonzero(batch.departure_ts >= self._retired_before)
+        if len(indices) == 0:
+            return 0
+
+        records = [batch.record(i) if isinstance(trips, TripBatch) else trips[i] for i in indices.tolist()]
+        batch = batch.take(indices)
+
+        existing = [int(rid) for rid in batch.request_id if int(rid) in self._records]
+        if existing:
+            self.remove(existing)
+
+        new_ids = batch.request_id
+        window_seconds = self.time_window * 60
+        n_old = len(self._ids)
+
+        self._ids = np.concatenate([self._ids, new_ids])
+        self._origin_lat = np.concatenate([self._origin_lat, batch.origin_lat])
+        self._origin_lng = np.concatenate([self._origin_lng, batch.origin_lng])
+        self._dest_lat = np.concatenate([self._dest_lat, batch.dest_lat])
+        self._dest_lng = np.concatenate([self._dest_lng, batch.dest_lng])
+        self._departure_ts = np.concatenate([self._departure_ts, batch.departure_ts])
+
+        self._invalidate(set(new_ids.tolist()))
+        for i, rid in enumerate(new_ids.tolist()):
+            self._records[rid] = records[i]
+            self._signatures[rid] = self._signature(batch, i)
+            self._neighbors[rid] = set()
+
+        # 只有出发时间相差不超过时间窗口的请求才可能落入同一时间组
+        order = np.argsort(self._departure_ts, kind='stable')
+        sorted_ts = self._departure_ts[order]
+        pair_count = 0
+        for k in range(n_old, len(self._ids)):
+            lo = np.searchsorted(sorted_ts, self._departure_ts[k] - window_seconds, side='left')
+            hi = np.searchsorted(sorted_ts, self._departure_ts[k] + window_seconds, side='right')
+            candidates = order[lo:hi]
+            # 新请求之间的配对只计算一次
+            candidates = candidates[(candidates < n_old) | (candidates > k)]
+            if len(candidates) == 0:
+                continue
+
+            distance = (
+                haversine_km(self._origin_lat[k], self._origin_lng[k],
+                             self._origin_lat[candidates], self._origin_lng[candidates]) +
+                haversine_km(self._dest_lat[k], self._dest_lng[k],
+                             self._dest_lat[candidates], self._dest_lng[candidates])
+            ) / 2
+            pair_count += len(candidates)
+
+            rid = int(self._ids[k])
+            for other in self._ids[candidates[distance <= self.spatial_threshold]].tolist():
+                self._neighbors[rid].add(other)
+                self._neighbors[other].add(rid)
+
+        logger.info(f"增量聚类插入 {len(new_ids)} 个请求, 计算 {pair_count} 对距离, 当前请求数 {len(self._ids)}")
+        return len(new_ids)
+
+    def remove(self, request_ids) -> int:
+        """
+        移除已分配或已取消的请求
+
+        参数:
+            request_ids: 请求ID列表
+
+        返回:
+            实际移除的请求数
+        """
+        remove_ids = {int(rid) for rid in request_ids if int(rid) in self._records}
+        if not remove_ids:
+            return 0
+
+        self._invalidate(remove_ids)
+        for rid in remove_ids:
+            for other in self._neighbors.pop(rid):
+                if other not in remove_ids:
+                    self._neighbors[other].discard(rid)
+            del self._records[rid]
+            del self._signatures[rid]
+
+        keep = ~np.isin(self._ids, np.fromiter(remove_ids, dtype=np.int64))
+        self._ids = self._ids[keep]
+        self._origin_lat = self._origin_lat[keep]
+        self._origin_lng = self._origin_lng[keep]
+        self._dest_lat = self._dest_lat[keep]
+        self._dest_lng = self._dest_lng[keep]
+        self._departure_ts = self._departure_ts[keep]
+
+        logger.info(f"增量聚类移除 {len(remove_ids)} 个请求, 当前请求数 {len(self._ids)}")
+        return len(remove_ids)
+
+    def retire_before(self, epoch_seconds: int) -> int:
+        """
+        淘汰出发时间早于指定时间的过期请求，之后也不再接收这些请求
+
+        参数:
+            epoch_seconds: 过期时间点（与TripBatch.departure_ts同一时间基准）
+
+        返回:
+            淘汰的请求数
+        """
+        self._retired_before = epoch_seconds if self._retired_before is None else max(self._retired_before, epoch_seconds)
+        expired = self._ids[self._departure_ts < self._retired_before]
+        return self.remove(expired.tolist())
+
+    def sync(self, trips: Union[List[Dict[str, Any]], TripBatch]) -> Dict[str, int]:
+        """
+        将内部状态同步为当前的待处理请求集合
+
+        不在集合中的请求被移除，新请求或内容发生变化的请求被（重新）插入，其余请求保持不变。
+
+        参数:
+            trips: 当前全部待处理请求（列表或TripBatch）
+
+        返回:
+            同步统计信息
+        """
+        batch = trips if isinstance(trips, TripBatch) else TripBatch.from_records(trips)
+        current_ids = set(batch.request_id.tolist())
+
+        removed = self.remove([rid for rid in self._records if rid not in current_ids])
+
+        changed = []
+        for i, rid in enumerate(batch.request_id.tolist()):
+            if self._signatures.get(rid) != self._signature(batch, i):
+                changed.append(i)
+        inserted = 0
+        if changed:
+            if isinstance(trips, TripBatch):
+                inserted = self.insert(batch.take(changed))
+            else:
+                inserted = self.insert([trips[i] for i in changed])
+
+        return {'inserted': inserted, 'removed': removed, 'total': len(self._ids)}
+
+    def _time_groups(self) -> List[np.ndarray]:
+        """
+        按出发时间、请求ID排序后按时间窗口分组，丢弃请求数小于最小样本数的组
+        """
+        if len(self._ids) == 0:
+            return []
+
+        order = np.lexsort((self._ids, self._departure_ts))
+        departure_ts = self._departure_ts[order].tolist()
+        window_seconds = self.time_window * 60
+
+        groups = []
+        start = 0
+        start_ts = departure_ts[0]
+        for i in range(1, len(departure_ts)):
+            if departure_ts[i] - start_ts > window_seconds:
+                if i - start >= self.min_samples:
+                    groups.append(order[start:i])
+                start = i
+                start_ts = departure_ts[i]
+        if len(departure_ts) - start >= self.min_samples:
+            groups.append(order[start:])
+
+        return groups
+
+    def _cluster_group(self, member_ids: Tuple[int, ...]) -> List[List[int]]:
+        """
+        使用已保存的邻接关系对单个时间组执行贪心团聚类
+        """
+        position = {rid: i for i, rid in enumerate(member_ids)}
+        rows, cols = [], []
+        for i, rid in enumerate(member_ids):
+            for other in self._neighbors[rid]:
+                j = position.get(other)
+                if j is not None:
+                    rows.append(i)
+                    cols.append(j)
+
+        n = len(member_ids)
+        graph = csr_matrix((np.ones(len(rows), dtype=np.int8), (rows, cols)), shape=(n, n))
+        graph.sort_indices()
+        clusters = greedy_clique_clusters(graph, self.min_samples)
+        return [[member_ids[i] for i in cluster] for cluster in clusters]
+
+    def cluster_trips(self) -> List[Dict[str, Any]]:
+        """
+        返回当前请求集合的聚类结果，格式与EnhancedClustering.cluster_trips一致
+
+        只有成员发生变化或包含被修改请求的时间组会重新聚类
+
+        返回:
+            聚类后的出行请求列表
+        """
+        start = time.time()
+        groups = self._time_groups()
+
+        group_clusters = {}
+        recomputed = 0
+        for group in groups:
+            member_ids = tuple(self._ids[group].tolist())
+            clusters = self._group_clusters.get(member_ids)
+            if clusters is None:
+                clusters = self._cluster_group(member_ids)
+                recomputed += 1
+            group_clusters[member_ids] = clusters
+
+        # 只保留当前仍存在的时间组，过期的组结果随之释放
+        self._group_clusters = group_clusters
+
+        all_clusters = []
+        cluster_id = 0
+        for member_ids, clusters in group_clusters.items():
+            used = set()
+            for cluster in clusters:
+                for rid in cluster:
+                    trip = self._records[rid].copy()
+                    trip['cluster_id'] = cluster_id
+                    all_clusters.append(trip)
+                used.update(cluster)
+                cluster_id += 1
+
+            for rid in member_ids:
+                if rid not in used:
+                    trip = self._records[rid].copy()
+                    trip['cluster_id'] = -1
+                    all_clusters.append(trip)
+
+        logger.info(f"增量聚类完成: {len(groups)} 个时间组, 重新聚类 {recomputed} 个, "
+                    f"有效聚类 {cluster_id} 个, 耗时 {time.time() - start:.3f}秒")
+
+        if cluster_id == 0:
+            logger.warning("没有形成有效的聚类")
+            return []
+
+        return all_clusters
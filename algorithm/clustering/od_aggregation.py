@@ -0,0 +1,109 @@
+import numpy as np
+from typing import List
+import logging
+
+from algorithm.trip_batch import TripBatch
+
+logger = logging.getLogger(__name__)
+
+# 1度纬度对应的距离（公里）
+KM_PER_DEGREE_LAT = 111.32
+
+
+class ODAggregation:
+    def __init__(self, batch: TripBatch, weights: np.ndarray, members: List[np.ndarray]):
+        """
+        起终点预聚合结果
+
+        参数:
+            batch: 聚合后的超级请求，坐标为成员均值，出发时间取最早成员，
+                people_count为成员人数之和，request_id为首个成员的请求ID
+            weights: 每个超级请求包含的原始请求数
+            members: 每个超级请求的成员在原始输入中的索引（保持原始顺序）
+        """
+        self.batch = batch
+        self.weights = weights
+        self.members = members
+
+    def __len__(self) -> int:
+        return len(self.batch)
+
+    def expand(self, clusters: List[List[int]]) -> List[List[int]]:
+        """
+        将超级请求上的聚类结果展开为原始请求索引
+
+        参数:
+            clusters: 聚类列表，每个聚类为超级请求索引列表
+
+        返回:
+            聚类列表，每个聚类为原始请求索引列表（升序）
+        """
+        return [
+            sorted(int(i) for k in cluster for i in self.members[k])
+            for cluster in clusters
+        ]
+
+
+def aggregate_od(batch: TripBatch, cell_size_km: float = 0.1, time_bucket_minutes: int = 5) -> ODAggregation:
+    """
+    将起点网格、终点网格和出发时间桶都相同的请求合并为一个带权重的超级请求
+
+    网格按纬度方向cell_size_km划分，经度方向按批次平均纬度的余弦缩放，
+    使网格在地面上近似为正方形。超级请求按首个成员在输入中的位置排序，
+    因此贪心聚类的遍历顺序与未聚合时一致。
+
+    参数:
+        batch: 列式出行请求
+        cell_size_km: 网格边长（公里），应远小于聚类空间阈值
+        time_bucket_minutes: 出发时间桶宽度（分钟）
+
+    返回:
+        ODAggregation
+    """
+    n = len(batch)
+    if n == 0:
+        return ODAggregation(batch, np.empty(0, dtype=np.int64), [])
+
+    lat_step = cell_size_km / KM_PER_DEGREE_LAT
+    mean_lat = np.concatenate([batch.origin_lat, batch.dest_lat]).mean()
+    lng_step = lat_step / max(np.cos(np.radians(mean_lat)), 1e-6)
+
+    keys = np.column_stack([
+        np.floor(batch.origin_lat / lat_step),
+        np.floor(batch.origin_lng / lng_step),
+        np.floor(batch.dest_lat / lat_step),
+        np.floor(batch.dest_lng / lng_step),
+        batch.departure_ts // (time_bucket_minutes * 60)
+    ]).astype(np.int64)
+
+    _, first_index, inverse = np.unique(keys, axis=0, return_index=True, return_inverse=True)
+    inverse = inverse.reshape(-1)
+
+    # 按首个成员的位置重新编号，保持输入顺序
+    rank = np.empty(len(first_index), dtype=np.int64)
+    rank[np.argsort(first_index, kind='stable')] = np.arange(len(first_index))
+    labels = rank[inverse]
+    m = len(first_index)
+
+    weights = np.bincount(labels, minlength=m)
+    order = np.argsort(labels, kind='stable')
+    members = np.split(order, np.cumsum(weights)[:-1])
+
+    def grouped_mean(values):
+        return np.bincount(labels, weights=values, minlength=m) / weights
+
+    departure_ts = np.full(m, np.iinfo(np.int64).max, dtype=np.int64)
+    np.minimum.at(departure_ts, labels, batch.departure_ts)
+
+    aggregated = TripBatch(
+        request_id=batch.request_id[np.sort(first_index)],
+        origin_lat=grouped_mean(batch.origin_lat),
+        origin_lng=grouped_mean(batch.origin_lng),
+        dest_lat=grouped_mean(batch.dest_lat),
+        dest_lng=grouped_mean(batch.dest_lng),
+        departure_ts=departure_ts,
+        people_count=np.bincount(labels, weights=batch.people_count, minlength=m).astype(np.int32)
+    )
+
+    logger.info(f"起终点预聚合: {n} 个请求合并为 {m} 个超级请求")
+    return ODAggregation(aggregated, weights, members)
@@ -0,0 +1,126 @@
+import numpy as np
+from scipy.sparse import csr_matrix
+from sklearn.neighbors import BallTree
+from typing import List, Optional
+import logging
+
+logger = logging.getLogger(__name__)
+
+# 地球半径（公里），与EnhancedClustering._haversine_distance保持一致
+EARTH_RADIUS_KM = 6371
+
+
+def haversine_km(lat1, lng1, lat2, lng2):
+    """
+    向量化计算Haversine距离（公里）
+
+    参数均可为标量或可广播的NumPy数组（单位：度）
+    """
+    lat1, lng1, lat2, lng2 = map(np.radians, (lat1, lng1, lat2, lng2))
+    dlat = lat2 - lat1
+    dlng = lng2 - lng1
+    a = np.sin(dlat / 2) ** 2 + np.cos(lat1) * np.cos(lat2) * np.sin(dlng / 2) ** 2
+    return 2 * np.arcsin(np.sqrt(a)) * EARTH_RADIUS_KM
+
+
+def od_neighbor_graph(origin_lat, origin_lng, dest_lat, dest_lng, threshold_km) -> csr_matrix:
+    """
+    基于BallTree构建起终点邻接稀疏图
+
+    两个请求相邻当且仅当 (起点距离 + 终点距离) / 2 <= threshold_km。
+    由于两项距离均非负，相邻请求的起点距离必然 <= 2 * threshold_km，
+    因此先在起点BallTree上做半径查询获取候选对，再精确计算OD距离过滤。
+
+    参数:
+        origin_lat, origin_lng: 起点纬度/经度数组（度）
+        dest_lat, dest_lng: 终点纬度/经度数组（度）
+        threshold_km: 空间距离阈值（公里）
+
+    返回:
+        n×n 对称CSR邻接矩阵，非零元素表示相邻（距离为0的重合点同样保留）；
+        内存随邻居数增长而非n²
+    """
+    origin_lat = np.asarray(origin_lat, dtype=np.float64)
+    origin_lng = np.asarray(origin_lng, dtype=np.float64)
+    dest_lat = np.asarray(dest_lat, dtype=np.float64)
+    dest_lng = np.asarray(dest_lng, dtype=np.float64)
+    n = len(origin_lat)
+
+    if n < 2:
+        return csr_matrix((n, n), dtype=np.int8)
+
+    # BallTree的haversine度量要求 [lat, lng] 弧度坐标
+    tree = BallTree(np.radians(np.column_stack([origin_lat, origin_lng])), metric='haversine')
+    candidates = tree.query_radius(
+        np.radians(np.column_stack([origin_lat, origin_lng])),
+        r=2 * threshold_km / EARTH_RADIUS_KM
+    )
+
+    # 展开候选对，只保留 i < j 的一半
+    counts = np.fromiter((len(c) for c in candidates), dtype=np.int64, count=n)
+    rows = np.repeat(np.arange(n), counts)
+    cols = np.concatenate(candidates).astype(np.int64) if counts.sum() else np.empty(0, dtype=np.int64)
+    upper = rows < cols
+    rows, cols = rows[upper], cols[upper]
+
+    # 对候选对精确计算OD平均距离
+    origin_dist = haversine_km(origin_lat[rows], origin_lng[rows], origin_lat[cols], origin_lng[cols])
+    dest_dist = haversine_km(dest_lat[rows], dest_lng[rows], dest_lat[cols], dest_lng[cols])
+    distance = (origin_dist + dest_dist) / 2
+
+    keep = distance <= threshold_km
+    rows, cols, distance = rows[keep], cols[keep], distance[keep]
+
+    logger.info(f"OD邻接图: {n} 个请求, {len(distance)} 对邻居 (候选对 {int(upper.sum())})")
+
+    # 对称化；不直接存距离，避免距离为0的重合点被稀疏矩阵当作无边
+    graph = csr_matrix(
+        (np.ones(2 * len(rows), dtype=np.int8), (np.concatenate([rows, cols]), np.concatenate([cols, rows]))),
+        shape=(n, n)
+    )
+    graph.sort_indices()
+    return graph
+
+
+def greedy_clique_clusters(graph: csr_matrix, min_samples: int, weights: Optional[np.ndarray] = None) -> List[List[int]]:
+    """
+    在稀疏邻接图上执行贪心团聚类
+
+    与EnhancedClustering.cluster_trips中基于稠密距离矩阵的贪心算法结果一致：
+    按索引顺序为每个未分配的请求i建簇，依次尝试加入索引更大、且与簇内所有成员相邻的请求。
+    由于候选j必须与i相邻，只需遍历i的邻居而不是全部请求。
+
+    参数:
+        graph: od_neighbor_graph返回的邻接图
+        min_samples: 形成聚类的最小请求数
+        weights: 每个节点代表的请求数（如起终点预聚合后的超级请求），为None时每个节点计为1
+
+    返回:
+        聚类列表，每个聚类为请求索引列表
+    """
+    n = graph.shape[0]
+    indptr, indices = graph.indptr, graph.indices
+    neighbors = [set(indices[indptr[i]:indptr[i + 1]].tolist()) for i in range(n)]
+
+    clusters = []
+    used = set()
+
+    for i in range(n):
+        if i in used:
+            continue
+
+        cluster = [i]
+        for j in indices[indptr[i]:indptr[i + 1]].tolist():
+            if j <= i or j in used:
+                continue
+
+            # 检查j是否与当前簇中的所有点都相邻
+            if all(k in neighbors[j] for k in cluster):
+                cluster.append(j)
+
+        size = len(cluster) if weights is None else int(weights[cluster].sum())
+        if size >= min_samples:
+            used.update(cluster)
+            clusters.append(cluster)
+
+    return clusters
@@ -0,0 +1,178 @@
+import logging
+from datetime import datetime, timezone
+from typing import List, Dict, Any, Optional
+
+import numpy as np
+from sqlalchemy import text
+
+from algorithm.trip_batch import TripBatch, to_epoch
+
+logger = logging.getLogger(__name__)
+
+# 未分配到调度计划的请求，一次查询取出全部列；坐标用ST_X/ST_Y直接取数值，不再逐行解析GeoJSON
+PENDING_REQUESTS_SQL = """
+    SELECT ur.request_id,
+           ST_Y(ur.origin_location::geometry) AS origin_lat,
+           ST_X(ur.origin_location::geometry) AS origin_lng,
+           ST_Y(ur.destination_location::geometry) AS dest_lat,
+           ST_X(ur.destination_location::geometry) AS dest_lng,
+           ur.departure_time, ur.people_count,
+           ur.origin_name, ur.destination_name,
+           ur.submit_time, ur.updated_at
+    FROM user_request ur
+    LEFT JOIN request_dispatch_link rdl ON ur.request_id = rdl.request_id
+    WHERE rdl.id IS NULL {status_filter}
+    ORDER BY ur.departure_time
+"""
+
+
+def _isoformat(value) -> Optional[str]:
+    return value.isoformat() if value is not None else None
+
+
+def _naive_utc(value: datetime) -> datetime:
+    """
+    带时区的时间换算为不带时区的UTC时间（与TripBatch相同的约定），写入TIMESTAMP列时不依赖驱动和会话时区
+    """
+    if value.tzinfo is None:
+        return value
+    return value.astimezone(timezone.utc).replace(tzinfo=None)
+
+
+def load_pending_requests(db, status: Optional[str] = None) -> TripBatch:
+    """
+    一次查询加载全部待处理的出行请求，返回列式的TripBatch
+
+    查询次数与待处理请求数无关；坐标超出有效范围的请求记录日志后丢弃。
+
+    参数:
+        db: SQLAlchemy会话或连接
+        status: 不为None时只加载user_request.status等于该值的请求
+
+    返回:
+        TripBatch，extra列包含origin_name、destination_name、departure_time、
+        submit_time、updated_at（时间均为ISO格式字符串）
+    """
+    status_filter = "AND ur.status = :status" if status is not None else ""
+    params = {'status': status} if status is not None else {}
+    rows = db.execute(text(PENDING_REQUESTS_SQL.format(status_filter=status_filter)), params).fetchall()
+    if not rows:
+        return TripBatch.from_records([])
+
+    (request_id, origin_lat, origin_lng, dest_lat, dest_lng, departure_time, people_count,
+     origin_name, destination_name, submit_time, updated_at) = zip(*rows)
+
+    batch = TripBatch(
+        request_id=request_id,
+        origin_lat=origin_lat,
+        origin_lng=origin_lng,
+        dest_lat=dest_lat,
+        dest_lng=dest_lng,
+        departure_ts=[to_epoch(t) for t in departure_time],
+        people_count=[count if count is not None else 1 for count in people_count],
+        extra={
+            'origin_name': origin_name,
+            'destination_name': destination_name,
+            'departure_time': [t.isoformat() for t in departure_time],
+            'submit_time': [_isoformat(t) for t in submit_time],
+            'updated_at': [_isoformat(t) for t in updated_at]
+        }
+    )
+
+    invalid = batch.invalid_mask()
+    if invalid.any():
+        logger.error(f"经纬度超出有效范围，忽略请求: {batch.request_id[invalid].tolist()}")
+        batch = batch.take(np.flatnonzero(~invalid))
+    return batch
+
+
+class PlanRepository:
+    def __init__(self, db):
+        """
+        调度计划的批量写入
+
+        一个调度周期的全部计划、请求关联和请求状态更新各用一条语句写入，
+        语句数与计划数、请求数无关；数组参数通过unnest展开，不受单条语句参数个数限制。
+
+        参数:
+            db: SQLAlchemy会话或连接，事务由调用方管理
+        """
+        self.db = db
+
+    def _allocate_plan_ids(self, count: int) -> List[int]:
+        """
+        一次取出count个plan_id序列值，计划与其关联的请求在插入前就能对应起来
+        """
+        rows = self.db.execute(text("""
+            SELECT nextval(pg_get_serial_sequence('dispatch_plan', 'plan_id'))
+            FROM generate_series(1, :count)
+        """), {'count': count}).fetchall()
+        return [row[0] for row in rows]
+
+    def save_plans(self, plans: List[Dict[str, Any]]) -> List[int]:
+        """
+        批量写入调度计划及其关联的请求
+
+        参数:
+            plans: 计划列表，每项包含start_time、route_polyline和request_ids
+
+        返回:
+            与plans顺序一致的plan_id列表
+        """
+        if not plans:
+            return []
+
+        plan_ids = self._allocate_plan_ids(len(plans))
+        self.db.execute(text("""
+            INSERT INTO dispatch_plan (plan_id, start_time, route_polyline, status, created_at)
+            SELECT plan.plan_id, plan.start_time, plan.route_polyline, 'planned', CURRENT_TIMESTAMP
+            FROM unnest(CAST(:plan_ids AS integer[]),
+                        CAST(:start_times AS timestamp[]),
+                        CAST(:route_polylines AS text[]))
+                 AS plan(plan_id, start_time, route_polyline)
+        """), {
+            'plan_ids': plan_ids,
+            'start_times': [_naive_utc(plan['start_time']) for plan in plans],
+            'route_polylines': [plan['route_polyline'] for plan in plans]
+        })
+
+        link_request_ids, link_plan_ids = [], []
+        for plan_id, plan in zip(plan_ids, plans):
+            link_request_ids.extend(int(request_id) for request_id in plan['request_ids'])
+            link_plan_ids.extend([plan_id] * len(plan['request_ids']))
+        if link_request_ids:
+            self.db.execute(text("""
+                INSERT INTO request_dispatch_link (request_id, plan_id)
+                SELECT * FROM unnest(CAST(:request_ids AS integer[]), CAST(:plan_ids AS integer[]))
+            """), {'request_ids': link_request_ids, 'plan_ids': link_plan_ids})
+
+        return plan_ids
+
+    def update_request_status(self, request_ids: List[int], status: str,
+                              cluster_ids: Optional[List[int]] = None) -> None:
+        """
+        一条语句更新一批请求的状态
+
+        参数:
+            request_ids: 请求ID列表
+            status: 新状态
+            cluster_ids: 与request_ids一一对应的聚类ID，为None时不修改cluster_id
+        """
+        if not len(request_ids):
+            return
+        request_ids = [int(request_id) for request_id in request_ids]
+        if cluster_ids is None:
+            self.db.execute(text("""
+                UPDATE user_request
+                SET status = :status, updated_at = CURRENT_TIMESTAMP
+                WHERE request_id = ANY(:request_ids)
+            """), {'status': status, 'request_ids': request_ids})
+        else:
+            self.db.execute(text("""
+                UPDATE user_request ur
+                SET status = :status, cluster_id = v.cluster_id, updated_at = CURRENT_TIMESTAMP
+                FROM unnest(CAST(:request_ids AS integer[]), CAST(:cluster_ids AS integer[]))
+                     AS v(request_id, cluster_id)
+                WHERE ur.request_id = v.request_id
+            """), {'status': status, 'request_ids': request_ids,
+                   'cluster_ids': [int(cluster_id) for cluster_id in cluster_ids]})
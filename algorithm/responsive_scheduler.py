@@ -3,13 +3,22 @@ import json
 import os
 import sys
 from datetime import datetime, timedelta
-from typing import List, Dict, Any
+from typing import List, Dict, Any, Union
 import time
 import traceback
+import hashlib
+import numpy as np
 
 # 导入自定义模块
 from algorithm.clustering.enhanced_clustering import EnhancedClustering
+from algorithm.clustering.incremental_clustering import IncrementalClustering
 from algorithm.routing.multi_route_planner import MultiRoutePlanner
+from algorithm.routing.route_cache import RouteCache
+from algorithm.routing.rate_limiter import TokenBucketLimiter
+from algorithm.routing.road_graph import RoadGraph
+from algorithm.routing.travel_matrix import TravelTimeMatrix
+from algorithm.routing.polyline_codec import pack_route_polyline
+from algorithm.trip_batch import TripBatch
 
 # 配置日志
 logging.basicConfig(
@@ -25,7 +34,20 @@ class ResponsiveScheduler:
                  min_samples=2,           # 最小样本数
                  max_cluster_radius=5.0,  # 最大聚类半径（公里）
                  max_points_per_route=8,  # 每条路线最大点数
-                 amap_key=None            # 高德地图API密钥
+                 amap_key=None,           # 高德地图API密钥
+                 neighbor_search='dense', # 聚类邻居搜索方式: 'dense' 或 'balltree'
+                 incremental=False,       # 是否在多次调用之间保留增量聚类状态
+                 n_jobs=1,                # 并行聚类时间组的进程数，-1表示使用全部CPU
+                 od_aggregation=False,    # 聚类前合并起终点和出发时间相近的请求
+                 backend='greedy_clique', # 时间组空间聚类后端
+                 cache_results=False,     # 待处理请求未变化时直接复用上一次的结果
+                 route_cache: RouteCache = None, # 高德API响应的磁盘缓存
+                 route_concurrency=1,     # 并发规划路线的最大HTTP请求数
+                 rate_limiter: TokenBucketLimiter = None, # 跨进程共享的高德API限流器
+                 combined_route=False,    # 每个聚类规划一条接送合并路线
+                 road_graph: RoadGraph = None, # 离线路网
+                 travel_matrix: TravelTimeMatrix = None, # 站点排序使用的道路行驶时间矩阵服务
+                 travel_matrix_fetch=False # 站点排序时是否实时请求缺失点对的行驶时间
                 ):
         """
         响应式公交调度系统
@@ -37,6 +59,24 @@ class ResponsiveScheduler:
             max_cluster_radius: 最大聚类半径（公里）
             max_points_per_route: 每条路线最大点数
             amap_key: 高德地图API密钥
+            neighbor_search: 非增量模式下的聚类邻居搜索方式，'balltree' 使用空间索引构建稀疏邻接图
+            incremental: 为True时使用IncrementalClustering，每次process_requests只处理
+                与上一次相比新增、变化或移除的请求，适合定时调度进程；此时neighbor_search、n_jobs、
+                od_aggregation和backend不生效，设置了非默认值时记录警告
+            n_jobs: 非增量模式下并行聚类时间组的进程数
+            od_aggregation: 非增量模式下是否先将同一细网格、同一时间桶的请求合并为超级请求再聚类
+            backend: 非增量模式下的时间组空间聚类后端: 'greedy_clique'、'dbscan' 或 'od_dbscan'
+            cache_results: 为True时按待处理请求的指纹（请求ID、更新时间、请求内容和聚类参数）
+                缓存处理结果，指纹不变时直接返回上一次的聚类和路线；指纹变化时，
+                成员和内容都未变化的聚类复用已规划的路线，只为变化的聚类重新规划；备用路线不缓存
+            route_cache: 路线缓存（RouteCache），多个进程使用同一缓存文件即可共享
+            route_concurrency: 大于1时所有聚类的接、送路线并发规划，同时进行的HTTP请求数不超过该值
+            rate_limiter: 令牌桶限流器（TokenBucketLimiter），多个进程使用同一状态文件即可共享QPS和每日配额
+            combined_route: 为True时接、送站点按先接后送的约束统一排序，每个聚类只规划一条路线，
+                结果中dropoff_route为None
+            road_graph: 离线路网（RoadGraph），覆盖范围内的路线在本地规划，不请求高德API
+            travel_matrix: 行驶时间矩阵服务（TravelTimeMatrix），站点排序使用道路行驶时间而不是直线距离
+            travel_matrix_fetch: 为True时缓存中没有的点对实时请求高德距离API；默认只读缓存，缺失的点对按直线距离估算
         """
         # 初始化聚类器
         self.clusterer = EnhancedClustering(
@@ -44,31 +84,168 @@ class ResponsiveScheduler:
             time_window=time_window,
             min_samples=min_samples,
             max_cluster_radius=max_cluster_radius,
-            max_points_per_route=max_points_per_route
+            max_points_per_route=max_points_per_route,
+            neighbor_search=neighbor_search,
+            n_jobs=n_jobs,
+            od_aggregation=od_aggregation,
+            backend=backend
         )
         
+        # 增量聚类器在调度周期之间保留邻接关系和时间组聚类结果
+        self.incremental_clusterer = None
+        if incremental:
+            # 增量聚类器自行维护邻接关系，不使用以下只对非增量模式生效的参数
+            ignored = [
+                name for name, value, default in (
+                    ('neighbor_search', neighbor_search, 'dense'),
+                    ('n_jobs', n_jobs, 1),
+                    ('od_aggregation', od_aggregation, False),
+                    ('backend', backend, 'greedy_clique')
+                ) if value != default
+            ]
+            if ignored:
+                logger.warning(f"增量聚类模式忽略参数: {', '.join(ignored)}")
+            self.incremental_clusterer = IncrementalClustering(
+                spatial_threshold=spatial_threshold,
+                time_window=time_window,
+                min_samples=min_samples
+            )
+        
         # 初始化路线规划器
-        self.route_planner = MultiRoutePlanner(amap_key=amap_key)
+        self.route_planner = MultiRoutePlanner(
+            amap_key=amap_key,
+            route_cache=route_cache,
+            max_concurrency=route_concurrency,
+            rate_limiter=rate_limiter,
+            combined_route=combined_route,
+            road_graph=road_graph,
+            travel_matrix=travel_matrix,
+            travel_matrix_fetch=travel_matrix_fetch
+        )
+        
+        # 周期级结果缓存: 指纹 -> 结果，以及聚类成员签名 -> 路线
+        self.cache_results = cache_results
+        self._cache_params = repr((
+            spatial_threshold, time_window, min_samples, max_cluster_radius, max_points_per_route,
+            neighbor_search, incremental, od_aggregation, backend
+        ))
+        self._result_cache = None
+        self._route_cache: Dict[tuple, Dict[str, Any]] = {}
         
         logger.info(f"初始化响应式调度系统: 空间阈值={spatial_threshold}公里, 时间窗口={time_window}分钟")
 
-    def process_requests(self, requests: List[Dict[str, Any]]) -> Dict[str, Any]:
+    def _fingerprint(self, requests: Union[List[Dict[str, Any]], TripBatch]) -> str:
+        """
+        计算待处理请求集合的指纹
+        
+        按请求ID排序后对核心列、更新时间（如有）和聚类参数做哈希，与请求的输入顺序无关
+        """
+        batch = requests if isinstance(requests, TripBatch) else TripBatch.from_records(requests)
+        order = np.argsort(batch.request_id, kind='stable')
+        
+        digest = hashlib.sha1(self._cache_params.encode('utf-8'))
+        for column in (batch.request_id, batch.origin_lat, batch.origin_lng,
+                       batch.dest_lat, batch.dest_lng, batch.departure_ts, batch.people_count):
+            digest.update(np.ascontiguousarray(column[order]).tobytes())
+        updated_at = batch.extra.get('updated_at')
+        if updated_at is not None:
+            digest.update(repr(updated_at[order].tolist()).encode('utf-8'))
+        return digest.hexdigest()
+
+    @staticmethod
+    def _route_cache_key(trips: List[Dict[str, Any]]) -> tuple:
+        """
+        聚类的路线缓存键: 按顺序排列的成员请求及其影响路线的字段
+        """
+        return tuple(
+            (trip.get('request_id'), trip['origin']['lat'], trip['origin']['lng'],
+             trip['destination']['lat'], trip['destination']['lng'],
+             str(trip['departure_time']), trip.get('people_count', 1))
+            for trip in trips
+        )
+
+    @staticmethod
+    def _is_fallback(route: Dict[str, Any]) -> bool:
+        """
+        接、送路线中任意一段是高德API失败后生成的直线备用路线
+        """
+        return any((route.get(leg) or {}).get('is_fallback') for leg in ('pickup_route', 'dropoff_route'))
+
+    def _plan_routes(self, clusters_data: Dict[int, Dict[str, Any]]) -> Dict[int, Dict[str, Any]]:
+        """
+        为有效聚类规划路线；启用缓存时只为成员发生变化的聚类调用路线规划器
+
+        备用路线（高德API故障或配额耗尽时的直线估算）不缓存，下一周期重新规划
+        """
+        if not self.cache_results:
+            return self.route_planner.plan_multi_routes(clusters_data)
+        
+        routes = {}
+        route_cache = {}
+        pending = {}
+        for cluster_id, cluster_data in clusters_data.items():
+            if cluster_id == -1:
+                continue
+            key = self._route_cache_key(cluster_data['trips'])
+            cached = self._route_cache.get(key)
+            if cached is not None:
+                # 聚类ID可能随其他聚类的变化而改变，复用路线时更新为当前的ID和请求
+                routes[cluster_id] = dict(cached, cluster_id=cluster_id, trips=cluster_data['trips'])
+                route_cache[key] = cached
+            else:
+                pending[cluster_id] = cluster_data
+        
+        logger.info(f"路线缓存: 复用 {len(routes)} 条, 需要规划 {len(pending)} 条")
+        
+        if pending:
+            planned = self.route_planner.plan_multi_routes(pending)
+            for cluster_id, route in planned.items():
+                routes[cluster_id] = route
+                if not self._is_fallback(route):
+                    route_cache[self._route_cache_key(pending[cluster_id]['trips'])] = route
+        
+        # 只保留当前聚类的路线，已分配或已变化的聚类随之淘汰
+        self._route_cache = route_cache
+        return {cluster_id: routes[cluster_id] for cluster_id in sorted(routes)}
+
+    def process_requests(self, requests: Union[List[Dict[str, Any]], TripBatch]) -> Dict[str, Any]:
         """
         处理出行请求并生成调度计划
         
         参数:
-            requests: 出行请求列表
+            requests: 出行请求列表，或列式的TripBatch（如scheduler.get_pending_requests的返回值）
         返回:
             处理结果，包含聚类和路线规划信息
         """
-        if not requests:
+        if not self.cache_results or requests is None or len(requests) == 0:
+            result, _ = self._process_requests(requests)
+            return result
+        
+        fingerprint = self._fingerprint(requests)
+        if self._result_cache is not None and self._result_cache[0] == fingerprint:
+            logger.info(f"待处理请求未变化（{len(requests)} 个），复用上一次的处理结果")
+            return dict(self._result_cache[1], cached=True, processing_time=0.0,
+                        timestamp=datetime.now().isoformat())
+        
+        result, cacheable = self._process_requests(requests)
+        self._result_cache = (fingerprint, result) if cacheable else None
+        return result
+
+    def _process_requests(self, requests: Union[List[Dict[str, Any]], TripBatch]):
+        """
+        执行聚类和路线规划
+        
+        返回:
+            (处理结果, 是否可缓存)。出错、路线规划失败或含备用路线（可能是外部服务的临时故障）的结果不缓存
+        """
+        if requests is None or len(requests) == 0:
             logger.warning("没有待处理的请求")
             return {
                 "success": False,
                 "error": "没有待处理的请求",
                 "clusters": {},
                 "routes": {}
-            }
+            }, False
             
         start_time = time.time()
         logger.info("=====================================================")
@@ -77,13 +254,22 @@ class ResponsiveScheduler:
         logger.info(f"收到 {len(requests)} 个出行请求")
         
         # 打印每个请求的基本信息
-        for i, request in enumerate(requests):
-            logger.info(f"\n请求 {i+1}:")
-            logger.info(f"- 请求ID: {request.get('request_id', 'unknown')}")
-            logger.info(f"- 出发时间: {request.get('departure_time', 'unknown')}")
-            logger.info(f"- 乘客数: {request.get('people_count', 1)}")
-            logger.info(f"- 起点: lat={request['origin']['lat']}, lng={request['origin']['lng']}")
-            logger.info(f"- 终点: lat={request['destination']['lat']}, lng={request['destination']['lng']}")
+        if isinstance(requests, TripBatch):
+            for i in range(len(requests)):
+                logger.info(f"\n请求 {i+1}:")
+                logger.info(f"- 请求ID: {requests.request_id[i]}")
+                logger.info(f"- 出发时间: {requests.departure_time(i)}")
+                logger.info(f"- 乘客数: {requests.people_count[i]}")
+                logger.info(f"- 起点: lat={requests.origin_lat[i]}, lng={requests.origin_lng[i]}")
+                logger.info(f"- 终点: lat={requests.dest_lat[i]}, lng={requests.dest_lng[i]}")
+        else:
+            for i, request in enumerate(requests):
+                logger.info(f"\n请求 {i+1}:")
+                logger.info(f"- 请求ID: {request.get('request_id', 'unknown')}")
+                logger.info(f"- 出发时间: {request.get('departure_time', 'unknown')}")
+                logger.info(f"- 乘客数: {request.get('people_count', 1)}")
+                logger.info(f"- 起点: lat={request['origin']['lat']}, lng={request['origin']['lng']}")
+                logger.info(f"- 终点: lat={request['destination']['lat']}, lng={request['destination']['lng']}")
         
         try:
             # 步骤1: 对请求进行聚类
@@ -92,18 +278,32 @@ class ResponsiveScheduler:
             logger.info("=====================================================")
             
             # 验证请求数据的完整性
-            for i, request in enumerate(requests):
-                if not self._validate_request(request):
-                    error_msg = f"请求 {i+1} 数据不完整或格式错误"
-                    logger.error(error_msg)
-                    return {
-                        "success": False,
-                        "error": error_msg,
-                        "clusters": {},
-                        "routes": {}
-                    }
+            # TripBatch在构建时已解析出发时间，这里只需整体检查坐标范围
+            if isinstance(requests, TripBatch):
+                invalid = np.flatnonzero(requests.invalid_mask())
+                first_invalid = int(invalid[0]) if len(invalid) else None
+            else:
+                first_invalid = next(
+                    (i for i, request in enumerate(requests) if not self._validate_request(request)),
+                    None
+                )
+            
+            if first_invalid is not None:
+                error_msg = f"请求 {first_invalid+1} 数据不完整或格式错误"
+                logger.error(error_msg)
+                return {
+                    "success": False,
+                    "error": error_msg,
+                    "clusters": {},
+                    "routes": {}
+                }, True
             
-            clustered_requests = self.clusterer.cluster_trips(requests)
+            if self.incremental_clusterer is not None:
+                sync_stats = self.incremental_clusterer.sync(requests)
+                logger.info(f"增量聚类同步: 新增 {sync_stats['inserted']}, 移除 {sync_stats['removed']}, 当前 {sync_stats['total']}")
+                clustered_requests = self.incremental_clusterer.cluster_trips()
+            else:
+                clustered_requests = self.clusterer.cluster_trips(requests)
             if not clustered_requests:
                 error_msg = "聚类过程未返回任何结果"
                 logger.error(error_msg)
@@ -112,7 +312,7 @@ class ResponsiveScheduler:
                     "error": error_msg,
                     "clusters": {},
                     "routes": {}
-                }
+                }, True
             
             # 步骤2: 获取聚类统计信息
             logger.info("\n=====================================================")
@@ -128,7 +328,7 @@ class ResponsiveScheduler:
                     "error": error_msg,
                     "clusters": {},
                     "routes": {}
-                }
+                }, True
             
             valid_clusters = {k: v for k, v in clusters_data.items() if k != -1}
             noise_points = clusters_data.get(-1, {}).get('size', 0)
@@ -141,7 +341,7 @@ class ResponsiveScheduler:
                     "error": error_msg,
                     "clusters": clusters_data,
                     "routes": {}
-                }
+                }, True
             
             # 步骤3: 路径规划
             logger.info("\n=====================================================")
@@ -149,7 +349,7 @@ class ResponsiveScheduler:
             logger.info("=====================================================")
             logger.info(f"开始为 {len(valid_clusters)} 个有效聚类规划路线")
             
-            routes = self.route_planner.plan_multi_routes(clusters_data)
+            routes = self._plan_routes(clusters_data)
             
             if not routes:
                 error_msg = "路线规划失败，未能生成任何有效路线"
@@ -159,7 +359,7 @@ class ResponsiveScheduler:
                     "error": error_msg,
                     "clusters": clusters_data,
                     "routes": {}
-                }
+                }, False
             
             processing_time = time.time() - start_time
             
@@ -171,6 +371,11 @@ class ResponsiveScheduler:
             logger.info(f"噪声点数: {noise_points}")
             logger.info(f"规划路线数: {len(routes)}")
             
+            # 含备用路线的结果不缓存，外部服务恢复后下一周期重新规划
+            fallback_routes = sum(1 for route in routes.values() if self._is_fallback(route))
+            if fallback_routes:
+                logger.warning(f"{fallback_routes} 条路线为备用路线，本次结果不缓存")
+            
             return {
                 "success": True,
                 "processing_time": processing_time,
@@ -181,7 +386,7 @@ class ResponsiveScheduler:
                 "clusters": clusters_data,
                 "routes": routes,
                 "timestamp": datetime.now().isoformat()
-            }
+            }, fallback_routes == 0
             
         except Exception as e:
             logger.error(f"处理请求时出错: {str(e)}")
@@ -193,7 +398,7 @@ class ResponsiveScheduler:
                 "clusters": {},
                 "routes": {},
                 "timestamp": datetime.now().isoformat()
-            }
+            }, False
             
     def _validate_request(self, request: Dict[str, Any]) -> bool:
         """
@@ -257,68 +462,47 @@ class ResponsiveScheduler:
             }
         
         try:
-            # 开始事务
-            with db_connection.begin():
-                saved_plans = []
-                
-                # 为每个有效路线创建调度计划
-                for cluster_id, route_data in result.get("routes", {}).items():
-                    cluster_data = result["clusters"][cluster_id]
-                    
-                    # 准备调度计划数据
-                    departure_time = datetime.fromisoformat(route_data["departure_time"].replace('Z', '+00:00'))
-                    
-                    # 路线数据
-                    route_polyline = json.dumps({
-                        'pickup_route': route_data['pickup_route']['polyline'],
-                        'dropoff_route': route_data['dropoff_route']['polyline']
-                    })
-                    
-                    # 保存调度计划
-                    query = """
-                        INSERT INTO dispatch_plan
-                        (start_time, route_polyline, status, created_at)
-                        VALUES (:start_time, :route_polyline, 'planned', CURRENT_TIMESTAMP)
-                        RETURNING plan_id
-                    """
-                    
-                    params = {
-                        'start_time': departure_time,
-                        'route_polyline': route_polyline
-                    }
-                    
-                    # 执行插入
-                    plan_result = db_connection.execute(query, params)
-                    plan_id = plan_result.scalar()
-                    
-                    # 关联请求到调度计划
-                    for trip in cluster_data['trips']:
-                        db_connection.execute(
-                            """
-                            INSERT INTO request_dispatch_link
-                            (request_id, plan_id)
-                            VALUES (:request_id, :plan_id)
-                            """,
-                            {
-                                'request_id': trip['request_id'],
-                                'plan_id': plan_id
-                            }
-                        )
-                    
-                    saved_plans.append({
-                        'plan_id': plan_id,
-                        'cluster_id': cluster_id,
-                        'trip_count': len(cluster_data['trips']),
-                        'passenger_count': route_data['passenger_count'],
-                        'departure_time': departure_time.isoformat()
-                    })
+            # 数据库访问依赖sqlalchemy，只在保存时导入
+            from algorithm.repository import PlanRepository
+            
+            plans = []
+            saved_plans = []
+            for cluster_id, route_data in result.get("routes", {}).items():
+                cluster_data = result["clusters"][cluster_id]
                 
-                logger.info(f"成功保存 {len(saved_plans)} 个调度计划")
+                # 准备调度计划数据
+                departure_time = datetime.fromisoformat(route_data["departure_time"].replace('Z', '+00:00'))
                 
-                return {
-                    "success": True,
-                    "saved_plans": saved_plans
-                }
+                # 编码折线，接送合并规划时没有单独的送乘客路线
+                plans.append({
+                    'start_time': departure_time,
+                    'route_polyline': pack_route_polyline(
+                        route_data['pickup_route']['polyline'],
+                        (route_data.get('dropoff_route') or {}).get('polyline', [])
+                    ),
+                    'request_ids': [trip['request_id'] for trip in cluster_data['trips']]
+                })
+                saved_plans.append({
+                    'plan_id': None,
+                    'cluster_id': cluster_id,
+                    'trip_count': len(cluster_data['trips']),
+                    'passenger_count': route_data['passenger_count'],
+                    'departure_time': departure_time.isoformat()
+                })
+            
+            # 开始事务，所有计划和请求关联批量写入
+            with db_connection.begin():
+                plan_ids = PlanRepository(db_connection).save_plans(plans)
+            
+            for plan_id, saved_plan in zip(plan_ids, saved_plans):
+                saved_plan['plan_id'] = plan_id
+            
+            logger.info(f"成功保存 {len(saved_plans)} 个调度计划")
+            
+            return {
+                "success": True,
+                "saved_plans": saved_plans
+            }
                 
         except Exception as e:
             logger.error(f"保存到数据库时出错: {str(e)}", exc_info=True)
@@ -386,7 +570,7 @@ class ResponsiveScheduler:
                 route_viz = {
                     "cluster_id": cluster_id,
                     "pickup_polyline": route_data['pickup_route']['polyline'],
-                    "dropoff_polyline": route_data['dropoff_route']['polyline'],
+                    "dropoff_polyline": (route_data.get('dropoff_route') or {}).get('polyline', []),
                     "total_distance": route_data['total_distance'],
                     "total_duration": route_data['total_duration'],
                     "passenger_count": route_data['passenger_count']
@@ -0,0 +1,343 @@
+import json
+import os
+import hashlib
+import glob
+import math
+import random
+import threading
+import time
+import logging
+import argparse
+import numpy as np
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from urllib.parse import urlparse, parse_qs
+from typing import Dict, Any, List, Optional
+
+from algorithm.clustering.spatial_index import haversine_km
+
+logger = logging.getLogger(__name__)
+
+# 合成路线的行驶速度（公里/小时）和折线点间距（公里）
+SYNTHETIC_SPEED_KMH = 30
+SYNTHETIC_POINT_SPACING_KM = 0.1
+# 错误注入默认使用的infocode: 访问已超出日访问量/QPS
+DEFAULT_ERROR_INFOCODE = '10020'
+# 参与匹配录制响应的请求参数
+FIXTURE_PARAMS = ('origin', 'destination', 'waypoints', 'strategy')
+
+
+class AmapStubServer:
+    def __init__(self,
+                 fixtures_dir=None,       # 录制的响应文件目录
+                 latency_ms=0,            # 每个请求的固定延迟（毫秒）
+                 jitter_ms=0,             # 延迟的随机波动上限（毫秒）
+                 error_rate=0.0,          # 返回错误infocode的概率
+                 error_infocode=DEFAULT_ERROR_INFOCODE, # 注入的错误infocode
+                 timeout_rate=0.0,        # 不及时响应（模拟超时）的概率
+                 timeout_seconds=30,      # 模拟超时时挂起的秒数
+                 seed=0,                  # 随机数种子，保证注入的错误可重现
+                 host='127.0.0.1',
+                 port=0                   # 0表示自动选择空闲端口
+                ):
+        """
+        本地高德地图API替身服务
+
+        在本机启动HTTP服务，提供与高德Web服务API相同格式的 /v3/direction/driving
+        和 /v3/distance 接口。driving请求优先返回录制的响应，没有录制的坐标生成合成路线；
+        可注入延迟、错误infocode和超时，用于离线基准测试、重试和缓存效果的测量。
+
+        参数:
+            fixtures_dir: 录制响应的目录，每个.json文件包含params和response两个字段
+            latency_ms: 固定延迟（毫秒）
+            jitter_ms: 在固定延迟上增加的0~jitter_ms的随机延迟
+            error_rate: 返回错误响应的概率
+            error_infocode: 错误响应的infocode，如'10020'（QPS超限）、'10003'（日配额超限）
+            timeout_rate: 挂起timeout_seconds秒后才响应的概率，客户端会先超时
+            timeout_seconds: 模拟超时时挂起的秒数
+            seed: 随机数种子
+            host, port: 监听地址
+        """
+        self.latency_ms = latency_ms
+        self.jitter_ms = jitter_ms
+        self.error_rate = error_rate
+        self.error_infocode = error_infocode
+        self.timeout_rate = timeout_rate
+        self.timeout_seconds = timeout_seconds
+        self.host = host
+        self.port = port
+
+        self._random = random.Random(seed)
+        self._lock = threading.Lock()
+        self._server = None
+        self._thread = None
+        self.fixtures = {}
+        self.stats = {'requests': 0, 'fixture_hits': 0, 'synthetic': 0, 'errors': 0, 'timeouts': 0}
+
+        if fixtures_dir:
+            self.load_fixtures(fixtures_dir)
+
+    @staticmethod
+    def fixture_key(endpoint: str, params: Dict[str, Any]) -> str:
+        """
+        录制响应的匹配键: 端点和影响路线的请求参数（不含key）
+        """
+        selected = {name: str(params[name]) for name in FIXTURE_PARAMS if params.get(name)}
+        return endpoint.strip('/') + '|' + json.dumps(selected, sort_keys=True)
+
+    def add_fixture(self, endpoint: str, params: Dict[str, Any], response: Dict[str, Any]):
+        """
+        添加一条录制响应
+        """
+        self.fixtures[self.fixture_key(endpoint, params)] = response
+
+    def load_fixtures(self, fixtures_dir: str) -> int:
+        """
+        加载目录中的录制响应，文件格式为 {"endpoint": ..., "params": {...}, "response": {...}}
+
+        返回:
+            加载的条数
+        """
+        count = 0
+        for path in sorted(glob.glob(os.path.join(fixtures_dir, '*.json'))):
+            try:
+                with open(path, encoding='utf-8') as f:
+                    fixture = json.load(f)
+                self.add_fixture(fixture.get('endpoint', 'direction/driving'), fixture['params'], fixture['response'])
+                count += 1
+            except (OSError, ValueError, KeyError) as e:
+                logger.warning(f"加载录制响应失败: {path}, {str(e)}")
+        logger.info(f"加载 {count} 条录制响应: {fixtures_dir}")
+        return count
+
+    @staticmethod
+    def save_fixture(fixtures_dir: str, endpoint: str, params: Dict[str, Any], response: Dict[str, Any]) -> str:
+        """
+        将一次真实API的请求和响应保存为录制文件
+
+        返回:
+            文件路径
+        """
+        os.makedirs(fixtures_dir, exist_ok=True)
+        key = AmapStubServer.fixture_key(endpoint, params)
+        name = hashlib.sha1(key.encode('utf-8')).hexdigest()[:16] + '.json'
+        path = os.path.join(fixtures_dir, name)
+        with open(path, 'w', encoding='utf-8') as f:
+            json.dump({'endpoint': endpoint,
+                       'params': {k: v for k, v in params.items() if k != 'key'},
+                       'response': response}, f, ensure_ascii=False)
+        return path
+
+    def _chance(self, rate: float) -> bool:
+        with self._lock:
+            return rate > 0 and self._random.random() < rate
+
+    def _delay(self) -> float:
+        with self._lock:
+            jitter = self._random.uniform(0, self.jitter_ms) if self.jitter_ms else 0
+        return (self.latency_ms + jitter) / 1000
+
+    def _count(self, name: str):
+        with self._lock:
+            self.stats[name] += 1
+
+    @staticmethod
+    def _parse_point(value: str) -> List[float]:
+        lng, lat = value.split(',')
+        return [float(lng), float(lat)]
+
+    @staticmethod
+    def _leg_points(start: List[float], end: List[float]) -> List[List[float]]:
+        """
+        合成一段先沿经线再沿纬线行驶的折线，点间距约100米
+        """
+        corner = [start[0], end[1]]
+        points = []
+        for a, b in ((start, corner), (corner, end)):
+            length = haversine_km(a[1], a[0], b[1], b[0])
+            count = max(1, int(math.ceil(length / SYNTHETIC_POINT_SPACING_KM)))
+            for i in range(count):
+                t = i / count
+                points.append([a[0] + (b[0] - a[0]) * t, a[1] + (b[1] - a[1]) * t])
+        points.append(list(end))
+        return points
+
+    def synthetic_driving(self, params: Dict[str, Any]) -> Dict[str, Any]:
+        """
+        为任意坐标生成高德driving格式的合成路线
+        """
+        stops = [self._parse_point(params['origin'])]
+        if params.get('waypoints'):
+            stops += [self._parse_point(point) for point in params['waypoints'].split(';')]
+        stops.append(self._parse_point(params['destination']))
+
+        steps = []
+        total_distance = 0.0
+        for i in range(len(stops) - 1):
+            points = self._leg_points(stops[i], stops[i + 1])
+            coords = np.array(points)
+            distance = float(haversine_km(coords[:-1, 1], coords[:-1, 0], coords[1:, 1], coords[1:, 0]).sum()) * 1000
+            duration = distance / 1000 / SYNTHETIC_SPEED_KMH * 3600
+            total_distance += distance
+            steps.append({
+                'instruction': f"行驶{round(distance)}米到达{'终点' if i == len(stops) - 2 else f'途经点{i + 1}'}",
+                'road': '',
+                'distance': str(round(distance)),
+                'duration': str(round(duration)),
+                'polyline': ';'.join(f"{lng:.6f},{lat:.6f}" for lng, lat in points),
+                'action': '',
+                'assistant_action': '',
+                'tolls': '0',
+                'toll_distance': '0'
+            })
+
+        total_duration = total_distance / 1000 / SYNTHETIC_SPEED_KMH * 3600
+        return {
+            'status': '1',
+            'info': 'OK',
+            'infocode': '10000',
+            'count': '1',
+            'route': {
+                'origin': params['origin'],
+                'destination': params['destination'],
+                'distance': str(round(total_distance)),
+                'time': str(round(total_duration)),
+                'toll': '0',
+                'toll_distance': '0',
+                'paths': [{
+                    'distance': str(round(total_distance)),
+                    'duration': str(round(total_duration)),
+                    'strategy': '速度最快',
+                    'tolls': '0',
+                    'toll_distance': '0',
+                    'steps': steps
+                }]
+            }
+        }
+
+    def synthetic_distance(self, params: Dict[str, Any]) -> Dict[str, Any]:
+        """
+        为distance请求生成合成的道路距离（直线距离的1.3倍）和行驶时间
+        """
+        destination = self._parse_point(params['destination'])
+        results = []
+        for i, origin in enumerate(params['origins'].split('|')):
+            lng, lat = self._parse_point(origin)
+            distance = haversine_km(lat, lng, destination[1], destination[0]) * 1000 * 1.3
+            results.append({
+                'origin_id': str(i + 1),
+                'dest_id': '1',
+                'distance': str(round(distance)),
+                'duration': str(round(distance / 1000 / SYNTHETIC_SPEED_KMH * 3600))
+            })
+        return {'status': '1', 'info': 'OK', 'infocode': '10000', 'count': str(len(results)), 'results': results}
+
+    def handle(self, endpoint: str, params: Dict[str, Any]) -> Optional[Dict[str, Any]]:
+        """
+        处理一次请求，返回响应；模拟超时时在挂起后返回None
+        """
+        self._count('requests')
+        time.sleep(self._delay())
+
+        if self._chance(self.timeout_rate):
+            self._count('timeouts')
+            time.sleep(self.timeout_seconds)
+            return None
+        if self._chance(self.error_rate):
+            self._count('errors')
+            return {'status': '0', 'info': 'STUB_INJECTED_ERROR', 'infocode': self.error_infocode}
+
+        fixture = self.fixtures.get(self.fixture_key(endpoint, params))
+        if fixture is not None:
+            self._count('fixture_hits')
+            return fixture
+
+        try:
+            if endpoint == 'direction/driving':
+                response = self.synthetic_driving(params)
+            elif endpoint == 'distance':
+                response = self.synthetic_distance(params)
+            else:
+                return {'status': '0', 'info': 'UNKNOWN_ENDPOINT', 'infocode': '20003'}
+        except (KeyError, ValueError):
+            return {'status': '0', 'info': 'INVALID_PARAMS', 'infocode': '20000'}
+        self._count('synthetic')
+        return response
+
+    def start(self) -> str:
+        """
+        在后台线程启动服务
+
+        返回:
+            可直接作为base_url使用的地址，如 http://127.0.0.1:8765/v3
+        """
+        stub = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                url = urlparse(self.path)
+                endpoint = url.path[len('/v3/'):] if url.path.startswith('/v3/') else url.path.strip('/')
+                params = {name: values[-1] for name, values in parse_qs(url.query).items()}
+                response = stub.handle(endpoint, params)
+                if response is None:
+                    return
+                body = json.dumps(response, ensure_ascii=False).encode('utf-8')
+                self.send_response(200)
+                self.send_header('Content-Type', 'application/json; charset=utf-8')
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, format, *args):
+                logger.debug(format % args)
+
+        self._server = ThreadingHTTPServer((self.host, self.port), Handler)
+        self._server.daemon_threads = True
+        self.port = self._server.server_address[1]
+        self._thread = threading.Thread(target=self._server.serve_forever, daemon=True)
+        self._thread.start()
+        logger.info(f"高德API替身服务已启动: {self.base_url}")
+        return self.base_url
+
+    @property
+    def base_url(self) -> str:
+        return f"http://{self.host}:{self.port}/v3"
+
+    def stop(self):
+        """
+        停止服务
+        """
+        if self._server is not None:
+            self._server.shutdown()
+            self._server.server_close()
+            self._server = None
+
+    def __enter__(self):
+        self.start()
+        return self
+
+    def __exit__(self, *exc):
+        self.stop()
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='本地高德地图API替身服务')
+    parser.add_argument('--port', type=int, default=8765)
+    parser.add_argument('--fixtures', default=None, help='录制响应目录')
+    parser.add_argument('--latency-ms', type=float, default=0)
+    parser.add_argument('--jitter-ms', type=float, default=0)
+    parser.add_argument('--error-rate', type=float, default=0.0)
+    parser.add_argument('--error-infocode', default=DEFAULT_ERROR_INFOCODE)
+    parser.add_argument('--timeout-rate', type=float, default=0.0)
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO)
+    server = AmapStubServer(fixtures_dir=args.fixtures, latency_ms=args.latency_ms, jitter_ms=args.jitter_ms,
+                            error_rate=args.error_rate, error_infocode=args.error_infocode,
+                            timeout_rate=args.timeout_rate, seed=args.seed, port=args.port)
+    print(f"AMAP_BASE_URL={server.start()}")
+    try:
+        while True:
+            time.sleep(3600)
+    except KeyboardInterrupt:
+        server.stop()
@@ -10,6 +10,22 @@ import time
 from geopy.distance import geodesic
 import heapq
 import math
+import re
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
+from requests.adapters import HTTPAdapter
+
+from algorithm.routing.route_cache import RouteCache
+from algorithm.routing.rate_limiter import TokenBucketLimiter
+from algorithm.routing.road_graph import RoadGraph
+from algorithm.routing.travel_matrix import TravelTimeMatrix
+from algorithm.routing.stop_ordering import distance_matrix_km, order_stops, sequence_pickup_delivery
+
+# 高德Web服务API地址
+DEFAULT_BASE_URL = "https://restapi.amap.com/v3"
+
+# 每个点恰好是"lng,lat"两个分量的折线字符串，满足时才整体转换为浮点数组
+POLYLINE_PATTERN = re.compile(r'[^,;]+,[^,;]+(?:;[^,;]+,[^,;]+)*')
 
 # 配置日志
 logging.basicConfig(
@@ -23,7 +39,15 @@ class MultiRoutePlanner:
                  amap_key=None, 
                  timeout=15,      # API请求超时时间（秒）
                  retry_limit=3,   # API请求重试次数
-                 sleep_time=1     # 请求间隔时间（秒）
+                 sleep_time=1,    # 请求间隔时间（秒）
+                 route_cache: RouteCache = None, # 高德API响应的磁盘缓存
+                 max_concurrency=1, # 并发规划的最大HTTP请求数
+                 rate_limiter: TokenBucketLimiter = None, # 跨进程共享的QPS和每日配额限流器
+                 combined_route=False, # 接送站点合并为一条路线规划
+                 road_graph: RoadGraph = None, # 离线路网
+                 travel_matrix: TravelTimeMatrix = None, # 道路行驶时间矩阵服务
+                 travel_matrix_fetch=False, # 站点排序时是否实时请求缺失点对的行驶时间
+                 base_url=None    # 高德API地址，可指向本地替身服务
                 ):
         """
         多路线规划器
@@ -33,6 +57,21 @@ class MultiRoutePlanner:
             timeout: API请求超时时间（秒）
             retry_limit: API请求重试次数
             sleep_time: 请求间隔时间（秒）
+            route_cache: 路线缓存（RouteCache），为None时每次都请求高德API
+            max_concurrency: 大于1时plan_multi_routes并发规划所有聚类，每个聚类的接、送两段路线也同时规划，
+                同时进行的HTTP请求数不超过该值
+            rate_limiter: 令牌桶限流器，每次请求前排队取令牌，保证不超过密钥的QPS和每日配额
+            combined_route: 为True时每个聚类只规划一条路线: 接、送站点按先接后送的约束统一排序
+                （允许交错），整条路线一次请求高德API（超过16个途经点时分段）。
+                结果中pickup_route为整条路线，dropoff_route为None，stops为有序站点列表
+            road_graph: 离线路网（RoadGraph），设置后优先在本地路网上规划路线，不发起网络请求；
+                起终点不在路网覆盖范围内或不连通时再请求高德API
+            travel_matrix: 行驶时间矩阵服务（TravelTimeMatrix），设置后站点排序使用道路行驶时间，
+                为None时使用直线距离
+            travel_matrix_fetch: 为True时站点排序遇到缓存中没有的点对会实时请求高德距离API（每个终点一次请求，
+                占用限流令牌和每日配额）；默认只使用点对缓存和区域间矩阵，缺失的点对按直线距离估算，
+                缓存由离线任务填充
+            base_url: 高德API地址，为None时读取环境变量AMAP_BASE_URL，默认https://restapi.amap.com/v3
         """
         # 加载环境变量
         load_dotenv()
@@ -43,16 +82,56 @@ class MultiRoutePlanner:
             logger.warning("未设置高德地图API密钥，将无法进行路线规划")
         
         # API配置
-        self.base_url = "https://restapi.amap.com/v3"
+        self.base_url = (base_url or os.getenv("AMAP_BASE_URL") or DEFAULT_BASE_URL).rstrip('/')
         self.timeout = timeout
         self.retry_limit = retry_limit
         self.sleep_time = sleep_time
+        self.route_cache = route_cache
+        self.max_concurrency = max(1, max_concurrency)
+        self.rate_limiter = rate_limiter
+        self.combined_route = combined_route
+        self.road_graph = road_graph
+        self.travel_matrix = travel_matrix
+        self.travel_matrix_fetch = travel_matrix_fetch
+        self._executor = None
+        
+        # 复用TCP/TLS连接的HTTP会话，连接池大小与并发数一致
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=4, pool_maxsize=max(10, self.max_concurrency))
+        self.session.mount('https://', adapter)
+        self.session.mount('http://', adapter)
         
         logger.info("初始化多路线规划器")
 
-    def _call_amap_api(self, endpoint: str, params: Dict[str, Any], retries=0) -> Dict[str, Any]:
+    def _call_amap_api(self, endpoint: str, params: Dict[str, Any]) -> Dict[str, Any]:
         """
-        调用高德地图API
+        调用高德地图API，配置了路线缓存时优先读取缓存，成功的响应写入缓存
+        
+        参数:
+            endpoint: API端点
+            params: 请求参数
+            
+        返回:
+            API响应
+        """
+        if self.route_cache is None:
+            return self._request_amap_api(endpoint, params)
+        
+        # 指向替身服务等非默认地址时，响应与正式API的缓存分开保存
+        base_url = self.base_url if self.base_url != DEFAULT_BASE_URL else None
+        cache_key = self.route_cache.make_key(endpoint, params, base_url=base_url)
+        cached = self.route_cache.get(cache_key)
+        if cached is not None:
+            logger.info(f"路线缓存命中: {endpoint}")
+            return cached
+        
+        result = self._request_amap_api(endpoint, params)
+        self.route_cache.put(cache_key, result)
+        return result
+
+    def _request_amap_api(self, endpoint: str, params: Dict[str, Any], retries=0) -> Dict[str, Any]:
+        """
+        请求高德地图API（不经过缓存）
         
         参数:
             endpoint: API端点
@@ -75,9 +154,13 @@ class MultiRoutePlanner:
         logger.info(f"高德地图API请求: {url}")
         logger.info(f"请求参数: {params}")
         
+        # 排队等待令牌，而不是发出注定被限流的请求
+        if self.rate_limiter is not None and not self.rate_limiter.acquire():
+            raise Exception("高德地图API今日配额已用完")
+        
         try:
             # 发送请求
-            response = requests.get(url, params=params, timeout=self.timeout)
+            response = self.session.get(url, params=params, timeout=self.timeout)
             response.raise_for_status()  # 抛出HTTP错误
             
             result = response.json()
@@ -99,10 +182,15 @@ class MultiRoutePlanner:
                 
                 # 如果API限流，尝试重试
                 if result.get('infocode') in ['10004', '10008', '10020'] and retries < self.retry_limit:
-                    sleep_time = self.sleep_time * (retries + 1)  # 指数退避
-                    logger.info(f"API请求受限，{sleep_time}秒后重试 ({retries+1}/{self.retry_limit})")
-                    time.sleep(sleep_time)
-                    return self._call_amap_api(endpoint, params, retries + 1)
+                    if self.rate_limiter is not None:
+                        # 清空令牌桶，重试请求和其他线程、进程的请求一起排队等待令牌补充
+                        self.rate_limiter.drain()
+                        logger.info(f"API请求受限，等待令牌后重试 ({retries+1}/{self.retry_limit})")
+                    else:
+                        sleep_time = self.sleep_time * (retries + 1)  # 指数退避
+                        logger.info(f"API请求受限，{sleep_time}秒后重试 ({retries+1}/{self.retry_limit})")
+                        time.sleep(sleep_time)
+                    return self._request_amap_api(endpoint, params, retries + 1)
                 
                 raise Exception(error_msg)
             
@@ -115,7 +203,7 @@ class MultiRoutePlanner:
                 sleep_time = self.sleep_time * (retries + 1)  # 指数退避
                 logger.info(f"API请求失败，{sleep_time}秒后重试 ({retries+1}/{self.retry_limit})")
                 time.sleep(sleep_time)
-                return self._call_amap_api(endpoint, params, retries + 1)
+                return self._request_amap_api(endpoint, params, retries + 1)
             
             raise
 
@@ -131,49 +219,41 @@ class MultiRoutePlanner:
         """
         return f"{location['lng']},{location['lat']}"
 
-    def _tsp_optimize_route(self, locations: List[Dict[str, float]]) -> List[int]:
+    def _stop_matrix(self, locations: List[Dict[str, float]]) -> np.ndarray:
+        """
+        站点排序使用的代价矩阵: 配置了行驶时间矩阵服务时为道路行驶时间（秒），否则为直线距离（公里）
+        """
+        if self.travel_matrix is not None:
+            fetch = self._request_amap_api if self.travel_matrix_fetch and self.amap_key else None
+            # 非默认地址请求到的点对不写入共享的点对缓存
+            durations, _ = self.travel_matrix.matrix(locations, fetch=fetch,
+                                                     store=self.base_url == DEFAULT_BASE_URL)
+            return durations
+        return distance_matrix_km(
+            [location['lat'] for location in locations],
+            [location['lng'] for location in locations]
+        )
+
+    def _tsp_optimize_route(self, locations: List[Dict[str, float]], end_fixed: bool = False) -> List[int]:
         """
-        使用贪心算法解决TSP问题，优化点位的访问顺序
+        优化点位的访问顺序
+        
+        代价矩阵一次获取（道路行驶时间或直线距离）；不超过12个中间点时用Held-Karp求精确解，
+        更多点时用最近邻构造后在时间预算内执行2-opt/Or-opt改进
         
         参数:
-            locations: 位置坐标列表
+            locations: 位置坐标列表，第一个点为起点
+            end_fixed: 是否固定最后一个点为终点
             
         返回:
-            优化后的点位访问顺序索引
+            优化后的点位访问顺序索引（以起点0开头）
         """
         n = len(locations)
         if n <= 2:
             return list(range(n))  # 如果只有1或2个点，直接返回原始顺序
         
-        # 计算所有点对之间的距离
-        distance_matrix = np.zeros((n, n))
-        for i in range(n):
-            for j in range(n):
-                if i != j:
-                    loc1 = (locations[i]['lat'], locations[i]['lng'])
-                    loc2 = (locations[j]['lat'], locations[j]['lng'])
-                    distance_matrix[i][j] = geodesic(loc1, loc2).kilometers
-        
-        # 贪心算法: 从第一个点开始，每次选择最近的未访问点
-        visited = [False] * n
-        current = 0  # 起点
-        route = [current]
-        visited[current] = True
-        
-        for _ in range(n - 1):
-            next_point = -1
-            min_distance = float('inf')
-            
-            for j in range(n):
-                if not visited[j] and distance_matrix[current][j] < min_distance:
-                    min_distance = distance_matrix[current][j]
-                    next_point = j
-            
-            route.append(next_point)
-            visited[next_point] = True
-            current = next_point
-        
-        return route
+        matrix = self._stop_matrix(locations)
+        return order_stops(matrix, start=0, end=n - 1 if end_fixed else None)
 
     def _find_optimal_waypoints_order(self, 
                                      origin: Dict[str, float], 
@@ -193,30 +273,11 @@ class MultiRoutePlanner:
         if not waypoints:
             return []
         
-        # 合并所有点位（起点、途经点）
-        all_points = [origin] + waypoints
-        
-        # 优化点位访问顺序
-        optimized_indices = self._tsp_optimize_route(all_points)
+        # 起点和终点都固定，只优化中间途经点的顺序
+        all_points = [origin] + waypoints + [destination]
+        optimized_indices = self._tsp_optimize_route(all_points, end_fixed=True)
         
-        # 从优化后的顺序中移除起点，并保持终点单独处理
-        # 注意：我们需要找到起点在优化路径中的位置
-        try:
-            origin_index = optimized_indices.index(0)  # 起点在合并列表中的索引为0
-            
-            # 重新排序，使起点作为第一个点
-            optimized_indices = optimized_indices[origin_index:] + optimized_indices[:origin_index]
-            
-            # 移除起点
-            optimized_indices.pop(0)
-            
-            # 获取优化后的途经点
-            optimized_waypoints = [all_points[i] for i in optimized_indices]
-            
-            return optimized_waypoints
-        except ValueError:
-            logger.error("无法在优化路径中找到起点")
-            return waypoints
+        return [all_points[i] for i in optimized_indices[1:-1]]
 
     def plan_single_route(self, 
                          origin: Dict[str, float], 
@@ -247,6 +308,14 @@ class MultiRoutePlanner:
             logger.info("优化途经点顺序")
             waypoints = self._find_optimal_waypoints_order(origin, destination, waypoints)
         
+        # 优先使用离线路网，没有途经点数量限制
+        if self.road_graph is not None:
+            route_info = self.road_graph.route(origin, destination, waypoints)
+            if route_info:
+                logger.info(f"离线路网规划成功，总距离: {route_info['distance']/1000:.2f}km")
+                return route_info
+            logger.info("离线路网无法规划该路线，改用高德地图API")
+        
         # 构建请求参数
         params = {
             'origin': self._format_location(origin),
@@ -296,30 +365,21 @@ class MultiRoutePlanner:
                 logger.error(f"API路径数据: {json.dumps(path)}")
                 return self._create_fallback_route(origin, destination, waypoints, "API返回结果中没有步骤数据")
                 
-            # 提取路线折线（处理可能的空值）
-            polyline = self._extract_polyline(path['steps'])
+            # 提取路线折线（(N, 2)数组）
+            coords = self._extract_polyline(path['steps'])
             
             # 验证折线数据的有效性
-            if not polyline or len(polyline) < 2:
+            if len(coords) < 2:
                 logger.warning("路线规划未返回有效的折线数据，创建备用直线路线")
                 return self._create_fallback_route(origin, destination, waypoints, "无效的折线数据")
             
-            # 验证折线点的有效性
-            valid_polyline = True
-            for point in polyline:
-                if not isinstance(point, dict) or 'lng' not in point or 'lat' not in point:
-                    valid_polyline = False
-                    logger.warning(f"发现无效的折线点: {point}")
-                    break
-                if not (-180 <= point['lng'] <= 180 and -90 <= point['lat'] <= 90):
-                    valid_polyline = False
-                    logger.warning(f"发现超出范围的经纬度: lng={point['lng']}, lat={point['lat']}")
-                    break
-            
-            if not valid_polyline:
+            if not np.isfinite(coords).all():
                 logger.warning("折线数据包含无效点，创建备用直线路线")
                 return self._create_fallback_route(origin, destination, waypoints, "折线数据包含无效点")
             
+            # 路线结果中的折线为坐标字典列表
+            polyline = self._polyline_to_dicts(coords)
+            
             # 提取路线详情
             route_info = {
                 'distance': float(path['distance']),  # 路线总长度（米）
@@ -449,82 +509,77 @@ class MultiRoutePlanner:
         logger.info(f"创建了备用路线，总距离: {(total_distance/1000):.2f}km, 预计时间: {(est_duration/60):.2f}分钟")
         return route_info
 
-    def _extract_polyline(self, steps):
+    def _extract_polyline(self, steps) -> np.ndarray:
         """
         从路线步骤中提取折线
         
+        将所有步骤的折线字符串拼接后一次转换为浮点数组；
+        字符串中有格式错误的点时逐点解析并跳过错误的点
+        
         参数:
             steps: 路线步骤
             
         返回:
-            路线折线
+            (N, 2)的[lng, lat]数组，超出经纬度范围的点已剔除
         """
-        polyline = []
-        try:
-            if not steps:
-                logger.error("路线步骤为空")
-                return []
-                
-            logger.info(f"开始从{len(steps)}个路线步骤中提取折线")
-            for i, step in enumerate(steps):
-                if not isinstance(step, dict):
-                    logger.warning(f"步骤{i+1}不是字典类型: {type(step)}")
-                    continue
-                    
-                if 'polyline' not in step:
-                    logger.warning(f"步骤{i+1}中缺少polyline字段")
-                    continue
-                    
-                polyline_str = step.get('polyline')
-                if not polyline_str:
-                    logger.warning(f"步骤{i+1}的polyline为空")
-                    continue
-                    
-                if not isinstance(polyline_str, str):
-                    logger.warning(f"步骤{i+1}的polyline不是字符串类型: {type(polyline_str)}")
-                    continue
-                    
-                if ';' not in polyline_str:
-                    logger.warning(f"步骤{i+1}的polyline格式不正确: {polyline_str[:30]}...")
-                    continue
-                    
-                points = polyline_str.split(';')
-                for point in points:
-                    if not point or not point.strip():
-                        continue
-                        
-                    try:
-                        if ',' not in point:
-                            logger.warning(f"坐标点格式不正确: {point}")
-                            continue
-                            
-                        lng, lat = point.strip().split(',')
-                        try:
-                            lng_float = float(lng)
-                            lat_float = float(lat)
-                            
-                            # 验证经纬度范围
-                            if not (-180 <= lng_float <= 180 and -90 <= lat_float <= 90):
-                                logger.warning(f"经纬度超出有效范围: lng={lng_float}, lat={lat_float}")
-                                continue
-                                
-                            polyline.append({'lng': lng_float, 'lat': lat_float})
-                        except ValueError as e:
-                            logger.warning(f"无法将坐标转换为浮点数: {point}, 错误: {str(e)}")
-                            continue
-                    except Exception as e:
-                        logger.warning(f"处理坐标点时出错: {point}, 错误: {str(e)}")
-                        continue
-                        
-            if not polyline:
-                logger.error("没有从路线步骤中提取到任何有效的折线点")
-                
-        except Exception as e:
-            logger.error(f"提取折线点时发生异常: {str(e)}")
-            logger.exception("详细异常信息:")
-            polyline = []
-            
-        return polyline
+        if not steps:
+            logger.error("路线步骤为空")
+            return np.empty((0, 2))
+        
+        # 只保留包含多个点的折线字符串
+        strings = []
+        for i, step in enumerate(steps):
+            polyline_str = step.get('polyline') if isinstance(step, dict) else None
+            if not isinstance(polyline_str, str) or ';' not in polyline_str:
+                logger.warning(f"步骤{i+1}的polyline缺失或格式不正确")
+                continue
+            strings.append(polyline_str.strip().strip(';'))
+        
+        if not strings:
+            logger.error("没有从路线步骤中提取到任何有效的折线点")
+            return np.empty((0, 2))
+        
+        text = ';'.join(strings)
+        coords = None
+        # 分量个数不是两个的点会让整体reshape错位，这类字符串直接逐点解析
+        if text.count(',') == text.count(';') + 1 and POLYLINE_PATTERN.fullmatch(text):
+            try:
+                coords = np.array(text.replace(';', ',').split(','), dtype=np.float64).reshape(-1, 2)
+            except ValueError:
+                coords = None
+        if coords is None:
+            coords = self._parse_points(text.split(';'))
+        
+        # 整体校验经纬度范围
+        valid = (np.abs(coords[:, 0]) <= 180) & (np.abs(coords[:, 1]) <= 90)
+        if not valid.all():
+            logger.warning(f"剔除 {int((~valid).sum())} 个超出有效范围的坐标点")
+            coords = coords[valid]
+        
+        if not len(coords):
+            logger.error("没有从路线步骤中提取到任何有效的折线点")
+        return coords
+
+    def _parse_points(self, points: List[str]) -> np.ndarray:
+        """
+        逐点解析 "lng,lat" 字符串，跳过格式错误的点
+        """
+        parsed = []
+        for point in points:
+            try:
+                lng, lat = point.strip().split(',')
+                parsed.append((float(lng), float(lat)))
+            except ValueError:
+                if point.strip():
+                    logger.warning(f"坐标点格式不正确: {point}")
+        return np.array(parsed, dtype=np.float64).reshape(-1, 2)
+
+    @staticmethod
+    def _polyline_to_dicts(coords: np.ndarray) -> List[Dict[str, float]]:
+        """
+        将(N, 2)的[lng, lat]数组转换为路线结果中的坐标字典列表
+        """
+        return [{'lng': lng, 'lat': lat} for lng, lat in coords.tolist()]
 
     def _plan_route_with_multiple_segments(self, 
                                           origin: Dict[str, float], 
@@ -568,18 +623,20 @@ class MultiRoutePlanner:
         
         # 循环处理每组途经点
         for i, group in enumerate(waypoint_groups):
-            # 如果是最后一组，终点为最终目的地
             if i == len(waypoint_groups) - 1:
+                # 最后一组: 组内所有点都是途经点，终点为最终目的地
                 current_destination = destination
+                segment_waypoints = group
             else:
-                # 否则，终点为下一组的第一个点
-                current_destination = waypoint_groups[i+1][0]
+                # 其他组: 以组内最后一个点为该段终点，下一段从这里出发
+                current_destination = group[-1]
+                segment_waypoints = group[:-1]
             
             # 规划当前段路线
             segment_route = self.plan_single_route(
                 current_origin, 
                 current_destination, 
-                group[:-1] if i == len(waypoint_groups) - 1 else group,
+                segment_waypoints,
                 optimize_order=False  # 已经优化过顺序，不再优化
             )
             
@@ -603,6 +660,253 @@ class MultiRoutePlanner:
         
         return combined_route
 
+    def _prepare_cluster(self, cluster_data: Dict[str, Any]) -> Dict[str, Any]:
+        """
+        提取规划聚类路线所需的中心点、起终点和出发时间
+        
+        参数:
+            cluster_data: 聚类数据
+            
+        返回:
+            包含trips、center、origins、destinations、departure_time的字典，数据不完整时返回None
+        """
+        # 提取请求数据
+        trips = cluster_data.get('trips', [])
+        if not trips:
+            logger.error("聚类数据中没有请求")
+            return None
+        
+        # 提取聚类中心（聚类级别字段，兼容旧数据中写在trip上的中心点）
+        center = cluster_data.get('center_origin') or trips[0].get('center_origin')
+        if not center:
+            logger.error("聚类数据缺少起点中心信息")
+            return None
+        
+        # 使用起点中心作为虚拟起点
+        logger.info(f"聚类起点中心: lat={center['lat']}, lng={center['lng']}")
+        
+        # 获取聚类中的所有起点和终点
+        origins = [trip['origin'] for trip in trips]
+        destinations = [trip['destination'] for trip in trips]
+        
+        # 输出详细的聚类点信息
+        logger.info("=== 聚类详细信息 ===")
+        logger.info(f"聚类ID: {cluster_data.get('cluster_id', 0)}")
+        logger.info(f"请求数量: {len(trips)}")
+        logger.info(f"总乘客数: {sum([trip.get('people_count', 1) for trip in trips])}")
+        
+        # 输出每个请求的详细信息
+        for i, trip in enumerate(trips):
+            logger.info(f"\n请求 {i+1}:")
+            logger.info(f"  - 请求ID: {trip.get('request_id', 'unknown')}")
+            logger.info(f"  - 乘客数: {trip.get('people_count', 1)}")
+            logger.info(f"  - 出发地: lat={trip['origin']['lat']}, lng={trip['origin']['lng']}")
+            logger.info(f"  - 目的地: lat={trip['destination']['lat']}, lng={trip['destination']['lng']}")
+            
+            # 计算与聚类中心的距离
+            origin_distance = geodesic(
+                (trip['origin']['lat'], trip['origin']['lng']),
+                (center['lat'], center['lng'])
+            ).kilometers
+            dest_distance = geodesic(
+                (trip['destination']['lat'], trip['destination']['lng']),
+                (center['lat'], center['lng'])
+            ).kilometers
+            logger.info(f"  - 到聚类中心的距离: 起点={origin_distance:.2f}km, 终点={dest_distance:.2f}km")
+        
+        # 提取出发时间
+        try:
+            departure_time = trips[0]['departure_time']
+            logger.info(f"计划出发时间: {departure_time}")
+        except (KeyError, IndexError) as e:
+            logger.error(f"无法提取出发时间: {str(e)}")
+            departure_time = datetime.now().isoformat()
+            logger.info(f"使用当前时间作为出发时间: {departure_time}")
+        
+        return {
+            'trips': trips,
+            'center': center,
+            'origins': origins,
+            'destinations': destinations,
+            'departure_time': departure_time
+        }
+
+    def _plan_leg(self, name: str, origin: Dict[str, float], destination: Dict[str, float],
+                  waypoints: List[Dict[str, float]]) -> Dict[str, Any]:
+        """
+        规划一段路线（接乘客或送乘客），优化顺序失败时不优化顺序再试一次
+        
+        参数:
+            name: 路段名称，用于日志
+            origin: 起点坐标
+            destination: 终点坐标
+            waypoints: 途经点坐标列表
+            
+        返回:
+            路线规划结果，两次都失败时返回None
+        """
+        logger.info(f"\n开始规划{name}路线:")
+        logger.info(f"- 起点: lat={origin['lat']}, lng={origin['lng']}")
+        logger.info(f"- 终点: lat={destination['lat']}, lng={destination['lng']}")
+        logger.info(f"- 途经点数量: {len(waypoints)}")
+        
+        route = self.plan_single_route(origin, destination, waypoints, optimize_order=True)
+        
+        if not route:
+            logger.error(f"{name}路线规划失败")
+            # 尝试不优化顺序再试一次
+            logger.info(f"尝试不优化顺序再规划一次{name}路线")
+            route = self.plan_single_route(origin, destination, waypoints, optimize_order=False)
+            if not route:
+                logger.error(f"{name}路线规划再次失败")
+                return None
+        else:
+            logger.info(f"{name}路线规划成功:")
+            logger.info(f"- 总距离: {route['distance']/1000:.2f}km")
+            logger.info(f"- 预计时间: {route['duration']/60:.0f}分钟")
+            logger.info(f"- 平均速度: {route['avg_speed']:.1f}km/h")
+        
+        return route
+
+    def _pickup_leg(self, prepared: Dict[str, Any]) -> Tuple:
+        """
+        接乘客路段: 从虚拟起点（聚类中心）出发，依次接所有乘客，最后一个乘客的位置为终点
+        """
+        origins = prepared['origins']
+        return ('接乘客', prepared['center'], origins[-1], origins[:-1])
+
+    def _dropoff_leg(self, prepared: Dict[str, Any]) -> Tuple:
+        """
+        送乘客路段: 从最后接的乘客位置出发，依次送所有乘客，最后一个目的地为终点
+        """
+        origins, destinations = prepared['origins'], prepared['destinations']
+        return ('送乘客', origins[-1], destinations[-1], destinations[:-1])
+
+    def _assemble_cluster_route(self, cluster_data: Dict[str, Any], prepared: Dict[str, Any],
+                                pickup_route: Dict[str, Any], dropoff_route: Dict[str, Any]) -> Dict[str, Any]:
+        """
+        合并接乘客和送乘客路线为聚类路线
+        
+        接乘客路线失败时返回None；送乘客路线失败时只返回接乘客路线
+        """
+        if not pickup_route:
+            logger.error("接乘客路线规划失败，无法生成路线计划")
+            return None
+        
+        trips = prepared['trips']
+        
+        if not dropoff_route:
+            # 只返回接乘客路线
+            logger.warning("送乘客路线规划失败，将只返回接乘客路线")
+            result = {
+                'cluster_id': cluster_data.get('cluster_id', 0),
+                'total_distance': pickup_route['distance'],
+                'total_duration': pickup_route['duration'],
+                'departure_time': prepared['departure_time'],
+                'pickup_route': pickup_route,
+                'dropoff_route': None,  # 没有送乘客路线
+                'passenger_count': sum([trip.get('people_count', 1) for trip in trips]),
+                'trips': trips
+            }
+            logger.info("\n=== 路线规划结果（仅接乘客路线）===")
+            logger.info(f"总距离: {result['total_distance']/1000:.2f}km")
+            logger.info(f"总时间: {result['total_duration']/60:.0f}分钟")
+            return result
+        
+        # 返回完整的路线信息
+        result = {
+            'cluster_id': cluster_data.get('cluster_id', 0),
+            'total_distance': pickup_route['distance'] + dropoff_route['distance'],
+            'total_duration': pickup_route['duration'] + dropoff_route['duration'],
+            'departure_time': prepared['departure_time'],
+            'pickup_route': pickup_route,
+            'dropoff_route': dropoff_route,
+            'passenger_count': sum([trip.get('people_count', 1) for trip in trips]),
+            'trips': trips
+        }
+        
+        logger.info("\n=== 路线规划最终结果 ===")
+        logger.info(f"总距离: {result['total_distance']/1000:.2f}km")
+        logger.info(f"总时间: {result['total_duration']/60:.0f}分钟")
+        logger.info(f"平均速度: {(result['total_distance']/1000)/(result['total_duration']/3600):.1f}km/h")
+        logger.info(f"总乘客数: {result['passenger_count']}")
+        logger.info("=====================================")
+        
+        return result
+
+    def _sequence_stops(self, prepared: Dict[str, Any]) -> List[Dict[str, Any]]:
+        """
+        对聚类的接送站点做带先后约束的排序
+        
+        返回:
+            有序站点列表，每项包含type（pickup/dropoff）、request_id和location
+        """
+        trips = prepared['trips']
+        n = len(trips)
+        locations = [prepared['center']] + prepared['origins'] + prepared['destinations']
+        matrix = self._stop_matrix(locations)
+        order = sequence_pickup_delivery(matrix, 0, list(range(1, n + 1)), list(range(n + 1, 2 * n + 1)))
+        
+        stops = []
+        for node in order:
+            is_pickup = node <= n
+            trip = trips[node - 1 if is_pickup else node - n - 1]
+            stops.append({
+                'type': 'pickup' if is_pickup else 'dropoff',
+                'request_id': trip.get('request_id'),
+                'location': locations[node]
+            })
+        return stops
+
+    def _plan_combined(self, prepared: Dict[str, Any]) -> Tuple:
+        """
+        规划接送合并路线: 从聚类中心出发，按排序后的站点依次接送，最后一个站点为终点
+        
+        返回:
+            (路线规划结果, 有序站点列表)
+        """
+        stops = self._sequence_stops(prepared)
+        locations = [stop['location'] for stop in stops]
+        
+        logger.info(f"\n开始规划接送合并路线:")
+        logger.info(f"- 起点(聚类中心): lat={prepared['center']['lat']}, lng={prepared['center']['lng']}")
+        logger.info(f"- 站点顺序: {[(stop['type'], stop['request_id']) for stop in stops]}")
+        
+        # 站点已排序，不再优化途经点顺序
+        route = self.plan_single_route(prepared['center'], locations[-1], locations[:-1], optimize_order=False)
+        if route:
+            route['stops'] = stops
+        return route, stops
+
+    def _assemble_combined_route(self, cluster_data: Dict[str, Any], prepared: Dict[str, Any],
+                                 route: Dict[str, Any], stops: List[Dict[str, Any]]) -> Dict[str, Any]:
+        """
+        生成接送合并路线的结果，字段与分段规划一致，dropoff_route为None
+        """
+        if not route:
+            logger.error("接送合并路线规划失败，无法生成路线计划")
+            return None
+        
+        trips = prepared['trips']
+        result = {
+            'cluster_id': cluster_data.get('cluster_id', 0),
+            'total_distance': route['distance'],
+            'total_duration': route['duration'],
+            'departure_time': prepared['departure_time'],
+            'pickup_route': route,   # 整条接送路线
+            'dropoff_route': None,   # 合并规划时没有单独的送乘客路线
+            'combined': True,
+            'stops': stops,
+            'passenger_count': sum([trip.get('people_count', 1) for trip in trips]),
+            'trips': trips
+        }
+        
+        logger.info("\n=== 路线规划结果（接送合并）===")
+        logger.info(f"总距离: {result['total_distance']/1000:.2f}km")
+        logger.info(f"总时间: {result['total_duration']/60:.0f}分钟")
+        logger.info(f"总乘客数: {result['passenger_count']}")
+        return result
+
     def plan_cluster_route(self, cluster_data: Dict[str, Any]) -> Dict[str, Any]:
         """
         根据聚类数据规划路线
@@ -614,170 +918,108 @@ class MultiRoutePlanner:
             规划的路线信息
         """
         try:
-            # 提取请求数据
-            trips = cluster_data.get('trips', [])
-            if not trips:
-                logger.error("聚类数据中没有请求")
-                return None
-            
-            # 提取聚类中心（从第一个trip中获取，因为所有trip都有相同的中心点）
-            if not trips[0].get('center_origin'):
-                logger.error("聚类数据缺少起点中心信息")
+            prepared = self._prepare_cluster(cluster_data)
+            if prepared is None:
                 return None
             
-            # 使用起点中心作为虚拟起点
-            center = trips[0]['center_origin']
-            logger.info(f"聚类起点中心: lat={center['lat']}, lng={center['lng']}")
-            
-            # 获取聚类中的所有起点和终点
-            origins = [trip['origin'] for trip in trips]
-            destinations = [trip['destination'] for trip in trips]
-            
-            # 输出详细的聚类点信息
-            logger.info("=== 聚类详细信息 ===")
-            logger.info(f"聚类ID: {cluster_data.get('cluster_id', 0)}")
-            logger.info(f"请求数量: {len(trips)}")
-            logger.info(f"总乘客数: {sum([trip.get('people_count', 1) for trip in trips])}")
-            
-            # 输出每个请求的详细信息
-            for i, trip in enumerate(trips):
-                logger.info(f"\n请求 {i+1}:")
-                logger.info(f"  - 请求ID: {trip.get('request_id', 'unknown')}")
-                logger.info(f"  - 乘客数: {trip.get('people_count', 1)}")
-                logger.info(f"  - 出发地: lat={trip['origin']['lat']}, lng={trip['origin']['lng']}")
-                logger.info(f"  - 目的地: lat={trip['destination']['lat']}, lng={trip['destination']['lng']}")
-                
-                # 计算与聚类中心的距离
-                origin_distance = geodesic(
-                    (trip['origin']['lat'], trip['origin']['lng']),
-                    (center['lat'], center['lng'])
-                ).kilometers
-                dest_distance = geodesic(
-                    (trip['destination']['lat'], trip['destination']['lng']),
-                    (center['lat'], center['lng'])
-                ).kilometers
-                logger.info(f"  - 到聚类中心的距离: 起点={origin_distance:.2f}km, 终点={dest_distance:.2f}km")
-            
             logger.info("\n=== 路线规划信息 ===")
-            # 设置虚拟起点（中心点）
-            virtual_origin = center
-            
-            # 提取出发时间
-            try:
-                departure_time_str = trips[0]['departure_time']
-                departure_time = departure_time_str
-                logger.info(f"计划出发时间: {departure_time}")
-            except (KeyError, IndexError) as e:
-                logger.error(f"无法提取出发时间: {str(e)}")
-                departure_time = datetime.now().isoformat()
-                logger.info(f"使用当前时间作为出发时间: {departure_time}")
-            
-            # 规划接乘客路线（从虚拟起点出发，依次接所有乘客）
-            logger.info(f"\n开始规划接乘客路线:")
-            logger.info(f"- 起点(聚类中心): lat={virtual_origin['lat']}, lng={virtual_origin['lng']}")
-            logger.info(f"- 终点(最后一个接的乘客): lat={origins[-1]['lat']}, lng={origins[-1]['lng']}")
-            logger.info(f"- 途经点数量: {len(origins)-1}")
-            
-            pickup_route = self.plan_single_route(
-                virtual_origin,
-                origins[-1],  # 最后一个接的乘客的位置作为终点
-                origins[:-1],  # 其余乘客位置作为途经点
-                optimize_order=True  # 优化接车顺序
-            )
+            if self.combined_route:
+                route, stops = self._plan_combined(prepared)
+                return self._assemble_combined_route(cluster_data, prepared, route, stops)
             
+            pickup_route = self._plan_leg(*self._pickup_leg(prepared))
             if not pickup_route:
-                logger.error("接乘客路线规划失败")
-                # 尝试不优化顺序再试一次
-                logger.info("尝试不优化顺序再规划一次接乘客路线")
-                pickup_route = self.plan_single_route(
-                    virtual_origin,
-                    origins[-1],
-                    origins[:-1],
-                    optimize_order=False
-                )
-                
-                if not pickup_route:
-                    logger.error("接乘客路线规划再次失败，无法生成路线计划")
-                    return None
-            else:
-                logger.info(f"接乘客路线规划成功:")
-                logger.info(f"- 总距离: {pickup_route['distance']/1000:.2f}km")
-                logger.info(f"- 预计时间: {pickup_route['duration']/60:.0f}分钟")
-                logger.info(f"- 平均速度: {pickup_route['avg_speed']:.1f}km/h")
-            
-            # 规划送乘客路线（从最后一个接的乘客位置出发，依次送所有乘客到目的地）
-            logger.info(f"\n开始规划送乘客路线:")
-            logger.info(f"- 起点(最后接的乘客): lat={origins[-1]['lat']}, lng={origins[-1]['lng']}")
-            logger.info(f"- 终点(最后一个目的地): lat={destinations[-1]['lat']}, lng={destinations[-1]['lng']}")
-            logger.info(f"- 途经点数量: {len(destinations)-1}")
-            
-            dropoff_route = self.plan_single_route(
-                origins[-1],  # 从最后接的乘客位置出发
-                destinations[-1],  # 最后送到的乘客的目的地作为终点
-                destinations[:-1],  # 其余乘客目的地作为途经点
-                optimize_order=True  # 优化送车顺序
-            )
+                return self._assemble_cluster_route(cluster_data, prepared, None, None)
             
-            if not dropoff_route:
-                logger.error("送乘客路线规划失败")
-                # 尝试不优化顺序再试一次
-                logger.info("尝试不优化顺序再规划一次送乘客路线")
-                dropoff_route = self.plan_single_route(
-                    origins[-1],
-                    destinations[-1],
-                    destinations[:-1],
-                    optimize_order=False
-                )
-                
-                if not dropoff_route:
-                    logger.error("送乘客路线规划再次失败，无法生成完整路线计划")
-                    # 只返回接乘客路线
-                    logger.warning("将只返回接乘客路线")
-                    result = {
-                        'cluster_id': cluster_data.get('cluster_id', 0),
-                        'total_distance': pickup_route['distance'],
-                        'total_duration': pickup_route['duration'],
-                        'departure_time': departure_time,
-                        'pickup_route': pickup_route,
-                        'dropoff_route': None,  # 没有送乘客路线
-                        'passenger_count': sum([trip.get('people_count', 1) for trip in trips]),
-                        'trips': trips
-                    }
-                    logger.info("\n=== 路线规划结果（仅接乘客路线）===")
-                    logger.info(f"总距离: {result['total_distance']/1000:.2f}km")
-                    logger.info(f"总时间: {result['total_duration']/60:.0f}分钟")
-                    return result
-            else:
-                logger.info(f"送乘客路线规划成功:")
-                logger.info(f"- 总距离: {dropoff_route['distance']/1000:.2f}km")
-                logger.info(f"- 预计时间: {dropoff_route['duration']/60:.0f}分钟")
-                logger.info(f"- 平均速度: {dropoff_route['avg_speed']:.1f}km/h")
+            dropoff_route = self._plan_leg(*self._dropoff_leg(prepared))
+            return self._assemble_cluster_route(cluster_data, prepared, pickup_route, dropoff_route)
             
-            # 返回完整的路线信息
-            result = {
-                'cluster_id': cluster_data.get('cluster_id', 0),
-                'total_distance': pickup_route['distance'] + dropoff_route['distance'],
-                'total_duration': pickup_route['duration'] + dropoff_route['duration'],
-                'departure_time': departure_time,
-                'pickup_route': pickup_route,
-                'dropoff_route': dropoff_route,
-                'passenger_count': sum([trip.get('people_count', 1) for trip in trips]),
-                'trips': trips
-            }
+        except Exception as e:
+            logger.error(f"规划聚类路线时出错: {str(e)}", exc_info=True)
+            return None
+
+    def _get_executor(self) -> ThreadPoolExecutor:
+        """
+        懒创建执行阻塞HTTP请求的线程池，在多次规划之间复用
+        """
+        if self._executor is None:
+            self._executor = ThreadPoolExecutor(max_workers=self.max_concurrency, thread_name_prefix='route-planner')
+        return self._executor
+
+    async def _plan_leg_async(self, semaphore: asyncio.Semaphore, leg: Tuple) -> Dict[str, Any]:
+        """
+        在线程池中规划一段路线，并发数由信号量限制
+        """
+        async with semaphore:
+            loop = asyncio.get_running_loop()
+            return await loop.run_in_executor(self._get_executor(), self._plan_leg, *leg)
+
+    async def plan_cluster_route_async(self, cluster_data: Dict[str, Any],
+                                       semaphore: asyncio.Semaphore = None) -> Dict[str, Any]:
+        """
+        异步规划聚类路线，接乘客和送乘客两段路线并发规划
+        
+        参数:
+            cluster_data: 聚类数据
+            semaphore: 限制并发HTTP请求数的信号量，为None时按max_concurrency新建
             
-            logger.info("\n=== 路线规划最终结果 ===")
-            logger.info(f"总距离: {result['total_distance']/1000:.2f}km")
-            logger.info(f"总时间: {result['total_duration']/60:.0f}分钟")
-            logger.info(f"平均速度: {(result['total_distance']/1000)/(result['total_duration']/3600):.1f}km/h")
-            logger.info(f"总乘客数: {result['passenger_count']}")
-            logger.info("=====================================")
+        返回:
+            规划的路线信息
+        """
+        semaphore = semaphore or asyncio.Semaphore(self.max_concurrency)
+        try:
+            prepared = self._prepare_cluster(cluster_data)
+            if prepared is None:
+                return None
             
-            return result
+            if self.combined_route:
+                async with semaphore:
+                    loop = asyncio.get_running_loop()
+                    route, stops = await loop.run_in_executor(self._get_executor(), self._plan_combined, prepared)
+                return self._assemble_combined_route(cluster_data, prepared, route, stops)
+            
+            # 送乘客路段的起点是最后一个乘客的位置，与接乘客路线的规划结果无关，可以同时规划
+            pickup_route, dropoff_route = await asyncio.gather(
+                self._plan_leg_async(semaphore, self._pickup_leg(prepared)),
+                self._plan_leg_async(semaphore, self._dropoff_leg(prepared))
+            )
+            return self._assemble_cluster_route(cluster_data, prepared, pickup_route, dropoff_route)
             
         except Exception as e:
             logger.error(f"规划聚类路线时出错: {str(e)}", exc_info=True)
             return None
 
+    async def plan_multi_routes_async(self, clusters_data: Dict[int, Dict[str, Any]]) -> Dict[int, Dict[str, Any]]:
+        """
+        异步规划多条路线，所有聚类的所有路段共享max_concurrency个并发请求
+        
+        参数:
+            clusters_data: 聚类数据字典，键为聚类ID，值为聚类数据
+            
+        返回:
+            路线规划结果字典，键为聚类ID，值为路线数据
+        """
+        semaphore = asyncio.Semaphore(self.max_concurrency)
+        cluster_ids = [cluster_id for cluster_id in clusters_data if cluster_id != -1]
+        
+        logger.info(f"开始为 {len(cluster_ids)} 个聚类并发规划路线, 并发数 {self.max_concurrency}")
+        start = time.time()
+        
+        results = await asyncio.gather(*[
+            self.plan_cluster_route_async(clusters_data[cluster_id], semaphore)
+            for cluster_id in cluster_ids
+        ])
+        
+        routes = {}
+        for cluster_id, route in zip(cluster_ids, results):
+            if route:
+                routes[cluster_id] = route
+            else:
+                logger.warning(f"聚类 {cluster_id} 的路线规划失败")
+        
+        logger.info(f"多路线规划完成，成功规划 {len(routes)} 条路线, 耗时 {time.time() - start:.2f}秒")
+        return routes
+
     def plan_multi_routes(self, clusters_data: Dict[int, Dict[str, Any]]) -> Dict[int, Dict[str, Any]]:
         """
         规划多条路线，每个聚类一条路线
@@ -788,6 +1030,16 @@ class MultiRoutePlanner:
         返回:
             路线规划结果字典，键为聚类ID，值为路线数据
         """
+        if self.max_concurrency > 1:
+            coroutine = self.plan_multi_routes_async(clusters_data)
+            try:
+                asyncio.get_running_loop()
+            except RuntimeError:
+                return asyncio.run(coroutine)
+            # 已在事件循环中（如FastAPI的异步接口）时，在独立线程的新事件循环中执行
+            with ThreadPoolExecutor(max_workers=1) as runner:
+                return runner.submit(asyncio.run, coroutine).result()
+        
         routes = {}
         
         logger.info(f"开始为 {len(clusters_data)} 个聚类规划路线")
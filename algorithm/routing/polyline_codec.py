@@ -0,0 +1,193 @@
+import json
+import logging
+import numpy as np
+from typing import List, Dict, Any, Union, Optional
+
+from algorithm.routing.polyline_simplify import simplify_levels, pick_level, SIMPLIFY_TOLERANCES_M
+
+logger = logging.getLogger(__name__)
+
+# 坐标精度: 保留6位小数（约0.1米）
+PRECISION = 6
+# 存储格式标识，写入route_polyline以区分旧的JSON坐标列表
+ENCODED_FORMAT = 'polyline6'
+# 单个值最多需要的5位分组数（35位足以容纳经纬度差值的zigzag编码）
+MAX_CHUNKS = 7
+# 调度计划中的两段路线
+LEGS = ('pickup_route', 'dropoff_route')
+
+
+def _to_array(points: Union[List[Dict[str, float]], np.ndarray]) -> np.ndarray:
+    """
+    将坐标转换为(N, 2)的[lng, lat]数组，支持字典列表和数组
+    """
+    if isinstance(points, np.ndarray):
+        return points.reshape(-1, 2).astype(np.float64)
+    if not points:
+        return np.empty((0, 2), dtype=np.float64)
+    return np.array([[point['lng'], point['lat']] for point in points], dtype=np.float64)
+
+
+def encode_polyline(points: Union[List[Dict[str, float]], np.ndarray], precision: int = PRECISION) -> str:
+    """
+    编码折线（Google Polyline算法: 差分 + zigzag + 5位分组变长编码）
+
+    参数:
+        points: 坐标字典列表[{'lng', 'lat'}]或(N, 2)的[lng, lat]数组
+        precision: 小数位数
+
+    返回:
+        编码后的ASCII字符串，按Google约定每个点先纬度后经度
+    """
+    coords = _to_array(points)
+    if not len(coords):
+        return ''
+
+    scaled = np.round(coords[:, ::-1] * 10 ** precision).astype(np.int64)
+    deltas = np.diff(scaled, axis=0, prepend=np.zeros((1, 2), dtype=np.int64)).ravel()
+    zigzag = (deltas << 1) ^ (deltas >> 63)
+
+    # 每个值按低位在前拆成5位一组，除最后一组外都带0x20续位标记
+    chunks = (zigzag[:, None] >> (5 * np.arange(MAX_CHUNKS))) & 0x1F
+    bit_length = 1 + (zigzag[:, None] >= 32 ** np.arange(1, MAX_CHUNKS)).sum(axis=1)
+    position = np.arange(MAX_CHUNKS)[None, :]
+    chunks |= np.where(position < bit_length[:, None] - 1, 0x20, 0)
+    chars = (chunks + 63)[position < bit_length[:, None]]
+    return chars.astype(np.uint8).tobytes().decode('ascii')
+
+
+def decode_polyline_array(encoded: str, precision: int = PRECISION) -> np.ndarray:
+    """
+    解码折线为(N, 2)的[lng, lat]数组
+    """
+    if not encoded:
+        return np.empty((0, 2), dtype=np.float64)
+
+    data = np.frombuffer(encoded.encode('ascii'), dtype=np.uint8).astype(np.int64) - 63
+    # 不带续位标记的字节是一个值的最后一组
+    ends = np.flatnonzero((data & 0x20) == 0)
+    starts = np.concatenate([[0], ends[:-1] + 1])
+    position = np.arange(len(data)) - np.repeat(starts, ends - starts + 1)
+    zigzag = np.add.reduceat((data & 0x1F) << (5 * position), starts)
+    deltas = (zigzag >> 1) ^ -(zigzag & 1)
+
+    coords = np.cumsum(deltas.reshape(-1, 2), axis=0) / 10 ** precision
+    return coords[:, ::-1]
+
+
+def decode_polyline(encoded: str, precision: int = PRECISION) -> List[Dict[str, float]]:
+    """
+    解码折线为坐标字典列表[{'lng', 'lat'}]
+    """
+    return [{'lng': lng, 'lat': lat} for lng, lat in decode_polyline_array(encoded, precision).tolist()]
+
+
+def encode_levels(legs: Dict[str, Any], tolerances=SIMPLIFY_TOLERANCES_M) -> Dict[str, Dict[str, str]]:
+    """
+    预先计算各段折线在多个容差下的Douglas-Peucker简化结果
+
+    参数:
+        legs: {段名: 折线}
+        tolerances: 容差列表（米）
+
+    返回:
+        {容差: {段名: 编码折线}}，容差键为字符串以便JSON保存
+    """
+    simplified = {name: simplify_levels(_to_array(points), tolerances) for name, points in legs.items()}
+    return {str(tolerance): {name: encode_polyline(levels[tolerance]) for name, levels in simplified.items()}
+            for tolerance in tolerances}
+
+
+def pack_route_polyline(pickup: Union[List[Dict[str, float]], np.ndarray],
+                        dropoff: Union[List[Dict[str, float]], np.ndarray]) -> str:
+    """
+    生成dispatch_plan.route_polyline的存储内容: 接、送两段路线的编码折线及其多级简化结果
+    """
+    legs = {'pickup_route': _to_array(pickup), 'dropoff_route': _to_array(dropoff)}
+    return json.dumps({
+        'format': ENCODED_FORMAT,
+        'pickup_route': encode_polyline(legs['pickup_route']),
+        'dropoff_route': encode_polyline(legs['dropoff_route']),
+        'levels': encode_levels(legs)
+    })
+
+
+def _leg_polyline(leg):
+    """
+    段数据中的折线: 段可以直接是折线，也可以是带polyline字段的路线字典
+    """
+    return leg.get('polyline') if isinstance(leg, dict) else leg
+
+
+def _convert_legs(data: Dict[str, Any], convert) -> Dict[str, Any]:
+    """
+    对pickup_route、dropoff_route两段的折线应用convert
+
+    每段可以直接是折线，也可以是带polyline字段的路线字典（/api/routes/plan保存的格式）
+    """
+    result = dict(data)
+    for name in LEGS:
+        leg = data.get(name)
+        polyline = convert(_leg_polyline(leg) or [])
+        result[name] = dict(leg, polyline=polyline) if isinstance(leg, dict) else polyline
+    return result
+
+
+def _select_level(data: Dict[str, Any], tolerance: Optional[float]) -> Dict[str, Any]:
+    """
+    按容差选择预计算的简化级别替换各段的编码折线，返回结果不含levels字段
+
+    没有预计算级别的数据（旧数据）在读取时简化
+    """
+    result = {key: value for key, value in data.items() if key != 'levels'}
+    if tolerance is None:
+        return result
+
+    levels = data.get('levels')
+    if levels is None:
+        levels = encode_levels({name: decode_polyline_array(_leg_polyline(data.get(name)) or '') for name in LEGS})
+    level = pick_level(levels, tolerance)
+    if level is None:
+        return result
+    for name in LEGS:
+        leg = result.get(name)
+        polyline = levels[level].get(name, '')
+        result[name] = dict(leg, polyline=polyline) if isinstance(leg, dict) else polyline
+    return result
+
+
+def unpack_route_polyline(stored: str, tolerance: Optional[float] = None) -> Dict[str, Any]:
+    """
+    读取route_polyline，返回坐标字典列表形式的折线
+
+    参数:
+        stored: route_polyline字段内容
+        tolerance: 简化容差（米），为None时返回原始折线
+
+    兼容旧数据中直接保存的JSON坐标列表
+    """
+    data = json.loads(stored) if isinstance(stored, str) else stored
+    if not isinstance(data, dict) or data.get('format') != ENCODED_FORMAT:
+        if tolerance is None or not isinstance(data, dict):
+            return data
+        data = encoded_route_polyline(data)
+    result = _convert_legs(_select_level(data, tolerance), lambda polyline: decode_polyline(polyline or ''))
+    del result['format']
+    return result
+
+
+def encoded_route_polyline(stored: str, tolerance: Optional[float] = None) -> Dict[str, Any]:
+    """
+    读取route_polyline，返回编码折线形式，带format字段
+
+    参数:
+        stored: route_polyline字段内容
+        tolerance: 简化容差（米），为None时返回原始折线
+
+    旧数据中的JSON坐标列表在读取时编码
+    """
+    data = json.loads(stored) if isinstance(stored, str) else stored
+    if not isinstance(data, dict) or data.get('format') != ENCODED_FORMAT:
+        data = _convert_legs(data if isinstance(data, dict) else {}, encode_polyline)
+        data['format'] = ENCODED_FORMAT
+    return _select_level(data, tolerance)
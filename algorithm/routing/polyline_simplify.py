@@ -0,0 +1,109 @@
+import math
+import logging
+import numpy as np
+from typing import List, Dict, Union
+
+from algorithm.clustering.spatial_index import EARTH_RADIUS_KM
+
+logger = logging.getLogger(__name__)
+
+# 保存调度计划时预先计算的简化容差（米）
+SIMPLIFY_TOLERANCES_M = (5, 20, 80)
+# 缩放级别为0时赤道处每像素代表的米数（256像素瓦片）
+METERS_PER_PIXEL_ZOOM0 = 156543.03392
+
+
+def _project(coords: np.ndarray) -> np.ndarray:
+    """
+    将[lng, lat]坐标投影为以米为单位的局部平面坐标（等距圆柱投影，适用于城市范围）
+    """
+    lat0 = np.radians(coords[:, 1].mean())
+    radians = np.radians(coords)
+    return np.column_stack([radians[:, 0] * np.cos(lat0), radians[:, 1]]) * EARTH_RADIUS_KM * 1000
+
+
+def dp_importance(coords: np.ndarray, floor: float = 0.0) -> np.ndarray:
+    """
+    计算每个点在Douglas-Peucker简化中被保留的最大容差
+
+    递归过程中每个点的重要度为它被选为分割点时的偏离距离，且不超过父分割点的重要度，
+    因此容差为t的简化结果恰好是重要度大于t的点，一次计算即可得到任意容差的结果。
+
+    参数:
+        coords: (N, 2)的[lng, lat]数组
+        floor: 偏离距离不超过该值时停止细分（只需要更大容差的结果时可以跳过大量短线段）
+
+    返回:
+        长度为N的重要度数组（米），首尾点为无穷大；未细分的点重要度为0
+    """
+    n = len(coords)
+    importance = np.zeros(n)
+    if n == 0:
+        return importance
+    importance[0] = importance[-1] = np.inf
+    if n < 3:
+        return importance
+
+    points = _project(coords)
+    stack = [(0, n - 1, np.inf)]
+    while stack:
+        start, end, limit = stack.pop()
+        if end - start < 2:
+            continue
+
+        # 中间点到线段start-end的距离
+        a, b = points[start], points[end]
+        segment = b - a
+        length_sq = segment @ segment
+        middle = points[start + 1:end]
+        if length_sq > 0:
+            t = np.clip((middle - a) @ segment / length_sq, 0.0, 1.0)
+            offsets = middle - (a + t[:, None] * segment)
+        else:
+            offsets = middle - a
+        distances = np.hypot(offsets[:, 0], offsets[:, 1])
+
+        k = int(np.argmax(distances))
+        split = start + 1 + k
+        importance[split] = min(distances[k], limit)
+        if importance[split] <= floor:
+            continue
+        stack.append((start, split, importance[split]))
+        stack.append((split, end, importance[split]))
+
+    return importance
+
+
+def simplify_levels(points: Union[List[Dict[str, float]], np.ndarray],
+                    tolerances=SIMPLIFY_TOLERANCES_M) -> Dict[float, np.ndarray]:
+    """
+    按多个容差简化折线
+
+    参数:
+        points: 坐标字典列表[{'lng', 'lat'}]或(N, 2)的[lng, lat]数组
+        tolerances: 容差列表（米）
+
+    返回:
+        {容差: 简化后的(M, 2)数组}
+    """
+    if isinstance(points, np.ndarray):
+        coords = points.reshape(-1, 2).astype(np.float64)
+    else:
+        coords = np.array([[point['lng'], point['lat']] for point in points], dtype=np.float64).reshape(-1, 2)
+    importance = dp_importance(coords, floor=min(tolerances))
+    return {tolerance: coords[importance > tolerance] for tolerance in tolerances}
+
+
+def zoom_to_tolerance(zoom: float, lat: float = 31.0) -> float:
+    """
+    地图缩放级别对应的简化容差（米）: 一个像素在该纬度代表的距离
+    """
+    return METERS_PER_PIXEL_ZOOM0 * math.cos(math.radians(lat)) / 2 ** zoom
+
+
+def pick_level(levels, tolerance: float):
+    """
+    选择不超过请求容差的最大预计算容差，没有合适的级别时返回None（使用原始折线）
+    """
+    candidates = [level for level in levels if float(level) <= tolerance]
+    return max(candidates, key=float) if candidates else None
@@ -0,0 +1,160 @@
+import sqlite3
+import threading
+import tempfile
+import os
+import time
+import logging
+from datetime import datetime
+
+logger = logging.getLogger(__name__)
+
+# 默认状态文件，调度进程和API进程使用同一路径即可共享配额
+DEFAULT_LIMITER_PATH = os.path.join(tempfile.gettempdir(), "datastar_rate_limit.sqlite")
+
+
+class TokenBucketLimiter:
+    def __init__(self,
+                 qps=None,               # 每秒请求数
+                 daily_quota=None,       # 每日请求配额
+                 path=None,              # SQLite状态文件路径
+                 name='amap',            # 限流器名称，同一文件可保存多个限流器
+                 burst=None              # 桶容量，默认等于qps
+                ):
+        """
+        跨线程、跨进程共享的令牌桶限流器
+
+        令牌数和当日已用配额保存在SQLite文件中，每次取令牌在一个写事务（BEGIN IMMEDIATE）内
+        完成补充和扣减，因此调度进程和API进程中的所有线程共同遵守同一QPS和每日配额。
+        令牌不足时调用方排队等待，而不是先发出请求再因限流被拒绝。
+
+        参数:
+            qps: 每秒请求数，为None时读取环境变量AMAP_QPS（默认3）
+            daily_quota: 每日请求配额，为None时读取环境变量AMAP_DAILY_QUOTA（默认5000）
+            path: SQLite文件路径，为None时读取环境变量RATE_LIMIT_PATH，否则使用系统临时目录
+            name: 限流器名称
+            burst: 桶容量（允许的瞬时突发请求数），默认等于qps
+        """
+        self.qps = float(qps if qps is not None else os.getenv("AMAP_QPS", 3))
+        self.daily_quota = int(daily_quota if daily_quota is not None else os.getenv("AMAP_DAILY_QUOTA", 5000))
+        self.path = path or os.getenv("RATE_LIMIT_PATH") or DEFAULT_LIMITER_PATH
+        self.name = name
+        self.burst = float(burst if burst is not None else max(1.0, self.qps))
+
+        self._local = threading.local()
+
+        conn = self._connection()
+        conn.execute("""
+            CREATE TABLE IF NOT EXISTS token_bucket (
+                name TEXT PRIMARY KEY,
+                tokens REAL NOT NULL,
+                updated_at REAL NOT NULL,
+                day TEXT NOT NULL,
+                day_count INTEGER NOT NULL
+            )
+        """)
+        conn.execute(
+            "INSERT OR IGNORE INTO token_bucket (name, tokens, updated_at, day, day_count) VALUES (?, ?, ?, ?, 0)",
+            (self.name, self.burst, time.time(), self._today())
+        )
+        conn.commit()
+
+        logger.info(f"初始化令牌桶限流器: {self.name}, QPS={self.qps}, 每日配额={self.daily_quota}, 状态文件={self.path}")
+
+    def _connection(self) -> sqlite3.Connection:
+        """
+        每个线程使用独立的连接；事务由本类显式控制
+        """
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=30, isolation_level=None)
+            conn.execute("PRAGMA journal_mode=WAL")
+            self._local.conn = conn
+        return conn
+
+    @staticmethod
+    def _today() -> str:
+        return datetime.now().strftime('%Y-%m-%d')
+
+    def _try_acquire(self):
+        """
+        在一个写事务内补充令牌并尝试扣减一个
+
+        返回:
+            (是否取得令牌, 需要等待的秒数)；当日配额用完时返回 (False, None)
+        """
+        conn = self._connection()
+        now = time.time()
+        today = self._today()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            tokens, updated_at, day, day_count = conn.execute(
+                "SELECT tokens, updated_at, day, day_count FROM token_bucket WHERE name = ?",
+                (self.name,)
+            ).fetchone()
+
+            if day != today:
+                day, day_count = today, 0
+            tokens = min(self.burst, tokens + max(0.0, now - updated_at) * self.qps)
+
+            if day_count >= self.daily_quota:
+                acquired, wait = False, None
+            elif tokens >= 1:
+                tokens -= 1
+                day_count += 1
+                acquired, wait = True, 0.0
+            else:
+                acquired, wait = False, (1 - tokens) / self.qps
+
+            conn.execute(
+                "UPDATE token_bucket SET tokens = ?, updated_at = ?, day = ?, day_count = ? WHERE name = ?",
+                (tokens, now, day, day_count, self.name)
+            )
+            conn.execute("COMMIT")
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+        return acquired, wait
+
+    def acquire(self, timeout=None) -> bool:
+        """
+        取得一个令牌，令牌不足时排队等待
+
+        参数:
+            timeout: 最长等待时间（秒），为None时一直等待
+
+        返回:
+            是否取得令牌；当日配额已用完或等待超时时返回False
+        """
+        deadline = None if timeout is None else time.time() + timeout
+        while True:
+            acquired, wait = self._try_acquire()
+            if acquired:
+                return True
+            if wait is None:
+                logger.error(f"限流器 {self.name} 今日配额 {self.daily_quota} 已用完")
+                return False
+            if deadline is not None and time.time() + wait > deadline:
+                logger.warning(f"限流器 {self.name} 等待令牌超时")
+                return False
+            time.sleep(wait)
+
+    def drain(self):
+        """
+        清空桶中的令牌
+
+        服务端仍返回限流错误时调用，之后的请求需要等待令牌重新补充
+        """
+        conn = self._connection()
+        conn.execute(
+            "UPDATE token_bucket SET tokens = 0, updated_at = ? WHERE name = ?",
+            (time.time(), self.name)
+        )
+
+    def remaining_quota(self) -> int:
+        """
+        当日剩余配额
+        """
+        day, day_count = self._connection().execute(
+            "SELECT day, day_count FROM token_bucket WHERE name = ?", (self.name,)
+        ).fetchone()
+        return self.daily_quota if day != self._today() else max(0, self.daily_quota - day_count)
@@ -0,0 +1,374 @@
+import numpy as np
+import pandas as pd
+import heapq
+import math
+import os
+import logging
+from sklearn.neighbors import BallTree
+from typing import List, Dict, Any, Optional, Tuple
+
+from algorithm.clustering.spatial_index import haversine_km, EARTH_RADIUS_KM
+
+logger = logging.getLogger(__name__)
+
+# 边表缺少速度时使用的默认车速（公里/小时）
+DEFAULT_SPEED_KMH = 40
+# 起终点到最近路网节点的接驳速度（公里/小时）
+ACCESS_SPEED_KMH = 20
+# 节点去重时坐标保留的小数位数（6位约0.1米）
+NODE_PRECISION = 6
+
+
+class RoadGraph:
+    def __init__(self,
+                 node_lat: np.ndarray,    # 节点纬度数组
+                 node_lng: np.ndarray,    # 节点经度数组
+                 indptr: np.ndarray,      # 正向CSR行指针
+                 indices: np.ndarray,     # 正向CSR列（边的终点）
+                 length: np.ndarray,      # 边长度（米）
+                 travel_time: np.ndarray, # 边通行时间（秒）
+                 name_index: np.ndarray,  # 边所在道路名称在names中的下标
+                 names: List[str],        # 道路名称表
+                 max_snap_km=0.5          # 起终点与最近节点的最大距离，超出视为不在服务区内
+                ):
+        """
+        离线路网，按CSR压缩数组保存，使用双向A*回答最短时间路径查询
+
+        正向CSR用于从起点出发的搜索，构造时同时生成反向CSR供从终点出发的搜索使用。
+        启发函数为到目标的直线距离除以路网最高车速，不会高估剩余时间，
+        双向搜索使用两侧启发函数的平均值作为势函数，保证结果与Dijkstra一致。
+
+        参数:
+            node_lat, node_lng: 节点坐标（度）
+            indptr, indices: 正向邻接的CSR数组，节点u的出边为indices[indptr[u]:indptr[u+1]]
+            length: 每条边的长度（米）
+            travel_time: 每条边的通行时间（秒）
+            name_index: 每条边的道路名称下标
+            names: 道路名称表
+            max_snap_km: 起终点吸附到路网节点的最大距离（公里）
+        """
+        self.node_lat = np.asarray(node_lat, dtype=np.float64)
+        self.node_lng = np.asarray(node_lng, dtype=np.float64)
+        self.indptr = np.asarray(indptr, dtype=np.int64)
+        self.indices = np.asarray(indices, dtype=np.int64)
+        self.length = np.asarray(length, dtype=np.float64)
+        self.travel_time = np.asarray(travel_time, dtype=np.float64)
+        self.name_index = np.asarray(name_index, dtype=np.int64)
+        self.names = list(names)
+        self.max_snap_km = max_snap_km
+
+        n = len(self.node_lat)
+
+        # 反向CSR: 按终点排序的边，rev_edge记录对应的正向边下标
+        sources = np.repeat(np.arange(n, dtype=np.int64), np.diff(self.indptr))
+        self.rev_edge = np.argsort(self.indices, kind='stable')
+        self.rev_indices = sources[self.rev_edge]
+        self.rev_indptr = np.zeros(n + 1, dtype=np.int64)
+        np.cumsum(np.bincount(self.indices, minlength=n), out=self.rev_indptr[1:])
+
+        # A*启发函数使用的最高车速（米/秒）
+        speeds = self.length / np.maximum(self.travel_time, 1e-9)
+        self.max_speed = float(speeds.max()) if len(speeds) else DEFAULT_SPEED_KMH / 3.6
+
+        self._tree = BallTree(np.radians(np.column_stack([self.node_lat, self.node_lng])), metric='haversine')
+
+        # 搜索循环逐个访问元素，使用Python列表避免NumPy标量的开销
+        self._lat_rad = np.radians(self.node_lat).tolist()
+        self._lng_rad = np.radians(self.node_lng).tolist()
+        self._cos_lat = np.cos(np.radians(self.node_lat)).tolist()
+        self._adjacency = (
+            (self.indptr.tolist(), self.indices.tolist(), list(range(len(self.indices)))),
+            (self.rev_indptr.tolist(), self.rev_indices.tolist(), self.rev_edge.tolist()),
+        )
+        self._travel_time = self.travel_time.tolist()
+        # 距离（米）换算为最短通行时间（秒）的系数
+        self._seconds_per_radian = EARTH_RADIUS_KM * 1000 / self.max_speed
+
+        logger.info(f"离线路网加载完成: {n} 个节点, {len(self.indices)} 条边")
+
+    @classmethod
+    def from_edge_csv(cls, path: str, **kwargs) -> 'RoadGraph':
+        """
+        从边表CSV构建路网
+
+        必需列: from_lng, from_lat, to_lng, to_lat
+        可选列: length（米，缺省按直线距离计算）、speed（公里/小时，缺省40）、
+               oneway（0/1，缺省0即双向）、name（道路名称）
+        坐标相同（保留6位小数）的端点视为同一节点。
+        """
+        edges = pd.read_csv(path)
+
+        from_lat = edges['from_lat'].to_numpy(dtype=np.float64)
+        from_lng = edges['from_lng'].to_numpy(dtype=np.float64)
+        to_lat = edges['to_lat'].to_numpy(dtype=np.float64)
+        to_lng = edges['to_lng'].to_numpy(dtype=np.float64)
+
+        if 'length' in edges:
+            length = edges['length'].to_numpy(dtype=np.float64)
+        else:
+            length = haversine_km(from_lat, from_lng, to_lat, to_lng) * 1000
+        speed = edges['speed'].fillna(DEFAULT_SPEED_KMH).to_numpy(dtype=np.float64) if 'speed' in edges \
+            else np.full(len(edges), DEFAULT_SPEED_KMH, dtype=np.float64)
+        oneway = edges['oneway'].fillna(0).to_numpy().astype(bool) if 'oneway' in edges \
+            else np.zeros(len(edges), dtype=bool)
+        road_names = edges['name'].fillna('').astype(str).to_numpy() if 'name' in edges \
+            else np.full(len(edges), '', dtype=object)
+
+        # 端点坐标去重得到节点编号
+        endpoints = np.round(np.column_stack([
+            np.concatenate([from_lat, to_lat]),
+            np.concatenate([from_lng, to_lng])
+        ]), NODE_PRECISION)
+        nodes, inverse = np.unique(endpoints, axis=0, return_inverse=True)
+        inverse = inverse.ravel()
+        u, v = inverse[:len(edges)], inverse[len(edges):]
+
+        # 双向道路补充反方向的边
+        u = np.concatenate([u, v[~oneway]])
+        v = np.concatenate([v, inverse[:len(edges)][~oneway]])
+        length = np.concatenate([length, length[~oneway]])
+        speed = np.concatenate([speed, speed[~oneway]])
+        road_names = np.concatenate([road_names, road_names[~oneway]])
+
+        names, name_index = np.unique(road_names, return_inverse=True)
+        return cls._from_edges(nodes[:, 0], nodes[:, 1], u, v, length,
+                               length / (speed / 3.6), name_index, names.tolist(), **kwargs)
+
+    @classmethod
+    def _from_edges(cls, node_lat, node_lng, u, v, length, travel_time, name_index, names, **kwargs) -> 'RoadGraph':
+        """
+        由边列表按起点排序生成CSR数组
+        """
+        order = np.lexsort((v, u))
+        indptr = np.zeros(len(node_lat) + 1, dtype=np.int64)
+        np.cumsum(np.bincount(u, minlength=len(node_lat)), out=indptr[1:])
+        return cls(node_lat, node_lng, indptr, v[order], length[order],
+                   travel_time[order], name_index[order], names, **kwargs)
+
+    @classmethod
+    def load(cls, path: str, **kwargs) -> 'RoadGraph':
+        """
+        加载save()保存的npz文件，无需重新解析CSV
+        """
+        data = np.load(path, allow_pickle=False)
+        return cls(data['node_lat'], data['node_lng'], data['indptr'], data['indices'],
+                   data['length'], data['travel_time'], data['name_index'],
+                   data['names'].tolist(), **kwargs)
+
+    def save(self, path: str):
+        """
+        以npz格式保存CSR数组
+        """
+        np.savez_compressed(path, node_lat=self.node_lat, node_lng=self.node_lng,
+                            indptr=self.indptr, indices=self.indices, length=self.length,
+                            travel_time=self.travel_time, name_index=self.name_index,
+                            names=np.array(self.names, dtype=str))
+
+    def snap(self, location: Dict[str, float]) -> Tuple[int, float]:
+        """
+        查找距离坐标最近的路网节点
+
+        返回:
+            (节点下标, 距离公里)
+        """
+        distance, index = self._tree.query(np.radians([[location['lat'], location['lng']]]), k=1)
+        return int(index[0, 0]), float(distance[0, 0] * EARTH_RADIUS_KM)
+
+    def _heuristic(self, node: int, target: int) -> float:
+        """
+        直线距离按最高车速行驶所需的时间（秒），不高估实际通行时间
+        """
+        dlat = self._lat_rad[target] - self._lat_rad[node]
+        dlng = self._lng_rad[target] - self._lng_rad[node]
+        a = math.sin(dlat / 2) ** 2 + self._cos_lat[node] * self._cos_lat[target] * math.sin(dlng / 2) ** 2
+        return 2 * math.asin(min(1.0, math.sqrt(a))) * self._seconds_per_radian
+
+    def shortest_path(self, source: int, target: int) -> Optional[List[int]]:
+        """
+        双向A*求最短时间路径
+
+        参数:
+            source, target: 起点、终点节点下标
+
+        返回:
+            路径经过的正向边下标列表，不可达时返回None
+        """
+        if source == target:
+            return []
+
+        # 平均势函数: 正向搜索使用p(v)，反向搜索使用-p(v)，两侧的约化边权均非负
+        potentials = {}
+
+        def potential(node):
+            value = potentials.get(node)
+            if value is None:
+                value = (self._heuristic(node, target) - self._heuristic(node, source)) / 2
+                potentials[node] = value
+            return value
+
+        dist = ({source: 0.0}, {target: 0.0})
+        parent = ({source: -1}, {target: -1})  # 到达节点所经过的正向边
+        settled = (set(), set())
+        heaps = ([(potential(source), source)], [(-potential(target), target)])
+        travel_time = self._travel_time
+
+        best, meeting = float('inf'), -1
+        while heaps[0] and heaps[1]:
+            # 两侧最小键值之和不小于当前最优值时，最优路径已确定
+            if heaps[0][0][0] + heaps[1][0][0] >= best:
+                break
+
+            side = 0 if heaps[0][0][0] <= heaps[1][0][0] else 1
+            _, node = heapq.heappop(heaps[side])
+            if node in settled[side]:
+                continue
+            settled[side].add(node)
+
+            indptr, indices, edges = self._adjacency[side]
+            sign = 1.0 if side == 0 else -1.0
+            node_dist = dist[side][node]
+            for k in range(indptr[node], indptr[node + 1]):
+                neighbor = indices[k]
+                edge = edges[k]
+                new_dist = node_dist + travel_time[edge]
+                if new_dist < dist[side].get(neighbor, float('inf')):
+                    dist[side][neighbor] = new_dist
+                    parent[side][neighbor] = edge
+                    heapq.heappush(heaps[side], (new_dist + sign * potential(neighbor), neighbor))
+                    other = dist[1 - side].get(neighbor)
+                    if other is not None and new_dist + other < best:
+                        best, meeting = new_dist + other, neighbor
+
+        if meeting < 0:
+            return None
+
+        # 从相遇点分别回溯到起点和终点
+        forward = []
+        node = meeting
+        while parent[0][node] >= 0:
+            edge = parent[0][node]
+            forward.append(edge)
+            node = self._edge_source(edge)
+        backward = []
+        node = meeting
+        while parent[1][node] >= 0:
+            edge = parent[1][node]
+            backward.append(edge)
+            node = int(self.indices[edge])
+        return forward[::-1] + backward
+
+    def _edge_source(self, edge: int) -> int:
+        """
+        正向边的起点节点
+        """
+        return int(np.searchsorted(self.indptr, edge, side='right') - 1)
+
+    def _leg(self, origin: Dict[str, float], destination: Dict[str, float]) -> Optional[Dict[str, Any]]:
+        """
+        规划两点之间的一段路线，起终点不在服务区内或不可达时返回None
+        """
+        source, source_km = self.snap(origin)
+        target, target_km = self.snap(destination)
+        if source_km > self.max_snap_km or target_km > self.max_snap_km:
+            logger.info(f"起终点距离路网过远（{source_km:.2f}km, {target_km:.2f}km），离线路网无法规划")
+            return None
+
+        edges = self.shortest_path(source, target)
+        if edges is None:
+            logger.info("离线路网中起终点不连通")
+            return None
+
+        edges = np.asarray(edges, dtype=np.int64)
+        access_seconds = (source_km + target_km) / ACCESS_SPEED_KMH * 3600
+
+        # 路径节点: 起点吸附节点 + 每条边的终点
+        path_nodes = np.concatenate([[source], self.indices[edges]]).astype(np.int64)
+        polyline = [{'lng': origin['lng'], 'lat': origin['lat']}]
+        polyline.extend({'lng': float(lng), 'lat': float(lat)}
+                        for lat, lng in zip(self.node_lat[path_nodes], self.node_lng[path_nodes]))
+        polyline.append({'lng': destination['lng'], 'lat': destination['lat']})
+
+        # 相同道路名称的连续边合并为一个步骤，步骤格式与高德API一致
+        steps = []
+        start = 0
+        for i in range(1, len(edges) + 1):
+            if i < len(edges) and self.name_index[edges[i]] == self.name_index[edges[start]]:
+                continue
+            run = edges[start:i]
+            points = path_nodes[start:i + 1]
+            name = self.names[self.name_index[run[0]]]
+            steps.append({
+                'instruction': f"沿{name}行驶" if name else "沿道路行驶",
+                'road': name,
+                'distance': str(round(float(self.length[run].sum()))),
+                'duration': str(round(float(self.travel_time[run].sum()))),
+                'polyline': ';'.join(f"{lng},{lat}" for lat, lng in
+                                     zip(self.node_lat[points], self.node_lng[points])),
+                'action': "",
+                'assistant_action': ""
+            })
+            start = i
+
+        return {
+            'distance': float(self.length[edges].sum()) + (source_km + target_km) * 1000,
+            'duration': float(self.travel_time[edges].sum()) + access_seconds,
+            'steps': steps,
+            'polyline': polyline
+        }
+
+    def route(self, origin: Dict[str, float], destination: Dict[str, float],
+              waypoints: List[Dict[str, float]] = None) -> Optional[Dict[str, Any]]:
+        """
+        按顺序经过途经点规划路线，返回与MultiRoutePlanner.plan_single_route相同结构的结果
+
+        返回:
+            路线信息，任一段无法规划时返回None
+        """
+        waypoints = waypoints or []
+        stops = [origin] + list(waypoints) + [destination]
+
+        route_info = {
+            'distance': 0.0,
+            'duration': 0,
+            'toll_distance': 0,
+            'toll': 0,
+            'steps': [],
+            'polyline': [],
+            'start_location': origin,
+            'end_location': destination,
+            'waypoints': waypoints,
+            'source': 'offline'  # 标记为离线路网规划
+        }
+        duration = 0.0
+        for leg_origin, leg_destination in zip(stops[:-1], stops[1:]):
+            leg = self._leg(leg_origin, leg_destination)
+            if leg is None:
+                return None
+            route_info['distance'] += leg['distance']
+            duration += leg['duration']
+            route_info['steps'].extend(leg['steps'])
+            # 相邻两段在途经点处重合，去掉重复的点
+            route_info['polyline'].extend(leg['polyline'][1:] if route_info['polyline'] else leg['polyline'])
+
+        route_info['duration'] = int(round(duration))
+        route_info['avg_speed'] = (route_info['distance'] / 1000) / (duration / 3600) if duration > 0 else 0
+        route_info['waypoints_count'] = len(waypoints)
+        return route_info
+
+
+def load_road_graph(path: str = None, **kwargs) -> Optional[RoadGraph]:
+    """
+    加载离线路网，path为None时读取环境变量ROAD_GRAPH_PATH，未配置时返回None
+
+    .npz文件按save()的格式加载，其余按边表CSV解析
+    """
+    path = path or os.getenv("ROAD_GRAPH_PATH")
+    if not path:
+        return None
+    try:
+        if path.endswith('.npz'):
+            return RoadGraph.load(path, **kwargs)
+        return RoadGraph.from_edge_csv(path, **kwargs)
+    except Exception as e:
+        logger.error(f"加载离线路网失败: {str(e)}")
+        return None
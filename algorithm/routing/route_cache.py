@@ -0,0 +1,197 @@
+import sqlite3
+import threading
+import tempfile
+import hashlib
+import json
+import os
+import time
+import logging
+from datetime import datetime
+from typing import Dict, Any, Optional
+
+logger = logging.getLogger(__name__)
+
+# 默认缓存文件，调度进程和API进程使用同一路径即可共享缓存
+DEFAULT_CACHE_PATH = os.path.join(tempfile.gettempdir(), "datastar_route_cache.sqlite")
+
+
+class RouteCache:
+    def __init__(self,
+                 path=None,               # SQLite文件路径
+                 ttl_seconds=24 * 3600,   # 缓存有效期（秒）
+                 max_entries=100000,      # 最大缓存条数，超出后按最近访问时间淘汰
+                 coord_precision=5,       # 坐标量化的小数位数（5位约1米）
+                 bucket_minutes=60,       # 一天内的时间段划分（分钟），不同时段的路况分别缓存
+                 evict_every=200          # 每写入多少条检查一次淘汰
+                ):
+        """
+        高德地图API响应的磁盘缓存
+
+        使用WAL模式的SQLite文件保存响应，多个线程、多个进程（调度进程和API进程）
+        可以同时读写同一个缓存文件。缓存键由端点、量化后的起终点坐标、按顺序排列的途经点、
+        其余请求参数（如strategy）、当前所处的时间段以及非默认的API地址组成。
+
+        参数:
+            path: SQLite文件路径，为None时读取环境变量ROUTE_CACHE_PATH，否则使用系统临时目录
+            ttl_seconds: 缓存有效期（秒）
+            max_entries: 最大缓存条数
+            coord_precision: 坐标量化的小数位数
+            bucket_minutes: 时间段长度（分钟）
+            evict_every: 每写入多少条检查一次过期和容量淘汰
+        """
+        self.path = path or os.getenv("ROUTE_CACHE_PATH") or DEFAULT_CACHE_PATH
+        self.ttl_seconds = ttl_seconds
+        self.max_entries = max_entries
+        self.coord_precision = coord_precision
+        self.bucket_minutes = bucket_minutes
+        self.evict_every = evict_every
+
+        self._local = threading.local()
+        self._writes = 0
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+        conn = self._connection()
+        conn.execute("""
+            CREATE TABLE IF NOT EXISTS route_cache (
+                key TEXT PRIMARY KEY,
+                response TEXT NOT NULL,
+                created_at REAL NOT NULL,
+                accessed_at REAL NOT NULL
+            )
+        """)
+        conn.execute("CREATE INDEX IF NOT EXISTS idx_route_cache_accessed ON route_cache (accessed_at)")
+        conn.commit()
+
+        logger.info(f"初始化路线缓存: {self.path}, 有效期={ttl_seconds}秒, 最大条数={max_entries}")
+
+    def _connection(self) -> sqlite3.Connection:
+        """
+        每个线程使用独立的连接
+        """
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=10)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+        return conn
+
+    def _quantize(self, location: str) -> str:
+        """
+        量化 "lng,lat" 格式的坐标
+        """
+        lng, lat = location.split(',')
+        return f"{round(float(lng), self.coord_precision)},{round(float(lat), self.coord_precision)}"
+
+    def make_key(self, endpoint: str, params: Dict[str, Any], now: Optional[datetime] = None,
+                 base_url: Optional[str] = None) -> str:
+        """
+        构建缓存键
+
+        参数:
+            endpoint: API端点，如 'direction/driving'
+            params: 请求参数（不含key）
+            now: 用于确定时间段的时间，默认为当前时间
+            base_url: 非默认的API地址（如本地替身服务），计入缓存键，与正式API的响应分开缓存
+
+        返回:
+            缓存键（SHA1十六进制）
+        """
+        now = now or datetime.now()
+        normalized = {}
+        for name, value in params.items():
+            if name == 'key':
+                continue
+            if name in ('origin', 'destination'):
+                value = self._quantize(value)
+            elif name == 'waypoints' and value:
+                # 途经点顺序决定路线，保持原顺序
+                value = ';'.join(self._quantize(point) for point in value.split(';'))
+            normalized[name] = str(value)
+        normalized['_bucket'] = (now.hour * 60 + now.minute) // self.bucket_minutes
+        if base_url:
+            normalized['_base_url'] = base_url.rstrip('/')
+
+        raw = endpoint + '|' + json.dumps(normalized, sort_keys=True)
+        return hashlib.sha1(raw.encode('utf-8')).hexdigest()
+
+    def get(self, key: str) -> Optional[Dict[str, Any]]:
+        """
+        读取未过期的缓存响应，命中时刷新访问时间
+        """
+        now = time.time()
+        try:
+            conn = self._connection()
+            row = conn.execute(
+                "SELECT response FROM route_cache WHERE key = ? AND created_at >= ?",
+                (key, now - self.ttl_seconds)
+            ).fetchone()
+            if row is None:
+                self.misses += 1
+                return None
+            conn.execute("UPDATE route_cache SET accessed_at = ? WHERE key = ?", (now, key))
+            conn.commit()
+            self.hits += 1
+            return json.loads(row[0])
+        except sqlite3.Error as e:
+            logger.warning(f"读取路线缓存失败: {str(e)}")
+            return None
+
+    def put(self, key: str, response: Dict[str, Any]):
+        """
+        写入响应，定期淘汰过期条目和超出容量的最久未访问条目
+        """
+        now = time.time()
+        try:
+            conn = self._connection()
+            conn.execute(
+                "INSERT OR REPLACE INTO route_cache (key, response, created_at, accessed_at) VALUES (?, ?, ?, ?)",
+                (key, json.dumps(response, ensure_ascii=False), now, now)
+            )
+            conn.commit()
+        except sqlite3.Error as e:
+            logger.warning(f"写入路线缓存失败: {str(e)}")
+            return
+
+        with self._lock:
+            self._writes += 1
+            evict = self._writes % self.evict_every == 0
+        if evict:
+            self.evict()
+
+    def evict(self) -> int:
+        """
+        删除过期条目，并在超出最大条数时按最近访问时间淘汰
+
+        返回:
+            删除的条数
+        """
+        try:
+            conn = self._connection()
+            deleted = conn.execute(
+                "DELETE FROM route_cache WHERE created_at < ?", (time.time() - self.ttl_seconds,)
+            ).rowcount
+            count = conn.execute("SELECT COUNT(*) FROM route_cache").fetchone()[0]
+            if count > self.max_entries:
+                deleted += conn.execute(
+                    "DELETE FROM route_cache WHERE key IN "
+                    "(SELECT key FROM route_cache ORDER BY accessed_at LIMIT ?)",
+                    (count - self.max_entries,)
+                ).rowcount
+            conn.commit()
+            if deleted:
+                logger.info(f"路线缓存淘汰 {deleted} 条")
+            return deleted
+        except sqlite3.Error as e:
+            logger.warning(f"淘汰路线缓存失败: {str(e)}")
+            return 0
+
+    def clear(self):
+        """
+        清空缓存
+        """
+        conn = self._connection()
+        conn.execute("DELETE FROM route_cache")
+        conn.commit()
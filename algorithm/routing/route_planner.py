@@ -5,13 +5,14 @@ import os
 from dotenv import load_dotenv
 
 class RoutePlanner:
-    def __init__(self):
+    def __init__(self, base_url=None):
         """
         初始化路线规划器
+        :param base_url: 高德API地址，为None时读取环境变量AMAP_BASE_URL，默认https://restapi.amap.com/v3
         """
         load_dotenv()
         self.amap_key = os.getenv("AMAP_KEY")
-        self.base_url = "https://restapi.amap.com/v3"
+        self.base_url = (base_url or os.getenv("AMAP_BASE_URL") or "https://restapi.amap.com/v3").rstrip('/')
 
     def _call_amap_api(self, endpoint: str, params: Dict[str, Any]) -> Dict[str, Any]:
         """
@@ -0,0 +1,299 @@
+import numpy as np
+import time
+from typing import List, Optional
+import logging
+
+from algorithm.clustering.spatial_index import haversine_km
+
+logger = logging.getLogger(__name__)
+
+# 中间站点数不超过该值时使用Held-Karp动态规划求精确解
+EXACT_LIMIT = 12
+
+
+def distance_matrix_km(lats, lngs) -> np.ndarray:
+    """
+    一次向量化计算所有站点之间的Haversine距离矩阵（公里）
+
+    参数:
+        lats, lngs: 站点纬度/经度数组（度）
+
+    返回:
+        n×n 距离矩阵
+    """
+    lats = np.asarray(lats, dtype=np.float64)
+    lngs = np.asarray(lngs, dtype=np.float64)
+    return haversine_km(lats[:, None], lngs[:, None], lats[None, :], lngs[None, :])
+
+
+def path_length(matrix: np.ndarray, path: List[int]) -> float:
+    """
+    按顺序经过path中站点的总距离
+    """
+    path = np.asarray(path)
+    if len(path) < 2:
+        return 0.0
+    return float(matrix[path[:-1], path[1:]].sum())
+
+
+def _held_karp(matrix: np.ndarray, start: int, middle: List[int], end: Optional[int]) -> List[int]:
+    """
+    Held-Karp动态规划求开放路径的精确最短顺序
+
+    dp[mask, j] 表示从start出发、经过mask中的中间站点、停在第j个中间站点的最短距离。
+    同一层（mask中站点数相同）的所有状态一次向量化更新。
+
+    返回:
+        中间站点的最优访问顺序
+    """
+    m = len(middle)
+    middle = np.asarray(middle)
+    inner = matrix[np.ix_(middle, middle)]          # inner[k, j]: 中间站点k到j
+    n_masks = 1 << m
+    bits = 1 << np.arange(m)
+
+    dp = np.full((n_masks, m), np.inf)
+    parent = np.full((n_masks, m), -1, dtype=np.int64)
+    dp[bits, np.arange(m)] = matrix[start, middle]
+
+    masks = np.arange(n_masks)
+    popcount = np.array([bin(mask).count('1') for mask in range(n_masks)])
+    contains = (masks[:, None] & bits[None, :]) != 0   # contains[mask, j]
+
+    for size in range(2, m + 1):
+        layer = masks[popcount == size]
+        # prev[mask, j, k] = dp[mask去掉j, k] + inner[k, j]
+        previous_masks = layer[:, None] ^ bits[None, :]
+        prev = dp[previous_masks] + inner.T[None, :, :]
+        best = prev.argmin(axis=2)
+        cost = np.take_along_axis(prev, best[:, :, None], axis=2)[:, :, 0]
+        valid = contains[layer]
+        dp[layer] = np.where(valid, cost, np.inf)
+        parent[layer] = np.where(valid, best, -1)
+
+    full = n_masks - 1
+    final = dp[full] + (matrix[middle, end] if end is not None else 0.0)
+    last = int(np.argmin(final))
+
+    order = []
+    mask = full
+    while last != -1:
+        order.append(last)
+        previous = int(parent[mask, last])
+        mask ^= 1 << last
+        last = previous
+    return [int(middle[k]) for k in reversed(order)]
+
+
+def _nearest_neighbor(matrix: np.ndarray, start: int, middle: List[int]) -> List[int]:
+    """
+    最近邻构造初始顺序
+    """
+    remaining = list(middle)
+    order = []
+    current = start
+    while remaining:
+        distances = matrix[current, remaining]
+        k = int(np.argmin(distances))
+        current = remaining.pop(k)
+        order.append(current)
+    return order
+
+
+def _improve(matrix: np.ndarray, path: List[int], fixed_end: bool, deadline: float) -> List[int]:
+    """
+    在时间预算内交替执行2-opt和Or-opt局部搜索
+
+    path的首个站点固定；fixed_end为True时末尾站点也固定
+    """
+    path = np.asarray(path, dtype=np.int64)
+    n = len(path)
+    # 可移动站点的索引上界（不含），末尾固定时最后一个站点不参与
+    last = n - 1 if fixed_end else n
+    improved = True
+
+    while improved and time.time() < deadline:
+        improved = False
+
+        # 2-opt: 反转 path[i:j+1]，比较断开的两条边与新连接的两条边；
+        # 非对称矩阵（如道路行驶时间）还需计入片段内部反向行驶的代价差
+        for i in range(1, last - 1):
+            forward = np.concatenate([[0.0], np.cumsum(matrix[path[:-1], path[1:]])])
+            backward = np.concatenate([[0.0], np.cumsum(matrix[path[1:], path[:-1]])])
+            j = np.arange(i + 1, last)
+            a, b, c = path[i - 1], path[i], path[j]
+            has_next = j + 1 < n
+            d = path[np.minimum(j + 1, n - 1)]
+            delta = (matrix[a, c] - matrix[a, b] + np.where(has_next, matrix[b, d] - matrix[c, d], 0.0) +
+                     (backward[j] - backward[i]) - (forward[j] - forward[i]))
+            k = int(np.argmin(delta))
+            if delta[k] < -1e-9:
+                path[i:j[k] + 1] = path[i:j[k] + 1][::-1].copy()
+                improved = True
+            if time.time() >= deadline:
+                break
+
+        # Or-opt: 把长度为1~3的连续片段移动到其他位置（保持方向）
+        for length in (1, 2, 3):
+            i = 1
+            while i + length <= last and time.time() < deadline:
+                segment = path[i:i + length]
+                rest = np.concatenate([path[:i], path[i + length:]])
+                removed_gain = (
+                    matrix[path[i - 1], segment[0]] +
+                    (matrix[segment[-1], path[i + length]] if i + length < n else 0.0) -
+                    (matrix[path[i - 1], path[i + length]] if i + length < n else 0.0)
+                )
+                # 插入到rest[p]与rest[p+1]之间，p从0开始（首站点之后）
+                rest_last = len(rest) - 1 if fixed_end else len(rest)
+                p = np.arange(0, rest_last)
+                following = np.where(p + 1 < len(rest), rest[np.minimum(p + 1, len(rest) - 1)], -1)
+                insert_cost = (
+                    matrix[rest[p], segment[0]] +
+                    np.where(following >= 0, matrix[segment[-1], np.maximum(following, 0)], 0.0) -
+                    np.where(following >= 0, matrix[rest[p], np.maximum(following, 0)], 0.0)
+                )
+                k = int(np.argmin(insert_cost))
+                if insert_cost[k] - removed_gain < -1e-9:
+                    path = np.concatenate([rest[:p[k] + 1], segment, rest[p[k] + 1:]])
+                    improved = True
+                else:
+                    i += 1
+
+    return path.tolist()
+
+
+def order_stops(matrix: np.ndarray,
+                start: int = 0,
+                end: Optional[int] = None,
+                time_budget: float = 0.05,
+                exact_limit: int = EXACT_LIMIT) -> List[int]:
+    """
+    求从start出发、经过所有站点（可选地停在end）的最短访问顺序
+
+    中间站点不超过exact_limit个时用Held-Karp求精确解；否则先用最近邻构造，
+    再在time_budget秒内用2-opt和Or-opt改进。
+
+    参数:
+        matrix: 站点距离矩阵
+        start: 起点索引
+        end: 终点索引，为None时终点不固定
+        time_budget: 局部搜索的时间预算（秒）
+        exact_limit: 使用精确算法的最大中间站点数
+
+    返回:
+        完整访问顺序（包含start以及end）
+    """
+    n = len(matrix)
+    middle = [i for i in range(n) if i != start and i != end]
+    tail = [end] if end is not None else []
+
+    if len(middle) <= 1:
+        return [start] + middle + tail
+
+    if len(middle) <= exact_limit:
+        return [start] + _held_karp(matrix, start, middle, end) + tail
+
+    initial = [start] + _nearest_neighbor(matrix, start, middle) + tail
+    improved = _improve(matrix, initial, end is not None, time.time() + time_budget)
+    logger.info(f"站点排序: {len(middle)} 个中间站点, 距离 {path_length(matrix, initial):.2f} -> "
+                f"{path_length(matrix, improved):.2f} 公里")
+    return improved
+
+
+def _best_insertion(matrix: np.ndarray, start: int, sequence: List[int], pickup: int, dropoff: int):
+    """
+    在sequence中为一对接送站点找到增加距离最少的插入位置（接站点在送站点之前）
+
+    插入位置k表示插在sequence[k-1]（k=0时为start）与sequence[k]之间。
+    接、送站点插在同一位置时两者相邻；否则送站点的位置必须在接站点之后，
+    两次插入互不影响，用后缀最小值一次求出。
+
+    返回:
+        (增加的距离, 接站点位置, 送站点位置)，位置均相对于原sequence
+    """
+    length = len(sequence)
+    prev = np.array([start] + sequence, dtype=np.int64)
+    has_next = np.arange(length + 1) < length
+    following = np.array(sequence + [start], dtype=np.int64)   # 最后一个位置没有后继，用占位值
+
+    def gap_cost(node_in, node_out):
+        return (
+            matrix[prev, node_in] +
+            np.where(has_next, matrix[node_out, following] - matrix[prev, following], 0.0)
+        )
+
+    pickup_cost = gap_cost(pickup, pickup)
+    dropoff_cost = gap_cost(dropoff, dropoff)
+    adjacent_cost = gap_cost(pickup, dropoff) + matrix[pickup, dropoff]
+
+    # later[k] = 在位置k之后（不含k）插入送站点的最小代价及位置
+    later = np.full(length + 1, np.inf)
+    later_pos = np.full(length + 1, -1, dtype=np.int64)
+    best, best_pos = np.inf, -1
+    for k in range(length, -1, -1):
+        later[k], later_pos[k] = best, best_pos
+        if dropoff_cost[k] < best:
+            best, best_pos = dropoff_cost[k], k
+
+    separate_cost = pickup_cost + later
+    k_adjacent = int(np.argmin(adjacent_cost))
+    k_separate = int(np.argmin(separate_cost))
+    if adjacent_cost[k_adjacent] <= separate_cost[k_separate]:
+        return float(adjacent_cost[k_adjacent]), k_adjacent, k_adjacent
+    return float(separate_cost[k_separate]), k_separate, int(later_pos[k_separate])
+
+
+def _insert_pair(sequence: List[int], pickup: int, dropoff: int, pickup_pos: int, dropoff_pos: int) -> List[int]:
+    """
+    按_best_insertion返回的位置插入一对接送站点
+    """
+    if pickup_pos == dropoff_pos:
+        return sequence[:pickup_pos] + [pickup, dropoff] + sequence[pickup_pos:]
+    return (sequence[:pickup_pos] + [pickup] + sequence[pickup_pos:dropoff_pos] +
+            [dropoff] + sequence[dropoff_pos:])
+
+
+def sequence_pickup_delivery(matrix: np.ndarray,
+                             start: int,
+                             pickups: List[int],
+                             dropoffs: List[int],
+                             time_budget: float = 0.05) -> List[int]:
+    """
+    带先后约束的接送排序: 从start出发，每个乘客的接站点都排在其送站点之前，终点不固定
+
+    先按最便宜插入逐个加入接送对，再在时间预算内反复把每一对取出并重新插入到最优位置，
+    直到没有改进。接送站点可以交错，不要求先接完所有乘客再统一送达。
+
+    参数:
+        matrix: 站点距离矩阵
+        start: 起点索引
+        pickups: 每个乘客的接站点索引
+        dropoffs: 与pickups一一对应的送站点索引
+        time_budget: 改进阶段的时间预算（秒）
+
+    返回:
+        站点访问顺序（不含start）
+    """
+    deadline = time.time() + time_budget
+    sequence: List[int] = []
+    for pickup, dropoff in zip(pickups, dropoffs):
+        _, i, j = _best_insertion(matrix, start, sequence, pickup, dropoff)
+        sequence = _insert_pair(sequence, pickup, dropoff, i, j)
+
+    best_length = path_length(matrix, [start] + sequence)
+    improved = True
+    while improved and time.time() < deadline:
+        improved = False
+        for pickup, dropoff in zip(pickups, dropoffs):
+            remaining = [node for node in sequence if node != pickup and node != dropoff]
+            _, i, j = _best_insertion(matrix, start, remaining, pickup, dropoff)
+            candidate = _insert_pair(remaining, pickup, dropoff, i, j)
+            candidate_length = path_length(matrix, [start] + candidate)
+            if candidate_length < best_length - 1e-9:
+                sequence, best_length = candidate, candidate_length
+                improved = True
+            if time.time() >= deadline:
+                break
+
+    return sequence
@@ -0,0 +1,360 @@
+import sqlite3
+import threading
+import tempfile
+import os
+import time
+import logging
+import numpy as np
+from typing import List, Dict, Any, Optional, Tuple, Callable
+
+from algorithm.clustering.spatial_index import haversine_km
+
+logger = logging.getLogger(__name__)
+
+# 默认矩阵缓存文件，调度进程和API进程使用同一路径即可共享
+DEFAULT_MATRIX_PATH = os.path.join(tempfile.gettempdir(), "datastar_travel_matrix.sqlite")
+# 高德距离测量API一次请求最多支持的起点数
+MAX_ORIGINS_PER_REQUEST = 100
+# 无法获取道路数据时，直线距离的绕行系数和估算车速（公里/小时）
+DETOUR_FACTOR = 1.3
+FALLBACK_SPEED_KMH = 30
+
+
+class TravelTimeMatrix:
+    def __init__(self,
+                 path=None,               # SQLite文件路径
+                 ttl_seconds=7 * 24 * 3600, # 点对缓存有效期（秒）
+                 coord_precision=4,       # 坐标量化的小数位数（4位约10米）
+                 memory_entries=200000    # 进程内点对缓存的最大条数
+                ):
+        """
+        道路行驶时间/距离矩阵服务
+
+        为一组点返回n×n的道路行驶时间（秒）和距离（米）。查询顺序:
+        进程内缓存 → SQLite点对缓存（量化坐标，带有效期）→ 热点区域间的离线矩阵（zone skims）
+        → 批量请求高德距离测量API（一次请求多个起点到一个终点）。
+        重复出现的点对只在第一次付出网络请求的代价，之后的查询只有字典查找的开销。
+
+        参数:
+            path: SQLite文件路径，为None时读取环境变量TRAVEL_MATRIX_PATH，否则使用系统临时目录
+            ttl_seconds: 点对缓存有效期（秒）
+            coord_precision: 坐标量化的小数位数
+            memory_entries: 进程内点对缓存的最大条数，超出后清空重建
+        """
+        self.path = path or os.getenv("TRAVEL_MATRIX_PATH") or DEFAULT_MATRIX_PATH
+        self.ttl_seconds = ttl_seconds
+        self.coord_precision = coord_precision
+        self.memory_entries = memory_entries
+
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        self._memory = {}   # (起点键, 终点键) -> (时间秒, 距离米)
+        self._zones = None  # 热点区域数组，首次使用时从数据库加载
+        self.hits = 0
+        self.misses = 0
+
+        conn = self._connection()
+        conn.execute("""
+            CREATE TABLE IF NOT EXISTS pair_cache (
+                origin TEXT NOT NULL,
+                destination TEXT NOT NULL,
+                duration REAL NOT NULL,
+                distance REAL NOT NULL,
+                created_at REAL NOT NULL,
+                PRIMARY KEY (origin, destination)
+            )
+        """)
+        conn.execute("""
+            CREATE TABLE IF NOT EXISTS zones (
+                zone_id INTEGER PRIMARY KEY,
+                lat REAL NOT NULL,
+                lng REAL NOT NULL,
+                radius_km REAL NOT NULL
+            )
+        """)
+        conn.execute("""
+            CREATE TABLE IF NOT EXISTS zone_skims (
+                origin_zone INTEGER NOT NULL,
+                dest_zone INTEGER NOT NULL,
+                duration REAL NOT NULL,
+                distance REAL NOT NULL,
+                refreshed_at REAL NOT NULL,
+                PRIMARY KEY (origin_zone, dest_zone)
+            )
+        """)
+        conn.commit()
+
+        logger.info(f"初始化行驶时间矩阵服务: {self.path}, 有效期={ttl_seconds}秒")
+
+    def _connection(self) -> sqlite3.Connection:
+        """
+        每个线程使用独立的连接
+        """
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=10)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+        return conn
+
+    def _key(self, location: Dict[str, float]) -> str:
+        """
+        量化后的 "lng,lat" 坐标，同时作为高德API的坐标参数
+        """
+        return f"{round(location['lng'], self.coord_precision)},{round(location['lat'], self.coord_precision)}"
+
+    def _remember(self, pairs: Dict[Tuple[str, str], Tuple[float, float]]):
+        """
+        写入进程内缓存
+        """
+        with self._lock:
+            if len(self._memory) + len(pairs) > self.memory_entries:
+                self._memory.clear()
+            self._memory.update(pairs)
+
+    def _load_pairs(self, missing: set) -> Dict[Tuple[str, str], Tuple[float, float]]:
+        """
+        从SQLite读取缺失点对中未过期的部分
+        """
+        origins = sorted({origin for origin, _ in missing})
+        destinations = sorted({destination for _, destination in missing})
+        try:
+            rows = self._connection().execute(
+                f"SELECT origin, destination, duration, distance FROM pair_cache "
+                f"WHERE origin IN ({','.join('?' * len(origins))}) "
+                f"AND destination IN ({','.join('?' * len(destinations))}) AND created_at >= ?",
+                (*origins, *destinations, time.time() - self.ttl_seconds)
+            ).fetchall()
+        except sqlite3.Error as e:
+            logger.warning(f"读取点对缓存失败: {str(e)}")
+            return {}
+        return {(origin, destination): (duration, distance)
+                for origin, destination, duration, distance in rows
+                if (origin, destination) in missing}
+
+    def _store_pairs(self, pairs: Dict[Tuple[str, str], Tuple[float, float]]):
+        """
+        将新获取的点对写入SQLite
+        """
+        now = time.time()
+        try:
+            conn = self._connection()
+            conn.executemany(
+                "INSERT OR REPLACE INTO pair_cache (origin, destination, duration, distance, created_at) "
+                "VALUES (?, ?, ?, ?, ?)",
+                [(origin, destination, duration, distance, now)
+                 for (origin, destination), (duration, distance) in pairs.items()]
+            )
+            conn.commit()
+        except sqlite3.Error as e:
+            logger.warning(f"写入点对缓存失败: {str(e)}")
+
+    def _zone_of(self, locations: List[Dict[str, float]]) -> np.ndarray:
+        """
+        每个点所在的热点区域ID，不在任何区域内时为-1（多个区域重叠时取最近的）
+        """
+        if self._zones is None:
+            rows = self._connection().execute("SELECT zone_id, lat, lng, radius_km FROM zones").fetchall()
+            self._zones = np.array(rows, dtype=np.float64).reshape(-1, 4)
+        result = np.full(len(locations), -1, dtype=np.int64)
+        if not len(self._zones) or not locations:
+            return result
+
+        lats = np.array([location['lat'] for location in locations])
+        lngs = np.array([location['lng'] for location in locations])
+        distance = haversine_km(lats[:, None], lngs[:, None], self._zones[None, :, 1], self._zones[None, :, 2])
+        distance = np.where(distance <= self._zones[None, :, 3], distance, np.inf)
+        nearest = np.argmin(distance, axis=1)
+        inside = np.isfinite(distance[np.arange(len(locations)), nearest])
+        result[inside] = self._zones[nearest[inside], 0].astype(np.int64)
+        return result
+
+    def _load_skims(self, keys: List[str], locations: List[Dict[str, float]],
+                    missing: set) -> Dict[Tuple[str, str], Tuple[float, float]]:
+        """
+        两端位于不同热点区域的点对使用区域间的离线矩阵
+        """
+        zones = self._zone_of(locations)
+        zone_by_key = dict(zip(keys, zones.tolist()))
+        wanted = {(zone_by_key[origin], zone_by_key[destination])
+                  for origin, destination in missing
+                  if zone_by_key[origin] >= 0 and zone_by_key[destination] >= 0
+                  and zone_by_key[origin] != zone_by_key[destination]}
+        if not wanted:
+            return {}
+
+        zone_ids = sorted({zone for pair in wanted for zone in pair})
+        placeholders = ','.join('?' * len(zone_ids))
+        try:
+            rows = self._connection().execute(
+                f"SELECT origin_zone, dest_zone, duration, distance FROM zone_skims "
+                f"WHERE origin_zone IN ({placeholders}) AND dest_zone IN ({placeholders})",
+                (*zone_ids, *zone_ids)
+            ).fetchall()
+        except sqlite3.Error as e:
+            logger.warning(f"读取区域矩阵失败: {str(e)}")
+            return {}
+        skims = {(origin_zone, dest_zone): (duration, distance) for origin_zone, dest_zone, duration, distance in rows}
+
+        result = {}
+        for origin, destination in missing:
+            skim = skims.get((zone_by_key[origin], zone_by_key[destination]))
+            if skim is not None:
+                result[(origin, destination)] = skim
+        return result
+
+    def _fetch_pairs(self, missing: set, fetch: Callable[[str, Dict[str, Any]], Dict[str, Any]]
+                    ) -> Dict[Tuple[str, str], Tuple[float, float]]:
+        """
+        批量请求高德距离测量API: 按终点分组，每次请求最多100个起点
+        """
+        by_destination = {}
+        for origin, destination in missing:
+            by_destination.setdefault(destination, []).append(origin)
+
+        result = {}
+        for destination, origins in by_destination.items():
+            for start in range(0, len(origins), MAX_ORIGINS_PER_REQUEST):
+                batch = origins[start:start + MAX_ORIGINS_PER_REQUEST]
+                try:
+                    response = fetch('distance', {
+                        'origins': '|'.join(batch),
+                        'destination': destination,
+                        'type': 1  # 驾车导航距离
+                    })
+                except Exception as e:
+                    logger.warning(f"距离测量API请求失败: {str(e)}")
+                    continue
+                for item in (response or {}).get('results', []):
+                    index = int(item.get('origin_id', 0)) - 1
+                    if 0 <= index < len(batch) and item.get('duration') not in (None, ''):
+                        result[(batch[index], destination)] = (float(item['duration']), float(item.get('distance', 0)))
+        return result
+
+    def matrix(self, locations: List[Dict[str, float]],
+               fetch: Optional[Callable[[str, Dict[str, Any]], Dict[str, Any]]] = None,
+               store: bool = True
+              ) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        返回点集的行驶时间和距离矩阵
+
+        参数:
+            locations: 坐标列表，每项包含lat和lng
+            fetch: 请求高德API的函数 fetch(endpoint, params)，为None时不发起网络请求
+            store: 为False时fetch获取的点对只用于本次计算，不写入进程内缓存和SQLite
+                   （fetch指向本地替身服务等非正式数据源时使用）
+
+        返回:
+            (时间矩阵秒, 距离矩阵米)，对角线为0；无法获取道路数据的点对按直线距离
+            乘以绕行系数估算（估算值不写入缓存）
+        """
+        n = len(locations)
+        durations = np.zeros((n, n))
+        distances = np.zeros((n, n))
+        if n < 2:
+            return durations, distances
+
+        keys = [self._key(location) for location in locations]
+        needed = {(keys[i], keys[j]) for i in range(n) for j in range(n) if keys[i] != keys[j]}
+
+        with self._lock:
+            found = {pair: self._memory[pair] for pair in needed if pair in self._memory}
+        missing = needed - found.keys()
+
+        if missing:
+            cached = self._load_pairs(missing)
+            missing -= cached.keys()
+            cached.update(self._load_skims(keys, locations, missing))
+            missing -= cached.keys()
+            self.hits += len(found) + len(cached)
+
+            fetched = {}
+            if missing and fetch is not None:
+                fetched = self._fetch_pairs(missing, fetch)
+                if store:
+                    self._store_pairs(fetched)
+                missing -= fetched.keys()
+            self.misses += len(fetched) + len(missing)
+
+            if store:
+                cached.update(fetched)
+                self._remember(cached)
+            else:
+                self._remember(cached)
+                cached.update(fetched)
+            logger.info(f"行驶时间矩阵: {n}个点, 内存命中 {len(found)} 对, 缓存命中 {len(cached) - len(fetched)} 对, "
+                        f"请求API {len(fetched)} 对, 直线估算 {len(missing)} 对")
+            found.update(cached)
+        else:
+            self.hits += len(found)
+
+        lats = np.array([location['lat'] for location in locations])
+        lngs = np.array([location['lng'] for location in locations])
+        estimate_m = haversine_km(lats[:, None], lngs[:, None], lats[None, :], lngs[None, :]) * 1000 * DETOUR_FACTOR
+        for i in range(n):
+            for j in range(n):
+                if i == j or keys[i] == keys[j]:
+                    continue
+                pair = found.get((keys[i], keys[j]))
+                if pair is None:
+                    distances[i, j] = estimate_m[i, j]
+                    durations[i, j] = estimate_m[i, j] / 1000 / FALLBACK_SPEED_KMH * 3600
+                else:
+                    durations[i, j], distances[i, j] = pair
+        return durations, distances
+
+    def set_zones(self, zones: List[Dict[str, Any]]):
+        """
+        设置热点区域，替换原有的区域和区域间矩阵
+
+        参数:
+            zones: 区域列表，每项包含zone_id、lat、lng和radius_km
+        """
+        conn = self._connection()
+        conn.execute("DELETE FROM zone_skims")
+        conn.execute("DELETE FROM zones")
+        conn.executemany(
+            "INSERT INTO zones (zone_id, lat, lng, radius_km) VALUES (?, ?, ?, ?)",
+            [(zone['zone_id'], zone['lat'], zone['lng'], zone['radius_km']) for zone in zones]
+        )
+        conn.commit()
+        self._zones = None
+
+    def refresh_skims(self, fetch: Callable[[str, Dict[str, Any]], Dict[str, Any]]) -> int:
+        """
+        离线刷新热点区域中心点之间的行驶时间和距离（例如每天夜间执行一次）
+
+        参数:
+            fetch: 请求高德API的函数 fetch(endpoint, params)
+
+        返回:
+            刷新的区域对数量
+        """
+        conn = self._connection()
+        zones = conn.execute("SELECT zone_id, lat, lng FROM zones ORDER BY zone_id").fetchall()
+        centers = {zone_id: self._key({'lat': lat, 'lng': lng}) for zone_id, lat, lng in zones}
+        pairs = {(centers[a], centers[b]) for a in centers for b in centers if centers[a] != centers[b]}
+        fetched = self._fetch_pairs(pairs, fetch)
+
+        now = time.time()
+        rows = [(a, b, *fetched[(centers[a], centers[b])], now)
+                for a in centers for b in centers
+                if (centers[a], centers[b]) in fetched]
+        conn.executemany(
+            "INSERT OR REPLACE INTO zone_skims (origin_zone, dest_zone, duration, distance, refreshed_at) "
+            "VALUES (?, ?, ?, ?, ?)", rows
+        )
+        conn.commit()
+        logger.info(f"刷新区域间矩阵: {len(zones)} 个区域, 更新 {len(rows)} 对")
+        return len(rows)
+
+    def clear(self):
+        """
+        清空点对缓存（保留热点区域和区域间矩阵）
+        """
+        conn = self._connection()
+        conn.execute("DELETE FROM pair_cache")
+        conn.commit()
+        with self._lock:
+            self._memory.clear()
@@ -0,0 +1,22 @@
+import math
+import os
+import sys
+
+import numpy as np
+import pytest
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__)))))
+from algorithm.clustering.balanced_split import balanced_split
+
+
+@pytest.mark.parametrize('max_size', [3, 8])
+def test_oversized_cluster_splits_into_even_parts(max_size):
+    """超过容量的聚类拆成最少数量的子聚类，各子聚类大小接近平均值，不产生只有一两个请求的子聚类"""
+    rng = np.random.default_rng(0)
+    for n in range(max_size + 1, 6 * max_size):
+        coords = rng.normal([31.2, 121.4, 31.3, 121.5], 0.01, size=(n, 4)).T
+        sizes = np.bincount(balanced_split(*coords, max_size=max_size))
+        n_parts = math.ceil(n / max_size)
+        assert len(sizes) == n_parts
+        assert sizes.max() <= max_size
+        assert sizes.max() - sizes.min() <= 2
@@ -0,0 +1,33 @@
+import os
+import sys
+
+import numpy as np
+import pytest
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__)))))
+from algorithm.clustering.backends import ClusteringBackend, GreedyCliqueBackend
+from algorithm.trip_batch import TripBatch
+
+
+def test_backend_base_class_is_abstract():
+    with pytest.raises(TypeError):
+        ClusteringBackend()
+
+
+@pytest.mark.parametrize('seed', range(5))
+def test_greedy_clique_dense_matches_indexed(seed):
+    """稠密距离矩阵与空间索引两种邻居搜索方式的聚类结果一致"""
+    rng = np.random.default_rng(seed)
+    n = 120
+    batch = TripBatch(
+        request_id=np.arange(n),
+        origin_lat=31.20 + rng.random(n) * 0.05,
+        origin_lng=121.40 + rng.random(n) * 0.05,
+        dest_lat=31.30 + rng.random(n) * 0.05,
+        dest_lng=121.50 + rng.random(n) * 0.05,
+        departure_ts=np.zeros(n),
+        people_count=np.ones(n)
+    )
+    dense = GreedyCliqueBackend(spatial_threshold=1.0, min_samples=2, neighbor_search='dense').cluster(batch)
+    indexed = GreedyCliqueBackend(spatial_threshold=1.0, min_samples=2, neighbor_search='balltree').cluster(batch)
+    assert dense == indexed
@@ -0,0 +1,51 @@
+import os
+import sys
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__)))))
+from algorithm.clustering.incremental_clustering import IncrementalClustering
+from algorithm.clustering.enhanced_clustering import EnhancedClustering
+
+
+def _trip(request_id, origin, destination, departure_time='2024-01-01T08:00:00'):
+    return {
+        'request_id': request_id,
+        'origin': {'lat': origin[0], 'lng': origin[1]},
+        'destination': {'lat': destination[0], 'lng': destination[1]},
+        'departure_time': departure_time,
+        'people_count': 1
+    }
+
+
+def _labels(clustered):
+    return {trip['request_id']: trip['cluster_id'] for trip in clustered}
+
+
+def test_edited_request_is_reclustered():
+    """请求修改坐标后仍在同一时间组内，重新同步的聚类结果与EnhancedClustering一致"""
+    trips = [_trip(rid, (31.20, 121.40), (31.30, 121.50)) for rid in (1, 2, 3)]
+    clusterer = IncrementalClustering(spatial_threshold=1.0, time_window=30, min_samples=2)
+    clusterer.sync(trips)
+    assert set(_labels(clusterer.cluster_trips()).values()) == {0}
+
+    edited = trips[:2] + [_trip(3, (31.5, 121.2), (31.6, 121.1))]
+    stats = clusterer.sync(edited)
+    assert stats['inserted'] == 1 and stats['removed'] == 0
+
+    expected = _labels(EnhancedClustering(spatial_threshold=1.0, time_window=30, min_samples=2).cluster_trips(edited))
+    assert _labels(clusterer.cluster_trips()) == expected
+    assert expected[3] == -1
+
+
+def test_edited_request_joins_cluster():
+    """远离其他请求的请求修改后靠近它们，应被并入聚类"""
+    trips = [_trip(1, (31.20, 121.40), (31.30, 121.50)),
+             _trip(2, (31.20, 121.40), (31.30, 121.50)),
+             _trip(3, (31.5, 121.2), (31.6, 121.1))]
+    clusterer = IncrementalClustering(spatial_threshold=1.0, time_window=30, min_samples=2)
+    clusterer.sync(trips)
+    assert _labels(clusterer.cluster_trips())[3] == -1
+
+    edited = trips[:2] + [_trip(3, (31.20, 121.40), (31.30, 121.50))]
+    clusterer.sync(edited)
+    expected = _labels(EnhancedClustering(spatial_threshold=1.0, time_window=30, min_samples=2).cluster_trips(edited))
+    assert _labels(clusterer.cluster_trips()) == expected
@@ -0,0 +1,58 @@
+import os
+import sys
+
+import pytest
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__)))))
+from algorithm.routing.multi_route_planner import MultiRoutePlanner
+from algorithm.routing.amap_stub import AmapStubServer
+
+
+@pytest.mark.parametrize('count', range(17, 34))
+def test_segmented_route_visits_every_waypoint(count):
+    """超过16个途经点分段规划时，每个途经点都出现在某次请求中，且各段首尾相接"""
+    stub = AmapStubServer()
+    planner = MultiRoutePlanner(amap_key='test')
+    requests = []
+
+    def fake_api(endpoint, params):
+        requests.append(dict(params))
+        return stub.synthetic_driving(params)
+
+    planner._call_amap_api = fake_api
+
+    origin = {'lng': 121.40, 'lat': 31.20}
+    destination = {'lng': 121.60, 'lat': 31.30}
+    waypoints = [{'lng': 121.40 + 0.005 * (i + 1), 'lat': 31.20 + 0.003 * (i + 1)} for i in range(count)]
+
+    route = planner.plan_single_route(origin, destination, waypoints, optimize_order=False)
+    assert route is not None
+
+    visited = []
+    for params in requests:
+        assert len(params.get('waypoints', '').split(';')) <= 16
+        visited += [params['origin']] + (params['waypoints'].split(';') if params.get('waypoints') else [])
+    visited.append(requests[-1]['destination'])
+
+    # 依次为起点、全部途经点（按原顺序，不重复）和终点
+    expected = [origin] + waypoints + [destination]
+    assert visited == [planner._format_location(point) for point in expected]
+    for previous, current in zip(requests, requests[1:]):
+        assert current['origin'] == previous['destination']
+
+
+@pytest.mark.parametrize('polyline', ['121.1,31.1,5;121.2,31.2;121.3,31.3', '121.1,31.1,5;121.2;121.3,31.3'])
+def test_polyline_with_malformed_point_keeps_alignment(polyline):
+    """某个点的分量个数不是两个时，只跳过该点，其余坐标不错位"""
+    planner = MultiRoutePlanner(amap_key='test')
+    coords = planner._extract_polyline([{'polyline': polyline}])
+    assert [tuple(point) for point in coords.tolist()] == \
+        [tuple(point) for point in planner._parse_points(polyline.split(';')).tolist()]
+    assert (121.3, 31.3) in [tuple(point) for point in coords.tolist()]
+
+
+def test_polyline_fast_path_matches_per_point_parsing():
+    planner = MultiRoutePlanner(amap_key='test')
+    steps = [{'polyline': '121.1,31.1;121.2,31.2'}, {'polyline': '121.2,31.2;121.3,31.3;'}]
+    coords = planner._extract_polyline(steps)
+    assert coords.tolist() == [[121.1, 31.1], [121.2, 31.2], [121.2, 31.2], [121.3, 31.3]]
@@ -0,0 +1,46 @@
+import os
+import sys
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__)))))
+from algorithm.responsive_scheduler import ResponsiveScheduler
+
+
+def _trip(request_id):
+    return {
+        'request_id': request_id,
+        'origin': {'lat': 31.20, 'lng': 121.40},
+        'destination': {'lat': 31.30, 'lng': 121.50},
+        'departure_time': '2024-01-01T08:00:00',
+        'people_count': 1
+    }
+
+
+def test_fallback_routes_are_not_cached():
+    """高德API故障时的备用路线不缓存，恢复后下一周期重新规划"""
+    scheduler = ResponsiveScheduler(amap_key='test', cache_results=True)
+    calls = []
+    outage = [True]
+
+    def fake_plan(clusters_data):
+        calls.append(sorted(clusters_data))
+        leg = {'polyline': [], 'is_fallback': True} if outage[0] else {'polyline': []}
+        return {cluster_id: {'cluster_id': cluster_id, 'trips': data['trips'],
+                             'pickup_route': dict(leg), 'dropoff_route': dict(leg)}
+                for cluster_id, data in clusters_data.items() if cluster_id != -1}
+
+    scheduler.route_planner.plan_multi_routes = fake_plan
+    trips = [_trip(rid) for rid in (1, 2, 3)]
+
+    first = scheduler.process_requests(trips)
+    assert first['success'] and not first.get('cached')
+    assert scheduler._route_cache == {}
+
+    outage[0] = False
+    second = scheduler.process_requests(trips)
+    assert not second.get('cached')
+    assert len(calls) == 2
+    assert not second['routes'][0]['pickup_route'].get('is_fallback')
+
+    third = scheduler.process_requests(trips)
+    assert third.get('cached')
+    assert len(calls) == 2
@@ -0,0 +1,43 @@
+import os
+import sys
+from datetime import datetime
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__)))))
+from algorithm.routing.route_cache import RouteCache
+from algorithm.routing.travel_matrix import TravelTimeMatrix
+from algorithm.routing.multi_route_planner import MultiRoutePlanner, DEFAULT_BASE_URL
+
+
+def test_cache_key_separates_base_urls(tmp_path):
+    cache = RouteCache(path=str(tmp_path / 'route_cache.db'))
+    params = {'origin': '121.40,31.20', 'destination': '121.60,31.30', 'strategy': 0}
+    now = datetime(2024, 1, 1, 8, 0)
+    default_key = cache.make_key('direction/driving', params, now=now)
+    stub_key = cache.make_key('direction/driving', params, now=now, base_url='http://127.0.0.1:8765/v3')
+    assert default_key != stub_key
+    assert default_key == cache.make_key('direction/driving', params, now=now, base_url=None)
+
+
+def test_stub_planner_does_not_write_shared_caches(tmp_path):
+    cache = RouteCache(path=str(tmp_path / 'route_cache.db'))
+    matrix = TravelTimeMatrix(path=str(tmp_path / 'travel_matrix.db'))
+    stub = MultiRoutePlanner(amap_key='test', route_cache=cache, travel_matrix=matrix,
+                             travel_matrix_fetch=True, base_url='http://127.0.0.1:8765/v3')
+    stub._request_amap_api = lambda endpoint, params: {
+        'status': '1',
+        'results': [{'origin_id': str(i + 1), 'duration': '60', 'distance': '500'}
+                    for i in range(len(params.get('origins', '').split('|')))]
+    }
+
+    stub._call_amap_api('direction/driving', {'origin': '121.40,31.20', 'destination': '121.60,31.30'})
+    locations = [{'lng': 121.40, 'lat': 31.20}, {'lng': 121.45, 'lat': 31.25}]
+    stub._stop_matrix(locations)
+
+    production = MultiRoutePlanner(amap_key='test', route_cache=cache, travel_matrix=matrix)
+    assert production.base_url == DEFAULT_BASE_URL
+    assert cache.get(cache.make_key('direction/driving',
+                                    {'origin': '121.40,31.20', 'destination': '121.60,31.30'})) is None
+    assert matrix._connection().execute("SELECT COUNT(*) FROM pair_cache").fetchone()[0] == 0
+    # 共享缓存中没有点对，正式规划使用直线估算
+    durations, _ = matrix.matrix(locations)
+    assert durations[0, 1] != 60
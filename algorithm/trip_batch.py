@@ -0,0 +1,190 @@
+import numpy as np
+from datetime import datetime, timezone
+from typing import List, Dict, Any, Iterable, Optional
+import logging
+
+logger = logging.getLogger(__name__)
+
+# 核心数值列，聚类与统计只读取这些列
+CORE_COLUMNS = (
+    'request_id',
+    'origin_lat', 'origin_lng',
+    'dest_lat', 'dest_lng',
+    'departure_ts',
+    'people_count'
+)
+
+
+def parse_departure_time(value) -> datetime:
+    """
+    解析出发时间，支持datetime对象和ISO格式字符串（含'Z'后缀）
+    """
+    if isinstance(value, datetime):
+        return value
+    return datetime.fromisoformat(value.replace('Z', '+00:00'))
+
+
+def to_epoch(value) -> int:
+    """
+    将出发时间转换为epoch秒
+
+    不带时区的时间按UTC处理，只用于组内时间差计算，不影响输出的原始时间字符串
+    """
+    dt = parse_departure_time(value)
+    if dt.tzinfo is None:
+        dt = dt.replace(tzinfo=timezone.utc)
+    return int(dt.timestamp())
+
+
+class TripBatch:
+    def __init__(self,
+                 request_id,
+                 origin_lat,
+                 origin_lng,
+                 dest_lat,
+                 dest_lng,
+                 departure_ts,
+                 people_count=None,
+                 extra: Optional[Dict[str, Any]] = None
+                ):
+        """
+        出行请求的列式表示
+
+        每个字段存为一个NumPy数组，聚类、统计等阶段直接读取数组，
+        不再逐条复制字典、反复解析出发时间。
+
+        参数:
+            request_id: 请求ID (int64)
+            origin_lat, origin_lng: 起点纬度/经度 (float64)
+            dest_lat, dest_lng: 终点纬度/经度 (float64)
+            departure_ts: 出发时间epoch秒 (int64)
+            people_count: 乘客人数 (int32)，为None时默认为1
+            extra: 其他透传列，如origin_name、departure_time原始字符串等，
+                仅在还原为字典时使用
+        """
+        self.request_id = np.asarray(request_id, dtype=np.int64)
+        n = len(self.request_id)
+        self.origin_lat = np.asarray(origin_lat, dtype=np.float64)
+        self.origin_lng = np.asarray(origin_lng, dtype=np.float64)
+        self.dest_lat = np.asarray(dest_lat, dtype=np.float64)
+        self.dest_lng = np.asarray(dest_lng, dtype=np.float64)
+        self.departure_ts = np.asarray(departure_ts, dtype=np.int64)
+        if people_count is None:
+            self.people_count = np.ones(n, dtype=np.int32)
+        else:
+            self.people_count = np.asarray(people_count, dtype=np.int32)
+
+        self.extra = {}
+        for name, values in (extra or {}).items():
+            column = np.empty(n, dtype=object)
+            column[:] = list(values)
+            self.extra[name] = column
+
+        for name in CORE_COLUMNS[1:]:
+            if len(getattr(self, name)) != n:
+                raise ValueError(f"列 {name} 的长度 ({len(getattr(self, name))}) 与请求数 ({n}) 不一致")
+
+    @classmethod
+    def from_records(cls, records: Iterable[Dict[str, Any]]) -> 'TripBatch':
+        """
+        从请求字典列表构建，出发时间只解析一次
+
+        参数:
+            records: 请求字典列表，格式同ResponsiveScheduler.process_requests的输入
+
+        返回:
+            TripBatch实例
+        """
+        records = list(records)
+        core_keys = {'request_id', 'origin', 'destination', 'departure_time', 'people_count'}
+        extra_keys = []
+        for record in records:
+            for key in record:
+                if key not in core_keys and key not in extra_keys:
+                    extra_keys.append(key)
+
+        departure_time = [record['departure_time'] for record in records]
+        extra = {'departure_time': [
+            t.isoformat() if isinstance(t, datetime) else t for t in departure_time
+        ]}
+        for key in extra_keys:
+            extra[key] = [record.get(key) for record in records]
+
+        return cls(
+            request_id=[record['request_id'] for record in records],
+            origin_lat=[record['origin']['lat'] for record in records],
+            origin_lng=[record['origin']['lng'] for record in records],
+            dest_lat=[record['destination']['lat'] for record in records],
+            dest_lng=[record['destination']['lng'] for record in records],
+            departure_ts=[to_epoch(t) for t in departure_time],
+            people_count=[record.get('people_count', 1) for record in records],
+            extra=extra
+        )
+
+    def __len__(self) -> int:
+        return len(self.request_id)
+
+    def take(self, indices) -> 'TripBatch':
+        """
+        按索引（或布尔掩码）选取子集，返回新的TripBatch
+        """
+        indices = np.asarray(indices)
+        subset = TripBatch.__new__(TripBatch)
+        for name in CORE_COLUMNS:
+            setattr(subset, name, getattr(self, name)[indices])
+        subset.extra = {name: column[indices] for name, column in self.extra.items()}
+        return subset
+
+    def argsort_departure(self) -> np.ndarray:
+        """
+        按出发时间稳定排序的索引
+        """
+        return np.argsort(self.departure_ts, kind='stable')
+
+    def invalid_mask(self) -> np.ndarray:
+        """
+        坐标超出有效范围的请求掩码
+        """
+        return ~(
+            (np.abs(self.origin_lat) <= 90) & (np.abs(self.origin_lng) <= 180) &
+            (np.abs(self.dest_lat) <= 90) & (np.abs(self.dest_lng) <= 180)
+        )
+
+    def departure_time(self, i: int) -> str:
+        """
+        第i个请求的出发时间字符串（优先使用原始字符串）
+        """
+        column = self.extra.get('departure_time')
+        if column is not None and column[i] is not None:
+            return column[i]
+        return datetime.fromtimestamp(int(self.departure_ts[i]), tz=timezone.utc).replace(tzinfo=None).isoformat()
+
+    def record(self, i: int) -> Dict[str, Any]:
+        """
+        将第i个请求还原为字典，格式与process_requests的输入一致
+        """
+        record = {
+            'request_id': int(self.request_id[i]),
+            'departure_time': self.departure_time(i),
+            'people_count': int(self.people_count[i]),
+            'origin': {
+                'lat': float(self.origin_lat[i]),
+                'lng': float(self.origin_lng[i])
+            },
+            'destination': {
+                'lat': float(self.dest_lat[i]),
+                'lng': float(self.dest_lng[i])
+            }
+        }
+        for name, column in self.extra.items():
+            if name not in record:
+                record[name] = column[i]
+        return record
+
+    def to_records(self, indices=None) -> List[Dict[str, Any]]:
+        """
+        将全部（或指定索引的）请求还原为字典列表
+        """
+        if indices is None:
+            indices = range(len(self))
+        return [self.record(int(i)) for i in indices]
@@ -1,10 +1,11 @@
 from fastapi import APIRouter, HTTPException, Depends
 from typing import List, Optional, Dict, Any
 from pydantic import BaseModel
-from sqlalchemy.orm import Session
-from models.database import get_db
-from models import Route, Trip, RequestDispatchLink  # 修改导入语句，移除不存在的 Vehicle 和 RouteTrip
+from sqlalchemy.ext.asyncio import AsyncSession
+from models.async_database import get_async_db
 from sqlalchemy import text
+from concurrent.futures import ThreadPoolExecutor
+import asyncio
 import json
 import sys
 import os
@@ -27,6 +28,13 @@ logger.info("正在初始化路由规划API模块...")
 sys.path.append(os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__)))))
 try:
     from algorithm.responsive_scheduler import ResponsiveScheduler
+    from algorithm.repository import load_pending_requests, PlanRepository
+    from algorithm.routing.route_cache import RouteCache
+    from algorithm.routing.rate_limiter import TokenBucketLimiter
+    from algorithm.routing.road_graph import load_road_graph
+    from algorithm.routing.travel_matrix import TravelTimeMatrix
+    from algorithm.routing.polyline_codec import pack_route_polyline, encode_polyline, encode_levels, ENCODED_FORMAT
+    from algorithm.routing.polyline_simplify import simplify_levels, zoom_to_tolerance
     logger.info("成功导入ResponsiveScheduler")
     
     # 检查geopy是否安装
@@ -40,6 +48,22 @@ except Exception as e:
     logger.error(traceback.format_exc())
     raise
 
+# 与调度进程共享的高德API响应缓存（路径由ROUTE_CACHE_PATH指定）
+route_cache = RouteCache()
+
+# 与调度进程共享的高德API限流器（AMAP_QPS、AMAP_DAILY_QUOTA、RATE_LIMIT_PATH）
+rate_limiter = TokenBucketLimiter()
+
+# 离线路网（ROAD_GRAPH_PATH），只在启动时加载一次，未配置时为None
+road_graph = load_road_graph()
+
+# 与调度进程共享的点对行驶时间缓存（TRAVEL_MATRIX_PATH），规划请求中只读，不请求距离API
+travel_matrix = TravelTimeMatrix()
+
+# 路线规划的工作线程池: 聚类和路线规划不在事件循环中执行，规划期间其他接口照常响应
+planning_executor = ThreadPoolExecutor(max_workers=int(os.getenv("PLANNING_WORKERS", "2")),
+                                       thread_name_prefix='route-planning')
+
 # 创建路由实例
 planning_routes = APIRouter(prefix="/api/routes", tags=["routes"])
 logger.info(f"创建APIRouter: prefix=/api/routes, tags=['routes']")
@@ -50,89 +74,61 @@ class PlanningRequest(BaseModel):
     spatialThreshold: float
     maxPointsPerRoute: int
     minSamples: int
+    zoom: Optional[float] = None       # 地图缩放级别，返回的折线按一个像素的距离简化
+    tolerance: Optional[float] = None  # 折线简化容差（米），优先于zoom
 
 class DispatchRequest(BaseModel):
     routeId: str
     clusterId: str
     planningResult: Dict[str, Any]
 
+def _compact_steps(steps: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+    """
+    去掉步骤中的分段折线，整条路线的折线已单独编码保存
+    """
+    return [{key: value for key, value in step.items() if key != 'polyline'} for step in steps]
+
+def _simplify_routes(planning_result: Dict[str, Any], tolerance: float) -> Dict[str, Any]:
+    """
+    返回路线折线按容差简化后的规划结果副本，不修改原结果
+    """
+    routes = {}
+    for route_id, route_data in planning_result.get('routes', {}).items():
+        route_data = dict(route_data)
+        for name in ('pickup_route', 'dropoff_route'):
+            leg = route_data.get(name)
+            if leg and leg.get('polyline'):
+                coords = simplify_levels(leg['polyline'], (tolerance,))[tolerance]
+                route_data[name] = dict(leg, polyline=[{'lng': lng, 'lat': lat} for lng, lat in coords.tolist()])
+        routes[route_id] = route_data
+    return dict(planning_result, routes=routes)
+
 # 获取待处理的请求
 @planning_routes.get("/pending")
-async def get_pending_requests(db: Session = Depends(get_db)):
+async def get_pending_requests(db: AsyncSession = Depends(get_async_db)):
     logger.info("API调用: GET /routes/pending")
     try:
-        # 移除时间窗口限制，查询所有未被分配到调度计划的请求
-        query = text("""
-            SELECT ur.request_id, ur.origin_name, ur.destination_name, 
-                   ur.departure_time, ur.people_count,
-                   ST_AsGeoJSON(ur.origin_location) as origin_location,
-                   ST_AsGeoJSON(ur.destination_location) as destination_location,
-                   ur.submit_time
-            FROM user_request ur
-            LEFT JOIN request_dispatch_link rdl ON ur.request_id = rdl.request_id
-            WHERE rdl.id IS NULL
-            ORDER BY ur.departure_time
-        """)
-        
-        logger.info(f"执行SQL查询: {query}")
-        result = db.execute(query)
-        
-        requests = []
-        for row in result:
-            try:
-                # 解析地理位置JSON
-                try:
-                    origin_json = json.loads(row.origin_location)
-                    dest_json = json.loads(row.destination_location)
-                except json.JSONDecodeError as json_error:
-                    logger.error(f"解析地理位置JSON失败，请求ID: {row.request_id}")
-                    logger.error(f"origin_location: {row.origin_location}")
-                    logger.error(f"destination_location: {row.destination_location}")
-                    continue
-                
-                # 验证经纬度数据
-                try:
-                    origin_lat = float(origin_json['coordinates'][1])
-                    origin_lng = float(origin_json['coordinates'][0])
-                    dest_lat = float(dest_json['coordinates'][1])
-                    dest_lng = float(dest_json['coordinates'][0])
-                    
-                    # 检查经纬度范围
-                    if not (-90 <= origin_lat <= 90 and -180 <= origin_lng <= 180 and
-                           -90 <= dest_lat <= 90 and -180 <= dest_lng <= 180):
-                        logger.error(f"经纬度超出有效范围，请求ID: {row.request_id}")
-                        logger.error(f"origin: ({origin_lat}, {origin_lng})")
-                        logger.error(f"destination: ({dest_lat}, {dest_lng})")
-                        continue
-                except (IndexError, ValueError) as coord_error:
-                    logger.error(f"提取经纬度失败，请求ID: {row.request_id}")
-                    logger.error(str(coord_error))
-                    continue
-                
-                # 构建请求数据
-                request_data = {
-                    'request_id': row.request_id,
-                    'origin_name': row.origin_name,
-                    'destination_name': row.destination_name,
-                    'departure_time': row.departure_time.isoformat(),
-                    'people_count': row.people_count,
-                    'origin': {
-                        'lat': origin_lat,
-                        'lng': origin_lng
-                    },
-                    'destination': {
-                        'lat': dest_lat,
-                        'lng': dest_lng
-                    },
-                    'submit_time': row.submit_time.isoformat()
-                }
-                requests.append(request_data)
-                
-            except Exception as row_error:
-                logger.error(f"处理查询结果行时出错，请求ID: {row.request_id}")
-                logger.error(str(row_error))
-                logger.error(traceback.format_exc())
-                continue
+        # 一次查询取出所有未被分配到调度计划的请求（坐标超出范围的请求已被丢弃）
+        batch = await db.run_sync(load_pending_requests)
+        requests = [
+            {
+                'request_id': int(batch.request_id[i]),
+                'origin_name': batch.extra['origin_name'][i],
+                'destination_name': batch.extra['destination_name'][i],
+                'departure_time': batch.extra['departure_time'][i],
+                'people_count': int(batch.people_count[i]),
+                'origin': {
+                    'lat': float(batch.origin_lat[i]),
+                    'lng': float(batch.origin_lng[i])
+                },
+                'destination': {
+                    'lat': float(batch.dest_lat[i]),
+                    'lng': float(batch.dest_lng[i])
+                },
+                'submit_time': batch.extra['submit_time'][i]
+            }
+            for i in range(len(batch))
+        ]
         
         # 记录所有请求及其状态，帮助诊断
         try:
@@ -153,7 +149,7 @@ async def get_pending_requests(db: Session = Depends(get_db)):
                     ur.departure_time
             """)
             
-            status_result = db.execute(status_query)
+            status_result = await db.execute(status_query)
             logger.info("所有请求的状态:")
             
             for row in status_result:
@@ -171,55 +167,15 @@ async def get_pending_requests(db: Session = Depends(get_db)):
 
 # 路线规划
 @planning_routes.post("/plan")
-async def plan_routes(request: PlanningRequest, db: Session = Depends(get_db)):
+async def plan_routes(request: PlanningRequest, db: AsyncSession = Depends(get_async_db)):
     try:
         logger.info(f"收到路线规划请求: {request}")
         
-        # 获取待处理的出行请求
-        pending_trips = db.query(Trip).filter(Trip.status == 'pending').all()
-        if not pending_trips:
+        # 一次查询加载待处理的出行请求，直接以列式TripBatch交给调度器
+        pending_requests = await db.run_sync(load_pending_requests, status='pending')
+        if not len(pending_requests):
             return {"success": False, "message": "没有待处理的出行请求"}
             
-        # 转换数据格式
-        formatted_requests = []
-        for trip in pending_trips:
-            try:
-                # 从地理位置字段中提取经纬度
-                origin_location = db.scalar(text("SELECT ST_AsGeoJSON(origin_location) FROM user_request WHERE request_id = :id"), {'id': trip.id})
-                destination_location = db.scalar(text("SELECT ST_AsGeoJSON(destination_location) FROM user_request WHERE request_id = :id"), {'id': trip.id})
-                
-                # 解析地理位置JSON
-                origin_json = json.loads(origin_location)
-                dest_json = json.loads(destination_location)
-                
-                # 提取经纬度
-                origin_lat = float(origin_json['coordinates'][1])
-                origin_lng = float(origin_json['coordinates'][0])
-                dest_lat = float(dest_json['coordinates'][1])
-                dest_lng = float(dest_json['coordinates'][0])
-                
-                formatted_requests.append({
-                    'request_id': trip.id,
-                    'origin_name': trip.origin_name,
-                    'destination_name': trip.destination_name,
-                    'departure_time': trip.departure_time.isoformat(),
-                    'people_count': trip.passenger_count,
-                    'origin': {
-                        'lat': origin_lat,
-                        'lng': origin_lng,
-                        'name': trip.origin_name
-                    },
-                    'destination': {
-                        'lat': dest_lat,
-                        'lng': dest_lng,
-                        'name': trip.destination_name
-                    },
-                    'submit_time': trip.created_at.isoformat() if trip.created_at else datetime.now().isoformat()
-                })
-            except Exception as e:
-                logger.error(f"处理请求 {trip.id} 时出错: {str(e)}")
-                continue
-            
         # 初始化调度器
         scheduler = ResponsiveScheduler(
             spatial_threshold=request.spatialThreshold,
@@ -227,59 +183,66 @@ async def plan_routes(request: PlanningRequest, db: Session = Depends(get_db)):
             min_samples=request.minSamples,
             max_points_per_route=request.maxPointsPerRoute,
             max_cluster_radius=request.spatialThreshold * 2,  # 设置为空间阈值的2倍
-            amap_key=os.getenv("AMAP_KEY")  # 从环境变量获取高德地图API密钥
+            amap_key=os.getenv("AMAP_KEY"),  # 从环境变量获取高德地图API密钥
+            route_cache=route_cache,
+            route_concurrency=8,
+            rate_limiter=rate_limiter,
+            combined_route=True,
+            road_graph=road_graph,
+            travel_matrix=travel_matrix
         )
         
-        # 执行路线规划
-        planning_result = scheduler.process_requests(formatted_requests)
+        # 在工作线程中执行路线规划
+        loop = asyncio.get_running_loop()
+        planning_result = await loop.run_in_executor(planning_executor, scheduler.process_requests, pending_requests)
         
         if not planning_result or not planning_result.get('routes'):
             return {"success": False, "message": "路线规划失败"}
             
-        # 保存规划结果到数据库
-        saved_routes = []
+        # 准备规划结果，所有路线、请求关联和请求状态在同一事务中批量写入
+        plans = []
+        clustered_ids, clustered_cluster_ids = [], []
         for route_id, route_data in planning_result['routes'].items():
             try:
                 # 确保路线数据包含必要的字段
                 pickup_route = route_data.get('pickup_route', {})
-                dropoff_route = route_data.get('dropoff_route', {})
+                # 接送合并规划时dropoff_route为None
+                dropoff_route = route_data.get('dropoff_route') or {}
+                cluster = planning_result['clusters'].get(route_id) or {}
+                request_ids = [trip_data['request_id'] for trip_data in cluster.get('trips', [])]
+                cluster_id = int(route_id)
                 
-                # 创建新的路线记录
-                route = Route(
-                    path=json.dumps({
+                # 折线编码保存，步骤中与整条折线重复的分段折线不再保存
+                plans.append({
+                    'route_polyline': json.dumps({
+                        'format': ENCODED_FORMAT,
                         'pickup_route': {
-                            'polyline': pickup_route.get('polyline', []),
+                            'polyline': encode_polyline(pickup_route.get('polyline', [])),
                             'path': pickup_route.get('path', []),
                             'stops': pickup_route.get('stops', []),
                             'distance': pickup_route.get('distance', 0),
                             'duration': pickup_route.get('duration', 0),
-                            'steps': pickup_route.get('steps', [])
+                            'steps': _compact_steps(pickup_route.get('steps', []))
                         },
                         'dropoff_route': {
-                            'polyline': dropoff_route.get('polyline', []),
+                            'polyline': encode_polyline(dropoff_route.get('polyline', [])),
                             'path': dropoff_route.get('path', []),
                             'stops': dropoff_route.get('stops', []),
                             'distance': dropoff_route.get('distance', 0),
                             'duration': dropoff_route.get('duration', 0),
-                            'steps': dropoff_route.get('steps', [])
-                        }
-                    }),
-                    status='planned',
-                    start_time=datetime.now()  # 设置一个默认的开始时间
-                )
-                db.add(route)
-                
-                # 更新相关出行请求的状态
-                cluster = planning_result['clusters'].get(route_id)
-                if cluster and cluster.get('trips'):
-                    for trip_data in cluster['trips']:
-                        trip = db.query(Trip).filter(Trip.id == trip_data['request_id']).first()
-                        if trip:
-                            trip.status = 'clustered'
-                            trip.cluster_id = int(route_id)
-                            route.trips.append(trip)
-                
-                saved_routes.append(route)
+                            'steps': _compact_steps(dropoff_route.get('steps', []))
+                        },
+                        # 地图概览使用的多级简化折线
+                        'levels': encode_levels({
+                            'pickup_route': pickup_route.get('polyline', []),
+                            'dropoff_route': dropoff_route.get('polyline', [])
+                        })
+                    }, ensure_ascii=False),
+                    'start_time': datetime.now(),  # 设置一个默认的开始时间
+                    'request_ids': request_ids
+                })
+                clustered_ids.extend(request_ids)
+                clustered_cluster_ids.extend([cluster_id] * len(request_ids))
                 
                 # 记录路线信息
                 logger.info(f"保存路线 {route_id}:")
@@ -291,13 +254,26 @@ async def plan_routes(request: PlanningRequest, db: Session = Depends(get_db)):
                 continue
         
         try:
-            db.commit()
-            logger.info(f"成功保存 {len(saved_routes)} 条路线到数据库")
+            def save(session):
+                repository = PlanRepository(session)
+                repository.save_plans(plans)
+                repository.update_request_status(clustered_ids, 'clustered', clustered_cluster_ids)
+            
+            await db.run_sync(save)
+            await db.commit()
+            logger.info(f"成功保存 {len(plans)} 条路线到数据库")
         except Exception as e:
-            db.rollback()
+            await db.rollback()
             logger.error(f"提交数据库事务时出错: {str(e)}")
             return {"success": False, "message": "保存路线数据失败"}
         
+        # 按请求的容差或缩放级别简化返回的折线，数据库中保存的是原始折线
+        tolerance = request.tolerance
+        if tolerance is None and request.zoom is not None:
+            tolerance = zoom_to_tolerance(request.zoom)
+        if tolerance is not None and tolerance > 0:
+            planning_result = _simplify_routes(planning_result, tolerance)
+        
         # 返回规划结果
         return {
             "success": True,
@@ -315,7 +291,7 @@ logger.info("=====================================")
 
 # 确认调度计划
 @planning_routes.post("/dispatch")
-async def dispatch_route(dispatch_request: DispatchRequest, db: Session = Depends(get_db)):
+async def dispatch_route(dispatch_request: DispatchRequest, db: AsyncSession = Depends(get_async_db)):
     try:
         route_id = dispatch_request.routeId
         cluster_id = dispatch_request.clusterId
@@ -336,47 +312,25 @@ async def dispatch_route(dispatch_request: DispatchRequest, db: Session = Depend
             return {"success": False, "message": "找不到对应的聚类或路线数据"}
         
         # 准备路线折线数据（用于地图显示）
-        route_polyline = json.dumps({
-            'pickup_route': route_data['pickup_route']['polyline'],
-            'dropoff_route': route_data['dropoff_route']['polyline']
-        })
+        route_polyline = pack_route_polyline(
+            route_data['pickup_route']['polyline'],
+            (route_data.get('dropoff_route') or {}).get('polyline', [])
+        )
         
         # 获取出发时间
         departure_time = datetime.fromisoformat(route_data["departure_time"].replace('Z', '+00:00'))
         
         # 开始事务
         try:
-            # 保存调度计划
-            plan_query = text("""
-                INSERT INTO dispatch_plan
-                (route_polyline, status, start_time, created_at)
-                VALUES (:route_polyline, 'planned', :start_time, CURRENT_TIMESTAMP)
-                RETURNING plan_id
-            """)
-            
-            params = {
+            # 保存调度计划并关联请求
+            plan = {
                 'route_polyline': route_polyline,
-                'start_time': departure_time if departure_time else datetime.now()
+                'start_time': departure_time if departure_time else datetime.now(),
+                'request_ids': [trip['request_id'] for trip in cluster_data['trips']]
             }
+            plan_id = (await db.run_sync(lambda session: PlanRepository(session).save_plans([plan])))[0]
             
-            # 执行插入
-            plan_result = db.execute(plan_query, params)
-            plan_id = plan_result.scalar()
-            
-            # 关联请求到调度计划
-            for trip in cluster_data['trips']:
-                link_query = text("""
-                    INSERT INTO request_dispatch_link
-                    (request_id, plan_id)
-                    VALUES (:request_id, :plan_id)
-                """)
-                
-                db.execute(link_query, {
-                    'request_id': trip['request_id'],
-                    'plan_id': plan_id
-                })
-            
-            db.commit()
+            await db.commit()
             
             logger.info(f"调度计划已创建，ID={plan_id}, 包含{len(cluster_data['trips'])}个请求")
             
@@ -388,7 +342,7 @@ async def dispatch_route(dispatch_request: DispatchRequest, db: Session = Depend
             }
             
         except Exception as db_error:
-            db.rollback()
+            await db.rollback()
             logger.error(f"保存调度计划失败: {str(db_error)}")
             logger.error(traceback.format_exc())
             return {"success": False, "message": f"保存调度计划失败: {str(db_error)}"}
@@ -1,13 +1,21 @@
 from fastapi import APIRouter, HTTPException, Depends
 from typing import List, Optional, Dict
-from datetime import datetime
+from datetime import datetime, timezone
 from pydantic import BaseModel
-from sqlalchemy.orm import Session
-from models.database import get_db
-from models.trip import Trip as TripModel
+from sqlalchemy.ext.asyncio import AsyncSession
+from models.async_database import get_async_db
 from models.user import User as UserModel
 from fastapi.responses import JSONResponse
 from sqlalchemy import text
+import base64
+import json
+import os
+import re
+import sys
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__)))))
+from algorithm.routing.polyline_codec import unpack_route_polyline, encoded_route_polyline
+from algorithm.routing.polyline_simplify import zoom_to_tolerance
 
 # 创建路由实例
 user_routes = APIRouter(prefix="/users", tags=["users"])
@@ -63,6 +71,102 @@ class RequestData(BaseModel):
     originLocation: Dict[str, float]
     destinationLocation: Dict[str, float]
 
+# 列表接口的默认和最大页大小
+MAX_PAGE_SIZE = 500
+# 请求状态只允许小写字母和下划线，估算总数时可以直接写入EXPLAIN语句
+STATUS_PATTERN = re.compile(r'^[a-z_]+$')
+# 估算总数低于该值（或尚未ANALYZE、估算为负）时改用精确的COUNT(*)，小结果集计数代价很低
+EXACT_COUNT_THRESHOLD = 10000
+
+def _page_size(size: int) -> int:
+    if size < 1 or size > MAX_PAGE_SIZE:
+        raise HTTPException(status_code=400, detail=f"页大小必须在1到{MAX_PAGE_SIZE}之间")
+    return size
+
+def _parse_time(value: str, name: str) -> datetime:
+    """
+    解析ISO格式时间参数，带时区的时间换算为UTC后去掉时区（与TIMESTAMP列一致）
+    """
+    try:
+        parsed = datetime.fromisoformat(value.replace('Z', '+00:00'))
+    except ValueError:
+        raise HTTPException(status_code=400, detail=f"{name}参数不是有效的ISO时间")
+    if parsed.tzinfo is not None:
+        parsed = parsed.astimezone(timezone.utc).replace(tzinfo=None)
+    return parsed
+
+def _encode_cursor(row) -> str:
+    """
+    游标为最后一行的(submit_time, request_id)，base64编码后返回给客户端
+    """
+    raw = f"{row.submit_time.isoformat()}|{row.request_id}"
+    return base64.urlsafe_b64encode(raw.encode('utf-8')).decode('ascii')
+
+def _decode_cursor(cursor: str):
+    try:
+        submit_time, request_id = base64.urlsafe_b64decode(cursor.encode('ascii')).decode('utf-8').rsplit('|', 1)
+        return datetime.fromisoformat(submit_time), int(request_id)
+    except Exception:
+        raise HTTPException(status_code=400, detail="cursor参数无效")
+
+def _request_filters(status: Optional[str], start_time: Optional[str], end_time: Optional[str],
+                     cursor: Optional[str]):
+    """
+    构建user_request列表查询的过滤条件
+
+    条件与索引(submit_time DESC, request_id DESC)和(status, submit_time DESC, request_id DESC)对应，
+    游标条件为行比较(submit_time, request_id) < 游标，最新一页和任意后续页都只扫描limit行。
+
+    返回:
+        (带绑定参数的条件列表, 参数字典, 不含游标的字面量条件列表（用于估算总数）)
+    """
+    conditions = ["ur.submit_time IS NOT NULL"]
+    params = {}
+    estimate_conditions = ["ur.submit_time IS NOT NULL"]
+    if status is not None:
+        if not STATUS_PATTERN.match(status):
+            raise HTTPException(status_code=400, detail="status参数无效")
+        conditions.append("ur.status = :status")
+        params["status"] = status
+        estimate_conditions.append(f"ur.status = '{status}'")
+    for name, value, operator in (("start_time", start_time, ">="), ("end_time", end_time, "<")):
+        if value is not None:
+            parsed = _parse_time(value, name)
+            conditions.append(f"ur.submit_time {operator} :{name}")
+            params[name] = parsed
+            estimate_conditions.append(f"ur.submit_time {operator} '{parsed.isoformat(sep=' ')}'::timestamp")
+    if cursor is not None:
+        params["cursor_time"], params["cursor_id"] = _decode_cursor(cursor)
+        conditions.append("(ur.submit_time, ur.request_id) < (:cursor_time, :cursor_id)")
+    return conditions, params, estimate_conditions
+
+async def _estimated_total(db: AsyncSession, estimate_conditions: List[str]) -> int:
+    """
+    估算满足条件的请求数，结果较小时返回精确值
+
+    没有过滤条件时读取pg_class.reltuples，否则使用查询计划的估计行数；两者都依赖ANALYZE统计信息。
+    首次ANALYZE之前reltuples为-1，带过滤条件的估计行数也可能偏差很大，
+    因此估算值为负或低于EXACT_COUNT_THRESHOLD时执行COUNT(*)，只有大结果集才返回估算值
+    """
+    where = ' AND '.join(estimate_conditions)
+    if len(estimate_conditions) == 1:
+        estimate = (await db.execute(text(
+            "SELECT reltuples::bigint FROM pg_class WHERE oid = 'user_request'::regclass"
+        ))).scalar()
+    else:
+        plan = (await db.execute(text(
+            f"EXPLAIN (FORMAT JSON) SELECT 1 FROM user_request ur WHERE {where}"
+        ))).scalar()
+        if isinstance(plan, str):
+            plan = json.loads(plan)
+        estimate = plan[0]["Plan"]["Plan Rows"]
+    estimate = int(estimate) if estimate is not None else -1
+    if estimate < EXACT_COUNT_THRESHOLD:
+        return int((await db.execute(text(
+            f"SELECT COUNT(*) FROM user_request ur WHERE {where}"
+        ))).scalar())
+    return estimate
+
 # 用户路由
 @user_routes.get("/")
 async def get_users():
@@ -70,23 +174,53 @@ async def get_users():
 
 # 行程路由
 @trip_routes.get("/")
-async def get_trips(page: int = 1, size: int = 10, db: Session = Depends(get_db)):
+async def get_trips(size: int = 10, cursor: Optional[str] = None, page: int = 1,
+                    status: Optional[str] = None, start_time: Optional[str] = None, end_time: Optional[str] = None,
+                    with_total: bool = True, db: AsyncSession = Depends(get_async_db)):
+    # 按(submit_time, request_id)倒序的游标分页；page只为旧客户端保留，传入cursor时忽略
     try:
-        # 计算偏移量
-        offset = (page - 1) * size
-        
-        # 获取总数
-        total = db.query(TripModel).count()
-        
-        # 获取分页数据
-        trips = db.query(TripModel).offset(offset).limit(size).all()
+        size = _page_size(size)
+        conditions, params, estimate_conditions = _request_filters(status, start_time, end_time, cursor)
+        query = text(f"""
+            SELECT ur.request_id, ur.user_id, u.username, u.created_at AS user_created_at,
+                   ST_Y(ur.origin_location::geometry) AS origin_lat,
+                   ST_X(ur.origin_location::geometry) AS origin_lng,
+                   ST_Y(ur.destination_location::geometry) AS dest_lat,
+                   ST_X(ur.destination_location::geometry) AS dest_lng,
+                   ur.departure_time, ur.status, ur.cluster_id, ur.submit_time
+            FROM user_request ur
+            LEFT JOIN users u ON ur.user_id = u.id
+            WHERE {' AND '.join(conditions)}
+            ORDER BY ur.submit_time DESC, ur.request_id DESC
+            LIMIT :limit {'OFFSET :offset' if cursor is None and page > 1 else ''}
+        """)
+        params.update({"limit": size + 1, "offset": (page - 1) * size})
+        rows = (await db.execute(query, params)).fetchall()
+        
+        trips = [{
+            "id": row.request_id,
+            "user": {
+                "id": row.user_id,
+                "username": row.username,
+                "created_at": row.user_created_at.isoformat() if row.user_created_at else None
+            } if row.user_id is not None else None,
+            "origin": {"lat": row.origin_lat, "lng": row.origin_lng},
+            "destination": {"lat": row.dest_lat, "lng": row.dest_lng},
+            "departure_time": row.departure_time.isoformat() if row.departure_time else None,
+            "status": row.status,
+            "cluster_id": row.cluster_id,
+            "created_at": row.submit_time.isoformat()
+        } for row in rows[:size]]
         
         return {
             "items": trips,
-            "total": total,
+            "total": await _estimated_total(db, estimate_conditions) if with_total else None,
             "page": page,
-            "size": size
+            "size": size,
+            "next_cursor": _encode_cursor(rows[size - 1]) if len(rows) > size else None
         }
+    except HTTPException:
+        raise
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
@@ -100,11 +234,16 @@ async def get_routes(page: int = 1, size: int = 10):
 async def get_vehicles():
     return {"message": "获取车辆列表"}
 
-# 获取所有出行请求
+# 获取出行请求列表
 @request_routes.get("/listRequests")
-async def list_requests(db: Session = Depends(get_db)):
+async def list_requests(limit: int = 50, cursor: Optional[str] = None, status: Optional[str] = None,
+                        start_time: Optional[str] = None, end_time: Optional[str] = None,
+                        estimate_total: bool = False, db: AsyncSession = Depends(get_async_db)):
+    # 按(submit_time, request_id)倒序的游标分页，next_cursor为空表示已到最后一页
     try:
-        query = text("""
+        limit = _page_size(limit)
+        conditions, params, estimate_conditions = _request_filters(status, start_time, end_time, cursor)
+        query = text(f"""
             SELECT 
                 request_id, 
                 origin_name, 
@@ -115,15 +254,19 @@ async def list_requests(db: Session = Depends(get_db)):
                 ST_AsText(origin_location) as origin_location_text,
                 ST_AsText(destination_location) as destination_location_text
             FROM 
-                user_request
+                user_request ur
+            WHERE 
+                {' AND '.join(conditions)}
             ORDER BY 
-                submit_time DESC;
+                submit_time DESC, request_id DESC
+            LIMIT :limit
         """)
+        params["limit"] = limit + 1
         
-        result = db.execute(query)
+        rows = (await db.execute(query, params)).fetchall()
         requests = []
         
-        for row in result:
+        for row in rows[:limit]:
             requests.append({
                 "request_id": row.request_id,
                 "origin_name": row.origin_name,
@@ -135,8 +278,18 @@ async def list_requests(db: Session = Depends(get_db)):
                 "destination_location": row.destination_location_text
             })
         
-        return {"success": True, "data": requests, "count": len(requests)}
+        response = {
+            "success": True,
+            "data": requests,
+            "count": len(requests),
+            "next_cursor": _encode_cursor(rows[limit - 1]) if len(rows) > limit else None
+        }
+        if estimate_total:
+            response["estimated_total"] = await _estimated_total(db, estimate_conditions)
+        return response
     
+    except HTTPException:
+        raise
     except Exception as e:
         print(f"获取请求列表失败: {e}")
         import traceback
@@ -145,7 +298,7 @@ async def list_requests(db: Session = Depends(get_db)):
 
 # 提交出行请求
 @request_routes.post("/submitRequest")
-async def submit_request(request_data: RequestData, db: Session = Depends(get_db)):
+async def submit_request(request_data: RequestData, db: AsyncSession = Depends(get_async_db)):
     try:
         # 检查user_request表是否存在，如果不存在则创建
         try:
@@ -155,7 +308,7 @@ async def submit_request(request_data: RequestData, db: Session = Depends(get_db
                     WHERE table_name = 'user_request'
                 );
             """)
-            result = db.execute(check_table_query)
+            result = await db.execute(check_table_query)
             table_exists = result.scalar()
             
             if not table_exists:
@@ -186,9 +339,11 @@ async def submit_request(request_data: RequestData, db: Session = Depends(get_db
                     CREATE INDEX IF NOT EXISTS idx_user_request_submit_time ON user_request(submit_time);
                 """)
                 
-                # 执行创建表操作
-                db.execute(create_table_query)
-                db.commit()
+                # 执行创建表操作（asyncpg不支持一次执行多条语句，逐条执行）
+                for statement in create_table_query.text.split(';'):
+                    if statement.strip():
+                        await db.execute(text(statement))
+                await db.commit()
                 print("user_request表创建成功")
         except Exception as table_check_error:
             print(f"检查和创建表失败: {table_check_error}")
@@ -201,10 +356,13 @@ async def submit_request(request_data: RequestData, db: Session = Depends(get_db
         
         # 处理日期时间格式
         departure_time = request_data.departureTime
+        # asyncpg按列类型绑定参数，TIMESTAMP列需要不带时区的datetime
+        departure_at = departure_time
         try:
             # 尝试解析ISO格式日期时间
             parsed_time = datetime.fromisoformat(departure_time.replace('Z', '+00:00'))
             departure_time = parsed_time.strftime('%Y-%m-%d %H:%M:%S')
+            departure_at = parsed_time.replace(tzinfo=None, microsecond=0)
             print(f"解析后的日期时间: {departure_time}")
         except Exception as e:
             print(f"日期解析失败，使用原始值: {e}")
@@ -241,14 +399,14 @@ async def submit_request(request_data: RequestData, db: Session = Depends(get_db
                 "dest_lng": dest_lng,
                 "dest_lat": dest_lat,
                 "people_count": request_data.peopleCount,
-                "departure_time": departure_time
+                "departure_time": departure_at
             }
             print("方法1 - 参数化查询:")
             print(f"SQL参数: {params}")
             
-            result = db.execute(query, params)
+            result = await db.execute(query, params)
             request_id = result.scalar()
-            db.commit()
+            await db.commit()
             
             print(f"请求提交成功，ID: {request_id}")
             return JSONResponse(content={
@@ -258,7 +416,7 @@ async def submit_request(request_data: RequestData, db: Session = Depends(get_db
             })
             
         except Exception as sql_error:
-            db.rollback()
+            await db.rollback()
             print(f"方法1失败: {sql_error}")
             import traceback
             traceback.print_exc()
@@ -285,9 +443,9 @@ async def submit_request(request_data: RequestData, db: Session = Depends(get_db
                 """)
                 print(f"SQL查询: {direct_query}")
                 
-                result = db.execute(direct_query)
+                result = await db.execute(direct_query)
                 request_id = result.scalar()
-                db.commit()
+                await db.commit()
                 
                 print(f"请求提交成功(备用方法)，ID: {request_id}")
                 return JSONResponse(content={
@@ -297,7 +455,7 @@ async def submit_request(request_data: RequestData, db: Session = Depends(get_db
                 })
                 
             except Exception as direct_sql_error:
-                db.rollback()
+                await db.rollback()
                 print(f"方法2失败: {direct_sql_error}")
                 traceback.print_exc()
                 
@@ -320,9 +478,9 @@ async def submit_request(request_data: RequestData, db: Session = Depends(get_db
                     print("方法3 - 测试插入:")
                     print(f"SQL查询: {test_query}")
                     
-                    result = db.execute(test_query)
+                    result = await db.execute(test_query)
                     request_id = result.scalar()
-                    db.commit()
+                    await db.commit()
                     
                     print(f"测试插入成功，ID: {request_id}")
                     error_msg = "用户数据插入失败，但测试插入成功。可能是数据格式问题。"
@@ -336,7 +494,7 @@ async def submit_request(request_data: RequestData, db: Session = Depends(get_db
                     )
                     
                 except Exception as test_error:
-                    db.rollback()
+                    await db.rollback()
                     print(f"方法3失败: {test_error}")
                     traceback.print_exc()
                     
@@ -372,7 +530,7 @@ async def submit_request(request_data: RequestData, db: Session = Depends(get_db
             )
         
     except Exception as e:
-        db.rollback()
+        await db.rollback()
         print(f"整体处理失败: {str(e)}")
         import traceback
         traceback.print_exc()
@@ -402,33 +560,24 @@ async def submit_request(request_data: RequestData, db: Session = Depends(get_db
 
 # 获取仪表盘统计数据
 @dispatch_routes.get("/dashboard/stats")
-async def get_dashboard_stats(db: Session = Depends(get_db)):
+async def get_dashboard_stats(db: AsyncSession = Depends(get_async_db)):
     try:
-        # 获取今日需求总数
-        total_requests_query = text("""
-            SELECT COUNT(*) FROM user_request 
-            WHERE DATE(submit_time) = CURRENT_DATE
-        """)
-        total_requests = db.execute(total_requests_query).scalar()
-        
-        # 获取待确认调度数量
-        pending_plans_query = text("""
-            SELECT COUNT(*) FROM dispatch_plan 
-            WHERE status = 'planned'
+        # 统计表由触发器增量维护，三个计数都是按主键读取单行
+        stats_query = text("""
+            SELECT
+                (SELECT request_count FROM daily_request_stats
+                 WHERE stat_date = CURRENT_DATE) AS total_requests,
+                (SELECT plan_count FROM dispatch_plan_status_stats
+                 WHERE status = 'planned') AS pending_plans,
+                (SELECT plan_count FROM dispatch_plan_status_stats
+                 WHERE status = 'confirmed') AS confirmed_plans
         """)
-        pending_plans = db.execute(pending_plans_query).scalar()
-        
-        # 获取已发车数量
-        confirmed_plans_query = text("""
-            SELECT COUNT(*) FROM dispatch_plan 
-            WHERE status = 'confirmed'
-        """)
-        confirmed_plans = db.execute(confirmed_plans_query).scalar()
+        stats = (await db.execute(stats_query)).fetchone()
         
         return {
-            "totalRequests": total_requests or 0,
-            "pendingPlans": pending_plans or 0,
-            "confirmedPlans": confirmed_plans or 0
+            "totalRequests": stats.total_requests or 0,
+            "pendingPlans": stats.pending_plans or 0,
+            "confirmedPlans": stats.confirmed_plans or 0
         }
     except Exception as e:
         print(f"获取统计数据失败: {str(e)}")
@@ -436,18 +585,18 @@ async def get_dashboard_stats(db: Session = Depends(get_db)):
 
 # 获取调度计划列表
 @dispatch_routes.get("/plans")
-async def get_dispatch_plans(db: Session = Depends(get_db)):
+async def get_dispatch_plans(db: AsyncSession = Depends(get_async_db)):
     try:
         query = text("""
             SELECT dp.plan_id, dp.vehicle_id, dp.start_time, dp.status, dp.created_at,
-                   COUNT(rdl.request_id) as request_count
+                   COALESCE(dps.request_count, 0) as request_count,
+                   COALESCE(dps.passenger_count, 0) as passenger_count
             FROM dispatch_plan dp
-            LEFT JOIN request_dispatch_link rdl ON dp.plan_id = rdl.plan_id
-            GROUP BY dp.plan_id
+            LEFT JOIN dispatch_plan_stats dps ON dp.plan_id = dps.plan_id
             ORDER BY dp.created_at DESC
         """)
         
-        result = db.execute(query)
+        result = await db.execute(query)
         plans = []
         
         for row in result:
@@ -457,7 +606,8 @@ async def get_dispatch_plans(db: Session = Depends(get_db)):
                 "start_time": row.start_time.isoformat() if row.start_time else None,
                 "status": row.status,
                 "created_at": row.created_at.isoformat() if row.created_at else None,
-                "request_count": row.request_count
+                "request_count": row.request_count,
+                "passenger_count": row.passenger_count
             })
             
         return plans
@@ -467,7 +617,14 @@ async def get_dispatch_plans(db: Session = Depends(get_db)):
 
 # 获取调度计划详情
 @dispatch_routes.get("/plan/{plan_id}")
-async def get_dispatch_plan_detail(plan_id: int, db: Session = Depends(get_db)):
+async def get_dispatch_plan_detail(plan_id: int, format: str = 'json', zoom: Optional[float] = None,
+                                   tolerance: Optional[float] = None, db: AsyncSession = Depends(get_async_db)):
+    # format='json'返回坐标列表JSON字符串（旧客户端）；format='encoded'返回编码折线
+    if format not in ('json', 'encoded'):
+        raise HTTPException(status_code=400, detail="format参数只能为json或encoded")
+    # 折线简化容差（米）: 直接指定，或按地图缩放级别换算为一个像素的距离；都不传时返回原始折线
+    if tolerance is None and zoom is not None:
+        tolerance = zoom_to_tolerance(zoom)
     try:
         # 获取计划基本信息
         plan_query = text("""
@@ -475,7 +632,7 @@ async def get_dispatch_plan_detail(plan_id: int, db: Session = Depends(get_db)):
             WHERE dp.plan_id = :plan_id
         """)
         
-        plan_result = db.execute(plan_query, {"plan_id": plan_id}).fetchone()
+        plan_result = (await db.execute(plan_query, {"plan_id": plan_id})).fetchone()
         
         if not plan_result:
             raise HTTPException(status_code=404, detail="调度计划不存在")
@@ -490,7 +647,7 @@ async def get_dispatch_plan_detail(plan_id: int, db: Session = Depends(get_db)):
             WHERE rdl.plan_id = :plan_id
         """)
         
-        requests_result = db.execute(requests_query, {"plan_id": plan_id})
+        requests_result = await db.execute(requests_query, {"plan_id": plan_id})
         
         # 构建响应
         import json
@@ -501,7 +658,10 @@ async def get_dispatch_plan_detail(plan_id: int, db: Session = Depends(get_db)):
             "start_time": plan_result.start_time.isoformat() if plan_result.start_time else None,
             "status": plan_result.status,
             "created_at": plan_result.created_at.isoformat() if plan_result.created_at else None,
-            "route_polyline": plan_result.route_polyline
+            "route_polyline": (
+                encoded_route_polyline(plan_result.route_polyline, tolerance) if format == 'encoded'
+                else json.dumps(unpack_route_polyline(plan_result.route_polyline, tolerance))
+            )
         }
         
         requests = []
@@ -537,7 +697,7 @@ async def get_dispatch_plan_detail(plan_id: int, db: Session = Depends(get_db)):
 
 # 确认发车
 @dispatch_routes.post("/confirm/{plan_id}")
-async def confirm_dispatch(plan_id: int, db: Session = Depends(get_db)):
+async def confirm_dispatch(plan_id: int, db: AsyncSession = Depends(get_async_db)):
     try:
         query = text("""
             UPDATE dispatch_plan
@@ -546,25 +706,25 @@ async def confirm_dispatch(plan_id: int, db: Session = Depends(get_db)):
             RETURNING plan_id
         """)
         
-        result = db.execute(query, {"plan_id": plan_id})
+        result = await db.execute(query, {"plan_id": plan_id})
         updated_plan_id = result.scalar()
         
         if not updated_plan_id:
             raise HTTPException(status_code=404, detail="计划不存在或已经被确认")
             
-        db.commit()
+        await db.commit()
         
         return {"success": True, "message": "已确认发车"}
     except HTTPException:
         raise
     except Exception as e:
-        db.rollback()
+        await db.rollback()
         print(f"确认发车失败: {str(e)}")
         raise HTTPException(status_code=500, detail="确认发车失败")
 
 # 取消计划
 @dispatch_routes.post("/cancel/{plan_id}")
-async def cancel_dispatch(plan_id: int, db: Session = Depends(get_db)):
+async def cancel_dispatch(plan_id: int, db: AsyncSession = Depends(get_async_db)):
     try:
         query = text("""
             UPDATE dispatch_plan
@@ -573,18 +733,18 @@ async def cancel_dispatch(plan_id: int, db: Session = Depends(get_db)):
             RETURNING plan_id
         """)
         
-        result = db.execute(query, {"plan_id": plan_id})
+        result = await db.execute(query, {"plan_id": plan_id})
         updated_plan_id = result.scalar()
         
         if not updated_plan_id:
             raise HTTPException(status_code=404, detail="计划不存在或已经被取消")
             
-        db.commit()
+        await db.commit()
         
         return {"success": True, "message": "已取消计划"}
     except HTTPException:
         raise
     except Exception as e:
-        db.rollback()
+        await db.rollback()
         print(f"取消计划失败: {str(e)}")
         raise HTTPException(status_code=500, detail="取消计划失败") 
\ No newline at end of file
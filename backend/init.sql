@@ -102,6 +102,206 @@ CREATE INDEX idx_dispatch_plan_vehicle_id ON dispatch_plan(vehicle_id);
 CREATE INDEX idx_user_request_status ON user_request(status);
 CREATE INDEX idx_dispatch_plan_status ON dispatch_plan(status);
 
+-- 创建请求列表游标分页索引（按(submit_time, request_id)倒序，可按状态过滤）
+CREATE INDEX idx_user_request_submit_time_id ON user_request(submit_time DESC, request_id DESC);
+CREATE INDEX idx_user_request_status_submit_time_id ON user_request(status, submit_time DESC, request_id DESC);
+
 -- 创建关联表索引
 CREATE INDEX idx_request_dispatch_link_request_id ON request_dispatch_link(request_id);
-CREATE INDEX idx_request_dispatch_link_plan_id ON request_dispatch_link(plan_id); 
\ No newline at end of file
+CREATE INDEX idx_request_dispatch_link_plan_id ON request_dispatch_link(plan_id); 
+
+-- 创建仪表盘统计表（由触发器增量维护，仪表盘只按主键读取单行）
+CREATE TABLE IF NOT EXISTS daily_request_stats (
+    stat_date DATE PRIMARY KEY,
+    request_count INTEGER NOT NULL DEFAULT 0
+);
+
+CREATE TABLE IF NOT EXISTS dispatch_plan_status_stats (
+    status TEXT PRIMARY KEY,
+    plan_count INTEGER NOT NULL DEFAULT 0
+);
+
+CREATE TABLE IF NOT EXISTS dispatch_plan_stats (
+    plan_id INTEGER PRIMARY KEY REFERENCES dispatch_plan(plan_id) ON DELETE CASCADE,
+    request_count INTEGER NOT NULL DEFAULT 0,
+    passenger_count INTEGER NOT NULL DEFAULT 0
+);
+
+-- 用户请求的增删改按语句汇总后更新每日请求数；人数变化时同步所属调度计划的乘客数
+CREATE OR REPLACE FUNCTION user_request_stats_trigger() RETURNS trigger AS $$
+BEGIN
+    IF TG_OP = 'INSERT' THEN
+        INSERT INTO daily_request_stats AS s (stat_date, request_count)
+        SELECT DATE(submit_time), COUNT(*) FROM new_rows
+        WHERE submit_time IS NOT NULL
+        GROUP BY DATE(submit_time)
+        ON CONFLICT (stat_date) DO UPDATE SET request_count = s.request_count + EXCLUDED.request_count;
+    ELSIF TG_OP = 'DELETE' THEN
+        INSERT INTO daily_request_stats AS s (stat_date, request_count)
+        SELECT DATE(submit_time), -COUNT(*) FROM old_rows
+        WHERE submit_time IS NOT NULL
+        GROUP BY DATE(submit_time)
+        ON CONFLICT (stat_date) DO UPDATE SET request_count = s.request_count + EXCLUDED.request_count;
+    ELSE
+        -- 只处理提交时间变化的行，状态更新等不涉及计数的修改不写统计表
+        INSERT INTO daily_request_stats AS s (stat_date, request_count)
+        SELECT stat_date, SUM(delta) FROM (
+            SELECT DATE(n.submit_time) AS stat_date, 1 AS delta
+            FROM new_rows n JOIN old_rows o ON o.request_id = n.request_id
+            WHERE n.submit_time IS DISTINCT FROM o.submit_time AND n.submit_time IS NOT NULL
+            UNION ALL
+            SELECT DATE(o.submit_time), -1
+            FROM new_rows n JOIN old_rows o ON o.request_id = n.request_id
+            WHERE n.submit_time IS DISTINCT FROM o.submit_time AND o.submit_time IS NOT NULL
+        ) d
+        GROUP BY stat_date
+        HAVING SUM(delta) <> 0
+        ON CONFLICT (stat_date) DO UPDATE SET request_count = s.request_count + EXCLUDED.request_count;
+
+        UPDATE dispatch_plan_stats s
+        SET passenger_count = s.passenger_count + d.delta
+        FROM (
+            SELECT rdl.plan_id, SUM(n.people_count - o.people_count) AS delta
+            FROM new_rows n
+            JOIN old_rows o ON o.request_id = n.request_id
+            JOIN request_dispatch_link rdl ON rdl.request_id = n.request_id
+            WHERE n.people_count <> o.people_count
+            GROUP BY rdl.plan_id
+        ) d
+        WHERE s.plan_id = d.plan_id;
+    END IF;
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+-- 调度计划的增删改按语句汇总后更新各状态的计划数
+CREATE OR REPLACE FUNCTION dispatch_plan_stats_trigger() RETURNS trigger AS $$
+BEGIN
+    IF TG_OP = 'INSERT' THEN
+        INSERT INTO dispatch_plan_status_stats AS s (status, plan_count)
+        SELECT status, COUNT(*) FROM new_rows
+        WHERE status IS NOT NULL
+        GROUP BY status
+        ON CONFLICT (status) DO UPDATE SET plan_count = s.plan_count + EXCLUDED.plan_count;
+    ELSIF TG_OP = 'DELETE' THEN
+        INSERT INTO dispatch_plan_status_stats AS s (status, plan_count)
+        SELECT status, -COUNT(*) FROM old_rows
+        WHERE status IS NOT NULL
+        GROUP BY status
+        ON CONFLICT (status) DO UPDATE SET plan_count = s.plan_count + EXCLUDED.plan_count;
+    ELSE
+        INSERT INTO dispatch_plan_status_stats AS s (status, plan_count)
+        SELECT status, SUM(delta) FROM (
+            SELECT n.status, 1 AS delta
+            FROM new_rows n JOIN old_rows o ON o.plan_id = n.plan_id
+            WHERE n.status IS DISTINCT FROM o.status AND n.status IS NOT NULL
+            UNION ALL
+            SELECT o.status, -1
+            FROM new_rows n JOIN old_rows o ON o.plan_id = n.plan_id
+            WHERE n.status IS DISTINCT FROM o.status AND o.status IS NOT NULL
+        ) d
+        GROUP BY status
+        HAVING SUM(delta) <> 0
+        ON CONFLICT (status) DO UPDATE SET plan_count = s.plan_count + EXCLUDED.plan_count;
+    END IF;
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+-- 请求关联的增删改按语句汇总后更新每个调度计划的请求数和乘客数
+CREATE OR REPLACE FUNCTION request_dispatch_link_stats_trigger() RETURNS trigger AS $$
+BEGIN
+    IF TG_OP IN ('DELETE', 'UPDATE') THEN
+        INSERT INTO dispatch_plan_stats AS s (plan_id, request_count, passenger_count)
+        SELECT l.plan_id, -COUNT(*), -COALESCE(SUM(ur.people_count), 0)
+        FROM old_rows l
+        LEFT JOIN user_request ur ON ur.request_id = l.request_id
+        JOIN dispatch_plan dp ON dp.plan_id = l.plan_id
+        GROUP BY l.plan_id
+        ON CONFLICT (plan_id) DO UPDATE SET request_count = s.request_count + EXCLUDED.request_count,
+                                            passenger_count = s.passenger_count + EXCLUDED.passenger_count;
+    END IF;
+    IF TG_OP IN ('INSERT', 'UPDATE') THEN
+        INSERT INTO dispatch_plan_stats AS s (plan_id, request_count, passenger_count)
+        SELECT l.plan_id, COUNT(*), COALESCE(SUM(ur.people_count), 0)
+        FROM new_rows l
+        LEFT JOIN user_request ur ON ur.request_id = l.request_id
+        WHERE l.plan_id IS NOT NULL
+        GROUP BY l.plan_id
+        ON CONFLICT (plan_id) DO UPDATE SET request_count = s.request_count + EXCLUDED.request_count,
+                                            passenger_count = s.passenger_count + EXCLUDED.passenger_count;
+    END IF;
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+-- 按现有数据重建全部统计（初始化时执行，计数异常时也可手动执行）
+CREATE OR REPLACE FUNCTION refresh_dashboard_stats() RETURNS void AS $$
+BEGIN
+    -- 重建期间阻止写入，避免与触发器的增量更新重复计数
+    LOCK TABLE user_request, dispatch_plan, request_dispatch_link IN SHARE MODE;
+
+    DELETE FROM daily_request_stats;
+    INSERT INTO daily_request_stats (stat_date, request_count)
+    SELECT DATE(submit_time), COUNT(*) FROM user_request
+    WHERE submit_time IS NOT NULL
+    GROUP BY DATE(submit_time);
+
+    DELETE FROM dispatch_plan_status_stats;
+    INSERT INTO dispatch_plan_status_stats (status, plan_count)
+    SELECT status, COUNT(*) FROM dispatch_plan
+    WHERE status IS NOT NULL
+    GROUP BY status;
+
+    DELETE FROM dispatch_plan_stats;
+    INSERT INTO dispatch_plan_stats (plan_id, request_count, passenger_count)
+    SELECT rdl.plan_id, COUNT(*), COALESCE(SUM(ur.people_count), 0)
+    FROM request_dispatch_link rdl
+    LEFT JOIN user_request ur ON ur.request_id = rdl.request_id
+    WHERE rdl.plan_id IS NOT NULL
+    GROUP BY rdl.plan_id;
+END;
+$$ LANGUAGE plpgsql;
+
+-- 创建统计触发器（语句级，批量写入时每条语句只更新一次统计表）
+DROP TRIGGER IF EXISTS user_request_stats_insert ON user_request;
+CREATE TRIGGER user_request_stats_insert AFTER INSERT ON user_request
+    REFERENCING NEW TABLE AS new_rows
+    FOR EACH STATEMENT EXECUTE FUNCTION user_request_stats_trigger();
+DROP TRIGGER IF EXISTS user_request_stats_update ON user_request;
+CREATE TRIGGER user_request_stats_update AFTER UPDATE ON user_request
+    REFERENCING OLD TABLE AS old_rows NEW TABLE AS new_rows
+    FOR EACH STATEMENT EXECUTE FUNCTION user_request_stats_trigger();
+DROP TRIGGER IF EXISTS user_request_stats_delete ON user_request;
+CREATE TRIGGER user_request_stats_delete AFTER DELETE ON user_request
+    REFERENCING OLD TABLE AS old_rows
+    FOR EACH STATEMENT EXECUTE FUNCTION user_request_stats_trigger();
+
+DROP TRIGGER IF EXISTS dispatch_plan_stats_insert ON dispatch_plan;
+CREATE TRIGGER dispatch_plan_stats_insert AFTER INSERT ON dispatch_plan
+    REFERENCING NEW TABLE AS new_rows
+    FOR EACH STATEMENT EXECUTE FUNCTION dispatch_plan_stats_trigger();
+DROP TRIGGER IF EXISTS dispatch_plan_stats_update ON dispatch_plan;
+CREATE TRIGGER dispatch_plan_stats_update AFTER UPDATE ON dispatch_plan
+    REFERENCING OLD TABLE AS old_rows NEW TABLE AS new_rows
+    FOR EACH STATEMENT EXECUTE FUNCTION dispatch_plan_stats_trigger();
+DROP TRIGGER IF EXISTS dispatch_plan_stats_delete ON dispatch_plan;
+CREATE TRIGGER dispatch_plan_stats_delete AFTER DELETE ON dispatch_plan
+    REFERENCING OLD TABLE AS old_rows
+    FOR EACH STATEMENT EXECUTE FUNCTION dispatch_plan_stats_trigger();
+
+DROP TRIGGER IF EXISTS request_dispatch_link_stats_insert ON request_dispatch_link;
+CREATE TRIGGER request_dispatch_link_stats_insert AFTER INSERT ON request_dispatch_link
+    REFERENCING NEW TABLE AS new_rows
+    FOR EACH STATEMENT EXECUTE FUNCTION request_dispatch_link_stats_trigger();
+DROP TRIGGER IF EXISTS request_dispatch_link_stats_update ON request_dispatch_link;
+CREATE TRIGGER request_dispatch_link_stats_update AFTER UPDATE ON request_dispatch_link
+    REFERENCING OLD TABLE AS old_rows NEW TABLE AS new_rows
+    FOR EACH STATEMENT EXECUTE FUNCTION request_dispatch_link_stats_trigger();
+DROP TRIGGER IF EXISTS request_dispatch_link_stats_delete ON request_dispatch_link;
+CREATE TRIGGER request_dispatch_link_stats_delete AFTER DELETE ON request_dispatch_link
+    REFERENCING OLD TABLE AS old_rows
+    FOR EACH STATEMENT EXECUTE FUNCTION request_dispatch_link_stats_trigger();
+
+-- 按现有数据初始化统计
+SELECT refresh_dashboard_stats();
@@ -8,6 +8,49 @@ from sqlalchemy import text
 from datetime import datetime
 import json
 import os
+import re
+
+# 美元符号引用的开始标记，如 $$ 或 $body$
+DOLLAR_QUOTE_PATTERN = re.compile(r'\$[A-Za-z_]*\$')
+
+def split_sql_statements(sql_script):
+    """
+    按分号拆分SQL脚本，跳过单引号字符串、--注释和美元符号引用（函数体）中的分号
+
+    只包含注释的片段不作为语句返回
+    """
+    statements = []
+    start = 0
+    i = 0
+    length = len(sql_script)
+    while i < length:
+        char = sql_script[i]
+        if char == "'":
+            # 单引号字符串，''为转义的单引号
+            i += 1
+            while i < length:
+                if sql_script[i] == "'":
+                    if sql_script.startswith("''", i):
+                        i += 2
+                        continue
+                    break
+                i += 1
+        elif sql_script.startswith('--', i):
+            newline = sql_script.find('\n', i)
+            i = length if newline == -1 else newline
+        elif char == '$':
+            match = DOLLAR_QUOTE_PATTERN.match(sql_script, i)
+            if match:
+                end = sql_script.find(match.group(), match.end())
+                i = length if end == -1 else end + len(match.group()) - 1
+        elif char == ';':
+            statements.append(sql_script[start:i])
+            start = i + 1
+        i += 1
+    statements.append(sql_script[start:])
+    
+    return [statement for statement in statements
+            if re.sub(r'--[^\n]*', '', statement).strip()]
 
 def init_db():
     print("开始初始化数据库...")
@@ -35,8 +78,8 @@ def init_db():
         
         # 连接到数据库并执行SQL
         with engine.connect() as connection:
-            # 分割SQL语句并逐一执行
-            statements = sql_script.split(';')
+            # 分割SQL语句并逐一执行（触发器函数体中的分号不拆分）
+            statements = split_sql_statements(sql_script)
             for statement in statements:
                 # 跳过空语句
                 if statement.strip():
@@ -1,4 +1,5 @@
 from .database import Base, engine, SessionLocal, get_db
+from .async_database import async_engine, AsyncSessionLocal, get_async_db
 from .trip import Trip
 from .route import Route
 from .request_dispatch_link import RequestDispatchLink
@@ -4,10 +4,9 @@ import threading
 import os
 import sys
 from datetime import datetime, timedelta
-from sqlalchemy import create_engine, text
+from sqlalchemy import create_engine
 from sqlalchemy.orm import sessionmaker
 from dotenv import load_dotenv
-import json
 import logging
 
 # 添加项目根目录到系统路径
@@ -15,6 +14,12 @@ sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
 
 # 导入响应式调度系统
 from algorithm.responsive_scheduler import ResponsiveScheduler
+from algorithm.trip_batch import TripBatch, to_epoch
+from algorithm.repository import load_pending_requests
+from algorithm.routing.route_cache import RouteCache
+from algorithm.routing.rate_limiter import TokenBucketLimiter
+from algorithm.routing.road_graph import load_road_graph
+from algorithm.routing.travel_matrix import TravelTimeMatrix
 
 # 配置日志
 logging.basicConfig(
@@ -42,54 +47,29 @@ scheduler = ResponsiveScheduler(
     min_samples=2,          # 最小2个样本形成聚类
     max_cluster_radius=5.0, # 最大聚类半径5公里
     max_points_per_route=8, # 每条路线最多8个点
-    amap_key=os.getenv("AMAP_KEY")
+    amap_key=os.getenv("AMAP_KEY"),
+    incremental=True,       # 跨周期保留聚类状态，只处理新增和变化的请求
+    cache_results=True,     # 待处理请求未变化时直接复用上一周期的结果
+    route_cache=RouteCache(), # 与API进程共享的高德API响应缓存（路径由ROUTE_CACHE_PATH指定）
+    route_concurrency=8,    # 最多同时发出8个路线规划请求
+    rate_limiter=TokenBucketLimiter(), # 与API进程共享的QPS和每日配额（AMAP_QPS、AMAP_DAILY_QUOTA）
+    combined_route=True,    # 接送站点统一排序，每个聚类只请求一条路线
+    road_graph=load_road_graph(), # 配置ROAD_GRAPH_PATH时在离线路网上规划，未配置时为None
+    travel_matrix=TravelTimeMatrix() # 与API进程共享的点对行驶时间缓存（TRAVEL_MATRIX_PATH），调度周期内只读，不请求距离API
 )
 
+# 出发时间早于当前时间该小时数的请求视为过期，不再参与聚类
+EXPIRE_AFTER_HOURS = 24
+
 def get_pending_requests():
-    """获取未处理的出行请求"""
+    """获取未处理的出行请求，返回列式的TripBatch"""
     db = SessionLocal()
     try:
-        # 查询未被分配到调度计划的请求，移除时间窗口限制
-        query = text("""
-            SELECT ur.request_id, ur.origin_name, ur.destination_name, 
-                   ur.departure_time, ur.people_count,
-                   ST_AsGeoJSON(ur.origin_location) as origin_location,
-                   ST_AsGeoJSON(ur.destination_location) as destination_location,
-                   ur.submit_time
-            FROM user_request ur
-            LEFT JOIN request_dispatch_link rdl ON ur.request_id = rdl.request_id
-            WHERE rdl.id IS NULL
-            ORDER BY ur.departure_time
-        """)
-        
-        result = db.execute(query)
-        
-        requests = []
-        for row in result:
-            origin_json = json.loads(row.origin_location)
-            dest_json = json.loads(row.destination_location)
-            
-            requests.append({
-                'request_id': row.request_id,
-                'origin_name': row.origin_name,
-                'destination_name': row.destination_name,
-                'departure_time': row.departure_time.isoformat(),
-                'people_count': row.people_count,
-                'origin': {
-                    'lat': origin_json['coordinates'][1],
-                    'lng': origin_json['coordinates'][0]
-                },
-                'destination': {
-                    'lat': dest_json['coordinates'][1],
-                    'lng': dest_json['coordinates'][0]
-                },
-                'submit_time': row.submit_time.isoformat()
-            })
-        
-        return requests
+        # 一次查询取出所有未被分配到调度计划的请求
+        return load_pending_requests(db)
     except Exception as e:
         logger.error(f"获取待处理请求失败: {str(e)}")
-        return []
+        return TripBatch.from_records([])
     finally:
         db.close()
 
@@ -107,6 +87,13 @@ def process_trips():
     logger.info(f"找到 {len(requests)} 个待处理请求")
     
     try:
+        # 淘汰过期请求（数据库时间不带时区，与TripBatch一样按UTC换算）
+        retired = scheduler.incremental_clusterer.retire_before(
+            to_epoch(datetime.now() - timedelta(hours=EXPIRE_AFTER_HOURS))
+        )
+        if retired:
+            logger.info(f"淘汰 {retired} 个过期请求")
+        
         # 使用响应式调度系统处理请求
         result = scheduler.process_requests(requests)
         